@@ -0,0 +1,178 @@
+# This script measures the throughput of proposal_generator.py.
+#
+# It generates seeded synthetic csv files with valid addresses and amounts, generates their pre-proposals
+# as the command line interface does, and times each stage of the generation separately: reading the csv file,
+# validating addresses, parsing amounts, computing schedules, serializing pre-proposals and writing their files.
+# Results are written as json, and can be compared against the results of an earlier run.
+#
+# Example:
+# python benchmark_proposal_generator.py --rows 1000 100000 --output results.json --compare baseline.json
+#
+# This script requires python 3.6 or above
+import io
+import sys
+import csv
+import json
+import os
+import time
+import contextlib
+import random
+import shutil
+import hashlib
+import platform
+import argparse
+import tempfile
+import itertools
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from dateutil.relativedelta import relativedelta
+import proposal_generator
+
+# Stages of the serial proposal generation that are timed separately by proposal_generator.generate_file, in the order they are run.
+# Address validation and amount parsing are timed within the validation of each row, see proposal_generator.timed_row_parser.
+stages:List[str] = ["csv_read", "address_validation", "amount_parsing", "scheduling", "serialization", "file_write"]
+
+# Encode payload as Base58Check string, as used for account addresses.
+def b58encode_check(payload:bytes) -> str:
+	data = payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+	value = int.from_bytes(data, 'big')
+	digits = []
+	while value > 0:
+		value, digit = divmod(value, 58)
+		digits.append(proposal_generator.base58_alphabet[digit])
+	leading_zeros = len(data) - len(data.lstrip(b'\0'))
+	return (proposal_generator.base58_alphabet[0:1] * leading_zeros + bytes(reversed(digits))).decode()
+
+# Returns a random account address, i.e., a Base58Check encoded version byte followed by 32 bytes.
+def random_address(rng:random.Random) -> str:
+	return b58encode_check(bytes([1]) + bytes(rng.getrandbits(8) for _ in range(32)))
+
+# Returns a random amount string in GTU, randomly formatted with or without thousands separators.
+def random_amount(rng:random.Random) -> str:
+	amount = rng.randrange(1, 10**13)
+	(gtu, micro_gtu) = divmod(amount, 1000000)
+	if rng.random() < 0.5:
+		return f"{gtu}.{micro_gtu:06}"
+	else:
+		return f"{gtu:,}.{micro_gtu:06}"
+
+# Write a synthetic csv file with the given number of rows.
+# As in real payout files, a few senders appear in almost every row, and receivers are drawn from a larger pool.
+def generate_csv(filename:str, rows:int, is_welcome:bool, seed:int, num_senders:int = 5, num_receivers:int = 50000) -> None:
+	rng = random.Random(seed)
+	senders = [random_address(rng) for _ in range(num_senders)]
+	receivers = [random_address(rng) for _ in range(min(rows, num_receivers))]
+	with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+		writer = csv.writer(csvfile, delimiter=',')
+		for _ in range(rows):
+			row = [rng.choice(senders), rng.choice(receivers), random_amount(rng)]
+			if not is_welcome:
+				row.append(random_amount(rng))
+			writer.writerow(row)
+
+# Generate the pre-proposals of the given csv file with the command line code path of proposal_generator.py, writing the
+# output files to output_dir, and time its stages with the StageMetrics of --metrics-file.
+# With jobs > 1, rows are generated by worker processes, which are timed as a whole as "parallel_generation".
+# Returns the total time in seconds spent in each stage, and the wall time of the whole run.
+def run_benchmark(csv_filename:str, output_dir:str, is_welcome:bool, jobs:int = 1) -> Tuple[Dict[str, float], float]:
+	config = proposal_generator.get_config()
+	# Use a schedule in the future, such that no releases are skipped
+	initial_release_time = datetime.now().astimezone() + relativedelta(days = +1)
+	config["welcome_release_time"] = initial_release_time
+	config["initial_release_time"] = initial_release_time
+	config["first_rem_release_time"] = initial_release_time + relativedelta(months = +1)
+	arguments = [csv_filename, "--output-dir", output_dir, "--jobs", str(jobs), "--report", "none"]
+	if is_welcome:
+		arguments.append("--welcome")
+	args = proposal_generator.build_argument_parser(config).parse_args(arguments)
+
+	# Start with empty address cache, as in a fresh run of the generator
+	proposal_generator.is_valid_address.cache_clear()
+	metrics = proposal_generator.StageMetrics()
+	output = io.StringIO()
+	start = time.perf_counter()
+	with contextlib.redirect_stdout(output):
+		exit_code = proposal_generator.run_generation(args, config, [csv_filename], metrics, None)
+	total = time.perf_counter() - start
+	if exit_code != 0:
+		raise RuntimeError(f"Generating the pre-proposals of \"{csv_filename}\" failed: {output.getvalue().strip()}")
+	timings = {stage: 0.0 for stage in stages if jobs == 1}
+	for stage, (seconds, _, _) in metrics.stages.items():
+		timings[stage] = seconds
+	return (timings, total)
+
+# Run the benchmark for all combinations of modes and row counts, using a temporary directory for all files.
+def run_all(row_counts:List[int], modes:List[str], seed:int, jobs:int) -> Dict[str, Any]:
+	results = []
+	for mode, rows in itertools.product(modes, row_counts):
+		is_welcome = mode == "welcome"
+		with tempfile.TemporaryDirectory() as directory:
+			csv_filename = os.path.join(directory, f"{mode}_{rows}.csv")
+			generate_csv(csv_filename, rows, is_welcome, seed)
+			output_dir = os.path.join(directory, "output")
+			os.mkdir(output_dir)
+			(timings, total) = run_benchmark(csv_filename, output_dir, is_welcome, jobs)
+			shutil.rmtree(output_dir)
+		results.append({
+			"mode" : mode,
+			"rows" : rows,
+			"stages" : {stage: {"seconds": seconds, "rows_per_second": rows / seconds if seconds > 0 else None} for stage, seconds in timings.items()},
+			"total_seconds" : total,
+			"rows_per_second" : rows / total if total > 0 else None
+		})
+		print(f"{mode} {rows} rows: {total:.3f}s ({', '.join(f'{stage} {seconds:.3f}s' for stage, seconds in timings.items())})", file=sys.stderr)
+	return {
+		"seed" : seed,
+		"jobs" : jobs,
+		"python" : platform.python_version(),
+		"platform" : platform.platform(),
+		"timestamp" : datetime.now().astimezone().isoformat(),
+		"results" : results
+	}
+
+# Compare results against an earlier run and return a description of every stage that got slower by more than tolerance.
+# Stages that took less than min_seconds in both runs are ignored, as their timings are dominated by noise.
+def find_regressions(baseline:Dict[str, Any], current:Dict[str, Any], tolerance:float, min_seconds:float = 0.01) -> List[str]:
+	baseline_results = {(result["mode"], result["rows"]): result for result in baseline["results"]}
+	regressions = []
+	for result in current["results"]:
+		old_result = baseline_results.get((result["mode"], result["rows"]))
+		if old_result is None:
+			continue
+		for stage, timing in result["stages"].items():
+			old_timing = old_result["stages"].get(stage)
+			if old_timing is None or max(timing["seconds"], old_timing["seconds"]) < min_seconds:
+				continue
+			if timing["seconds"] > old_timing["seconds"] * (1 + tolerance):
+				regressions.append(f"{result['mode']} {result['rows']} rows, {stage}: {old_timing['seconds']:.3f}s -> {timing['seconds']:.3f}s")
+	return regressions
+
+# Main function
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the stages of proposal_generator.py on synthetic csv files.")
+	parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000], help="Numbers of csv rows to benchmark (default 1000 100000 1000000).")
+	parser.add_argument("--modes", nargs="+", choices=["welcome", "scheduled"], default=["welcome", "scheduled"], help="Transfer types to benchmark.")
+	parser.add_argument("--seed", type=int, default=42, help="Seed for generating the csv files.")
+	parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes of the generator (default 1, which times all stages separately).")
+	parser.add_argument("--output", type=str, help="Write results to this json file instead of standard output.")
+	parser.add_argument("--compare", type=str, metavar="BASELINE", help="Compare results against an earlier results file, and exit with code 1 on regressions.")
+	parser.add_argument("--tolerance", type=float, default=0.2, help="Relative slowdown of a stage that is reported as regression (default 0.2).")
+	args = parser.parse_args()
+
+	results = run_all(args.rows, args.modes, args.seed, args.jobs)
+	if args.output:
+		with open(args.output, 'w') as outFile:
+			json.dump(results, outFile, indent=4)
+	else:
+		print(json.dumps(results, indent=4))
+
+	if args.compare:
+		with open(args.compare) as baseline_file:
+			regressions = find_regressions(json.load(baseline_file), results, args.tolerance)
+		for regression in regressions:
+			print(f"Regression: {regression}", file=sys.stderr)
+		if regressions:
+			sys.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,51 @@
+# Thin client for the pre-proposal generator daemon, started with: python proposal_generator.py --serve [SOCKET]
+#
+# Takes the same arguments as proposal_generator.py, and sends them to the daemon instead of generating the
+# pre-proposals itself. The output and exit code are the same as when running proposal_generator.py directly.
+# As this script only uses the standard library, it starts much faster than proposal_generator.py.
+#
+# Example:
+# python proposal_client.py --socket /tmp/proposal_generator.sock --welcome payout.csv
+#
+# This script requires python 3.6 or above
+import sys
+import os
+import json
+import socket
+import tempfile
+from typing import Any, Dict, List, Tuple
+
+# Same default as in proposal_generator.py
+default_socket:str = os.environ.get("PROPOSAL_GENERATOR_SOCKET", os.path.join(tempfile.gettempdir(), "proposal_generator.sock"))
+
+# Send a request to the daemon listening on socket_path, and return its response.
+# See ProposalRequestHandler in proposal_generator.py for the fields of requests and responses.
+def send_request(socket_path:str, request:Dict[str, Any]) -> Dict[str, Any]:
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+		connection.connect(socket_path)
+		connection.sendall(json.dumps(request).encode() + b"\n")
+		with connection.makefile('rb') as response:
+			return json.loads(response.readline())
+
+# Returns the socket given by a leading "--socket SOCKET" argument, and the remaining arguments.
+# All other arguments are passed on to the daemon unchanged, such that they are parsed exactly as by proposal_generator.py.
+def split_arguments(arguments:List[str]) -> Tuple[str, List[str]]:
+	if arguments[:1] == ["--socket"] and len(arguments) > 1:
+		return (arguments[1], arguments[2:])
+	return (default_socket, arguments)
+
+# Main function
+def main():
+	(socket_path, arguments) = split_arguments(sys.argv[1:])
+	try:
+		response = send_request(socket_path, {"arguments": arguments, "cwd": os.getcwd()})
+	except (OSError, ValueError) as e:
+		print(f"Error: cannot reach the proposal generator daemon on \"{socket_path}\": {e}")
+		sys.exit(3)
+	for line in response["output"]:
+		print(line)
+	if response["exit_code"] != 0:
+		sys.exit(response["exit_code"])
+
+if __name__ == "__main__":
+	main()
@@ -2,22 +2,47 @@
 #
 # This script requires python 3.6 or above
 #
-# Note: The script uses dateutil and base58, which can be installed using 
+# Note: The script uses dateutil, which can be installed using 
 # "pip install python-dateutil"
-# "pip install base58"
 #
 # Version 0.2.0
 import sys
 import json
+import codecs
 import csv
+import glob
+import gzip
+import lzma
 import os
+import queue
 import re
+import socket
+import socketserver
+import sqlite3
 import argparse
+import contextlib
+import copy
+import cProfile
+import hashlib
+import itertools
+import mmap
+import io
+import tarfile
+import tempfile
+import threading
+import tracemalloc
+import zipfile
+import zlib
+from array import array
+from collections import deque
+from functools import lru_cache, partial
+from time import perf_counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from decimal import *
-from datetime import datetime,date,time
-from typing import Any, Dict, List, Tuple
+from json.encoder import encode_basestring_ascii as encode_json_string
+from datetime import datetime,date,time,timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Pattern, Sequence, Tuple, Union
 from dateutil.relativedelta import relativedelta
-from base58 import b58decode_check
 
 def get_config() -> Dict[str, Any]:
 	return {
@@ -33,6 +58,7 @@ def get_config() -> Dict[str, Any]:
 
 # Class for storing transfer amounts. The amounts are internally stored in microGTU
 class TransferAmount:
+	__slots__ = ("amount",)
 	#max amount in microGTU
 	max_amount:int = 18446744073709551615
 	#regex for valid amount strings using '.' as decimal separator and ',' as thousands separator
@@ -46,23 +72,42 @@ class TransferAmount:
 		self.amount = amount
 
 	# Creates a TransferAmount from an amount string that represents an amount in GTU. 
-	# The string must valid, i.e., satisfy amount_regex or amount_regex_with_1000_sep.
+	# The string must valid, i.e., satisfy amount_regex or amount_regex_with_1000_sep,
+	# where '.' and ',' are replaced by decimal_sep and thousands_sep.
 	@classmethod
 	def from_string(cls, amount_string:str, decimal_sep:str, thousands_sep: str) -> 'TransferAmount':
-		#Convert the separators
-		translation_table = {ord(thousands_sep) : ',', ord(decimal_sep): '.'}
+		return TransferAmount(cls.parse_micro_GTU(amount_string, decimal_sep, thousands_sep))
+
+	# Compiled pattern accepting the amount strings of amount_regex and amount_regex_with_1000_sep for the given separators.
+	# The integral digits (possibly with thousands separators) and the fractional digits are captured in two groups.
+	@staticmethod
+	@lru_cache(maxsize=None)
+	def amount_pattern(decimal_sep:str, thousands_sep:str) -> Pattern[str]:
+		decimal_sep = re.escape(decimal_sep)
+		thousands_sep = re.escape(thousands_sep)
+		return re.compile(f"([0-9]+|[0-9]{{1,3}}(?:{thousands_sep}[0-9]{{3}})*)(?:{decimal_sep}([0-9]{{1,6}}))?")
+
+	# Converts an amount string in GTU to microGTU, validating its format and range in a single pass.
+	# Only uses integer arithmetic on the integral and fractional digits. Raises the same errors as from_string.
+	@classmethod
+	def parse_micro_GTU(cls, amount_string:str, decimal_sep:str, thousands_sep: str) -> int:
 		amount_string = amount_string.strip()
-		amount_org_string = amount_string
-		#Check validity of amount string
-		if not bool(re.match(cls.amount_regex, amount_string)) and not bool(re.match(cls.amount_regex_with_1000_sep, amount_string)):
-			raise ValueError(f"\"{amount_org_string}\" is not a valid amount string.")
-		amount_string = amount_string.replace(',', '')
-		#Convert to microGTU
-		try: 
-			amount = int(Decimal(amount_string) * 1000000)
-		except: #this should not happen
-			raise ValueError("Amount string \"{amount_org_string}\" could not be converted.")
-		return TransferAmount(amount)
+		match = cls.amount_pattern(decimal_sep, thousands_sep).fullmatch(amount_string)
+		if match is None:
+			raise ValueError(f"\"{amount_string}\" is not a valid amount string.")
+		(integral, fractional) = match.groups()
+		amount = int(integral.replace(thousands_sep, '')) * 1000000
+		if fractional is not None:
+			amount += int(fractional) * 10**(6 - len(fractional))
+		if amount <= 0 or amount > cls.max_amount:
+			raise ValueError(f"Amount {amount} not in valid range (0,{cls.max_amount}]")
+		return amount
+
+	# Converts a sequence of amount strings in GTU to an array of amounts in microGTU.
+	@classmethod
+	def parse_many(cls, amount_strings:Iterable[str], decimal_sep:str, thousands_sep: str) -> array:
+		parse = cls.parse_micro_GTU
+		return array('Q', (parse(amount_string, decimal_sep, thousands_sep) for amount_string in amount_strings))
 
 	# String representation of a TransferAmount
 	def __str__(self):
@@ -105,6 +150,49 @@ class TransferAmount:
 			amount_list.append(TransferAmount(last_amount))
 			return amount_list
 		
+# Templates of the fixed layout of pre-proposals, as written by json.dump(data, outFile, indent=4).
+# Only the sender, receiver, expiry and schedule are filled in, instead of encoding the whole nested dict.
+pre_proposal_head_template:str = (
+	'{\n'
+	'    "sender": %s,\n'
+	'    "nonce": "",\n'
+	'    "energyAmount": "",\n'
+	'    "estimatedFee": "",\n'
+	'    "expiry": {\n'
+	'        "@type": "bigint",\n'
+	'        "value": %d\n'
+	'    },\n'
+	'    "transactionKind": 19,\n'
+	'    "payload": {\n'
+	'        "toAddress": %s,\n'
+	'        "schedule": [')
+pre_proposal_release_template:str = (
+	'\n'
+	'            {\n'
+	'                "amount": %d,\n'
+	'                "timestamp": %d\n'
+	'            }')
+pre_proposal_tail:str = (
+	'\n'
+	'        ]\n'
+	'    },\n'
+	'    "signatures": {}\n'
+	'}')
+pre_proposal_empty_schedule_tail:str = (
+	']\n'
+	'    },\n'
+	'    "signatures": {}\n'
+	'}')
+
+# Returns the json of a pre-proposal with the given fields and releases, given as (amount, timestamp) tuples.
+# The result is exactly the same as json.dumps(data, indent=4) for the corresponding ScheduledPreProposal.
+def pre_proposal_json(sender_address:str, receiver_address:str, expiry:int, releases:Iterable[Tuple[int, int]]) -> str:
+	head = pre_proposal_head_template % (encode_json_string(sender_address), expiry, encode_json_string(receiver_address))
+	schedule = ",".join([pre_proposal_release_template % release for release in releases])
+	if not schedule:
+		return head + pre_proposal_empty_schedule_tail
+	return head + schedule + pre_proposal_tail
+
 # Class for generating scheduled pre-proposals and saving them as json files.
 # A pre-proposal is a proposal with empty nonce, energy and fee amounts.
 # The desktop wallet can convert them to proper proposals.
@@ -136,70 +224,1478 @@ class ScheduledPreProposal:
 		} 
 		self.data["payload"]["schedule"].append(release)
 
+	# Add a release with an amount in microGTU at a timestamp in milliseconds to the schedule.
+	def add_scheduled_release(self, amount: int, timestamp: int):
+		self.data["payload"]["schedule"].append({"amount": amount, "timestamp": timestamp})
+
 	# Write pre-proposal to json file with given filename.
 	def write_json(self, filename: str):
 		with open(filename, 'w') as outFile:
-			json.dump(self.data, outFile, indent=4)
+			outFile.write(self.to_json())
 
+	# Digest of everything in the pre-proposal that is derived from its csv row and the release schedule, i.e., all but the expiry.
+	def input_digest(self) -> str:
+		content = json.dumps([self.data["sender"], self.data["payload"]["toAddress"], self.data["payload"]["schedule"]])
+		return hashlib.sha256(content.encode()).hexdigest()
 
-# Read csv file and return a list with one entry for each row in csv.
-def csv_to_list(filename:str, is_welcome:bool, decimal_sep:str, thousands_sep:str, csv_delimiter:str) -> List[Any]:
+	# Return the pre-proposal as json string, formatted as json.dumps(self.data, indent=indent).
+	# With the default indent=4, this is done with the precompiled pre-proposal templates.
+	# With indent=None, the pre-proposal is serialized on a single line.
+	def to_json(self, indent:Optional[int] = 4) -> str:
+		if indent != 4:
+			return json.dumps(self.data, indent=indent)
+		schedule = self.data["payload"]["schedule"]
+		return pre_proposal_json(self.data["sender"], self.data["payload"]["toAddress"], self.data["expiry"]["value"],
+			[(release["amount"], release["timestamp"]) for release in schedule])
+
+# Pre-proposal that has already been serialized to json, e.g., by a worker process.
+class SerializedPreProposal:
+	def __init__(self, content: str, indent:Optional[int] = 4, input_digest:Optional[str] = None):
+		self.content = content
+		self.indent = indent
+		self.known_input_digest = input_digest
+
+	# Digest of the pre-proposal as computed by ScheduledPreProposal.input_digest
+	def input_digest(self) -> str:
+		if self.known_input_digest is None:
+			pre_proposal = ScheduledPreProposal("", "", datetime.now())
+			pre_proposal.data = json.loads(self.content)
+			self.known_input_digest = pre_proposal.input_digest()
+		return self.known_input_digest
+
+	# Write pre-proposal to json file with given filename.
+	def write_json(self, filename: str):
+		with open(filename, 'w') as outFile:
+			outFile.write(self.content)
+
+	# Return the pre-proposal as json string with the given indentation.
+	def to_json(self, indent:Optional[int] = 4) -> str:
+		if indent == self.indent:
+			return self.content
+		return json.dumps(json.loads(self.content), indent=indent)
+
+# Release amounts of a transfer in run-length form: an initial release of first_amount, followed by step_count releases
+# of step_amount and a last release of last_amount, if any. The memory of a schedule does not depend on its number of releases.
+class CompactSchedule:
+	__slots__ = ("first_amount", "step_amount", "step_count", "last_amount")
+
+	def __init__(self, first_amount:int, step_amount:int = 0, step_count:int = 0, last_amount:Optional[int] = None):
+		self.first_amount = first_amount
+		self.step_amount = step_amount
+		self.step_count = step_count
+		self.last_amount = last_amount
+
+	# Returns the schedule of initial_amount followed by remaining_amount split into num_releases-1 releases, where the
+	# skipped releases are added to the initial one. The amounts and errors are exactly those of amounts_to_scheduled_list.
+	@classmethod
+	def split(cls, initial_amount:int, remaining_amount:int, num_releases:int, skipped_releases:int) -> 'CompactSchedule':
+		if skipped_releases >= num_releases:
+			raise ValueError("The number of skipped releases must be less than total number of releases.")
+		parts = num_releases - 1
+		if parts <= 0:
+			raise AssertionError(f"Cannot split into {parts} parts")
+		step_amount = remaining_amount // parts
+		if step_amount <= 0:
+			raise AssertionError(f"Cannot split {remaining_amount} into {parts} parts, amount is too small")
+		if skipped_releases >= parts:
+			# all releases are skipped, including the last one
+			schedule = cls(initial_amount + remaining_amount)
+		else:
+			schedule = cls(initial_amount + skipped_releases*step_amount, step_amount, parts - 1 - skipped_releases, remaining_amount - (parts-1)*step_amount)
+		if schedule.first_amount > TransferAmount.max_amount:
+			raise ValueError(f"Amount {schedule.first_amount} not in valid range (0,{TransferAmount.max_amount}]")
+		return schedule
+
+	def __len__(self) -> int:
+		return 1 + self.step_count + (self.last_amount is not None)
+
+	# Yields all release amounts in order.
+	def amounts(self) -> Iterator[int]:
+		yield self.first_amount
+		yield from itertools.repeat(self.step_amount, self.step_count)
+		if self.last_amount is not None:
+			yield self.last_amount
+
+	# Yields the (amount, timestamp) tuples of all releases, with the given release timestamps.
+	def releases(self, timestamps:Iterable[int]) -> Iterator[Tuple[int, int]]:
+		return zip(self.amounts(), timestamps)
+
+# Pre-proposal whose releases are kept as CompactSchedule, with the release timestamps shared by all transfers with
+# the same schedule. Releases are only expanded while the pre-proposal is serialized, to the same json as the
+# ScheduledPreProposal with the same releases.
+class CompactPreProposal:
+	__slots__ = ("sender", "receiver", "expiry", "schedule", "timestamps")
+
+	def __init__(self, sender_address:str, receiver_address:str, expiry:datetime, schedule:CompactSchedule, timestamps:Sequence[int]):
+		self.sender = sender_address
+		self.receiver = receiver_address
+		self.expiry = int(expiry.timestamp())
+		self.schedule = schedule
+		self.timestamps = timestamps
+
+	def releases(self) -> Iterator[Tuple[int, int]]:
+		return self.schedule.releases(self.timestamps)
+
+	# Returns the ScheduledPreProposal with all releases of this pre-proposal.
+	def expand(self) -> ScheduledPreProposal:
+		pre_proposal = ScheduledPreProposal(self.sender, self.receiver, datetime.fromtimestamp(self.expiry, timezone.utc))
+		for amount, timestamp in self.releases():
+			pre_proposal.add_scheduled_release(amount, timestamp)
+		return pre_proposal
+
+	# Digest as computed by ScheduledPreProposal.input_digest, without creating a dict for each release.
+	def input_digest(self) -> str:
+		digest = hashlib.sha256(f"[{encode_json_string(self.sender)}, {encode_json_string(self.receiver)}, [".encode())
+		digest.update(", ".join(['{"amount": %d, "timestamp": %d}' % release for release in self.releases()]).encode())
+		digest.update(b"]]")
+		return digest.hexdigest()
+
+	# Write pre-proposal to json file with given filename.
+	def write_json(self, filename: str):
+		with open(filename, 'w') as outFile:
+			outFile.write(self.to_json())
+
+	# Return the pre-proposal as json string, formatted as ScheduledPreProposal.to_json.
+	def to_json(self, indent:Optional[int] = 4) -> str:
+		if indent != 4:
+			return self.expand().to_json(indent)
+		return pre_proposal_json(self.sender, self.receiver, self.expiry, self.releases())
+
+
+# Buffer size used when writing all pre-proposals into a single output file.
+output_buffer_size:int = 1 << 20
+
+# File name suffixes of the compressions supported by --compress
+compression_suffixes:Dict[str, str] = {"gzip": ".gz", "xz": ".xz"}
+
+# Returns the file name suffix of pre-proposal files or containers written with the given compression, if any.
+def compression_suffix(compression:Optional[str]) -> str:
+	return compression_suffixes[compression] if compression is not None else ""
+
+# Returns a stream that compresses everything written to it into raw_file, with level 0 to 9 for both compressions.
+# Closing the stream does not close raw_file.
+def compressed_stream(raw_file, compression:str, level:int):
+	if compression == "gzip":
+		# Without a timestamp, identical pre-proposals are compressed to identical files
+		return gzip.GzipFile(fileobj=raw_file, mode='wb', compresslevel=level, mtime=0)
+	return lzma.LZMAFile(raw_file, 'wb', preset=level)
+
+# Stream into which compressed containers are written, compressing the data written for each entry as a separate gzip member
+# or xz stream (see compressed_stream). Decompressing the whole file gives the container, as both formats allow concatenated
+# members, and a single entry can be decompressed on its own from the offset of its member (see read_container_entry).
+# Positions are positions in the decompressed container. The stream cannot seek, such that zip archives are written with data descriptors.
+class CompressedMembers:
+	def __init__(self, raw_file, compression:str, level:int):
+		self.raw_file = raw_file
+		self.compression = compression
+		self.level = level
+		self.position = 0
+		self.member = None
+		self.member_offset = 0
+		self.member_start = 0
+
+	def write(self, data:bytes) -> int:
+		if self.member is None:
+			self.member_offset = self.raw_file.tell()
+			self.member_start = self.position
+			self.member = compressed_stream(self.raw_file, self.compression, self.level)
+		self.member.write(data)
+		self.position += len(data)
+		return len(data)
+
+	# Finish the current member, and return its offset and length in the compressed file and its start in the container.
+	def end_member(self) -> Tuple[int, int, int]:
+		if self.member is None:
+			return (self.raw_file.tell(), 0, self.position)
+		self.member.close()
+		self.member = None
+		return (self.member_offset, self.raw_file.tell() - self.member_offset, self.member_start)
+
+	def tell(self) -> int:
+		return self.position
+
+	def seekable(self) -> bool:
+		return False
+
+	def seek(self, *args) -> int:
+		raise io.UnsupportedOperation("seek")
+
+	def flush(self) -> None:
+		pass
+
+	def close(self) -> None:
+		self.end_member()
+
+# Returns the json of a pre-proposal from an open container file, given its entry in the index of the container.
+# In compressed containers, only the member of the entry is read and decompressed.
+def read_container_entry(container, entry:Dict[str, Any]) -> bytes:
+	if "member_offset" not in entry:
+		container.seek(entry["offset"])
+		return container.read(entry["length"])
+	container.seek(entry["member_offset"])
+	member = container.read(entry["member_length"])
+	member = gzip.decompress(member) if member.startswith(b"\x1f\x8b") else lzma.decompress(member)
+	start = entry["offset"] - entry["member_start"]
+	return member[start:start + entry["length"]]
+
+# Open a pre-proposal file or container for reading, decompressing it if its name has the suffix of a compression.
+def open_output(filename:str, mode:str = 'rb', **kwargs):
+	if filename.endswith(compression_suffixes["gzip"]):
+		return gzip.open(filename, mode, **kwargs)
+	if filename.endswith(compression_suffixes["xz"]):
+		return lzma.open(filename, mode, **kwargs)
+	return open(filename, mode, **kwargs)
+
+# Writes each pre-proposal to its own json file. This is the default output mode.
+# If fsync_batch is positive, written files are closed right away and synced to disk in batches of fsync_batch files,
+# such that at most one file is open at a time, whatever the batch size.
+class ProposalFileWriter:
+	# indentation of the json written for each pre-proposal
+	indent:Optional[int] = 4
+
+	def __init__(self, fsync_batch:int = 0):
+		self.fsync_batch = fsync_batch
+		# Names of written files that are not synced yet, with the function to call once they are
+		self.unsynced:List[Tuple[str, Optional[Callable[[], None]]]] = []
+
+	def __enter__(self) -> 'ProposalFileWriter':
+		return self
+
+	def __exit__(self, *exc_info) -> None:
+		self.close()
+
+	# Write pre-proposal with given entry name, and call on_written once it is completely written.
+	def write(self, name:str, pre_proposal, on_written:Optional[Callable[[], None]] = None) -> None:
+		if self.fsync_batch <= 0:
+			pre_proposal.write_json(name)
+			if on_written is not None:
+				on_written()
+			return
+		pre_proposal.write_json(name)
+		self.add_unsynced(name, on_written)
+
+	# Record a written file, and sync the batch once it is full.
+	def add_unsynced(self, name:str, on_written:Optional[Callable[[], None]]) -> None:
+		self.unsynced.append((name, on_written))
+		if len(self.unsynced) >= self.fsync_batch:
+			self.sync()
+
+	# Sync all written files to disk, reopening each of them, as files are closed once they are written.
+	def sync(self) -> None:
+		unsynced = self.unsynced
+		self.unsynced = []
+		for name, on_written in unsynced:
+			try:
+				# Windows can only sync files that are open for writing
+				fd = os.open(name, os.O_RDWR if os.name == "nt" else os.O_RDONLY)
+				try:
+					os.fsync(fd)
+				finally:
+					os.close(fd)
+			except OSError as error:
+				if error.filename is None:
+					error.filename = name
+				raise
+			if on_written is not None:
+				on_written()
+
+	def close(self) -> None:
+		self.sync()
+
+# Writes each pre-proposal to its own json file, compressed with compression and level (see compressed_stream),
+# and counts the bytes of the json before and after compression.
+class CompressedFileWriter(ProposalFileWriter):
+	def __init__(self, compression:str, level:int, fsync_batch:int = 0):
+		super().__init__(fsync_batch)
+		self.compression = compression
+		self.level = level
+		self.uncompressed_bytes = 0
+		self.compressed_bytes = 0
+
+	def write(self, name:str, pre_proposal, on_written:Optional[Callable[[], None]] = None) -> None:
+		content = pre_proposal.to_json(indent=self.indent).encode()
+		with open(name, 'wb') as outFile:
+			with compressed_stream(outFile, self.compression, self.level) as stream:
+				stream.write(content)
+			self.uncompressed_bytes += len(content)
+			self.compressed_bytes += outFile.tell()
+		if self.fsync_batch <= 0:
+			if on_written is not None:
+				on_written()
+			return
+		self.add_unsynced(name, on_written)
+
+# Base class for writers that stream all pre-proposals into one container file.
+# Next to the container, an index file is written with one json line per pre-proposal,
+# containing its number, name, and the offset and length of its json in the container.
+# This allows extracting a single pre-proposal without reading the whole container.
+# If compression is set, each entry is compressed as a separate member (see CompressedMembers), and offsets in the index are
+# offsets in the decompressed container. The index also has the offset and length of the member of each entry and its start
+# in the decompressed container, such that single entries are still extracted without decompressing the whole container.
+# The bytes of the container before and after compression are counted on close.
+# If fsync_batch is positive, the container is synced to disk when it is closed.
+class ContainerWriter(ProposalFileWriter):
+	def __init__(self, filename:str, fsync_batch:int = 0, compression:Optional[str] = None, level:int = 6):
+		super().__init__(fsync_batch)
+		self.filename = filename
+		self.index_filename = filename + ".index"
+		self.count = 0
+		self.uncompressed_bytes = 0
+		self.compressed_bytes = 0
+		self.raw_file = open(filename, 'wb', buffering=output_buffer_size)
+		try:
+			self.file = self.raw_file if compression is None else CompressedMembers(self.raw_file, compression, level)
+			self.index_file = open(self.index_filename, 'w', buffering=output_buffer_size)
+		except:
+			self.raw_file.close()
+			raise
+
+	def write(self, name:str, pre_proposal, on_written:Optional[Callable[[], None]] = None) -> None:
+		self.count += 1
+		(offset, length) = self.write_entry(name, pre_proposal)
+		entry = {"index": self.count, "name": name, "offset": offset, "length": length}
+		if self.file is not self.raw_file:
+			(entry["member_offset"], entry["member_length"], entry["member_start"]) = self.file.end_member()
+		self.index_file.write(json.dumps(entry) + "\n")
+		if on_written is not None:
+			on_written()
+
+	# Write a single entry to the container and return the offset and length of its json.
+	def write_entry(self, name:str, pre_proposal) -> Tuple[int, int]:
+		raise NotImplementedError()
+
+	def close(self) -> None:
+		try:
+			try:
+				if self.file is not self.raw_file:
+					self.uncompressed_bytes = self.file.tell()
+					self.file.close()
+				self.compressed_bytes = self.raw_file.tell()
+				if self.fsync_batch > 0:
+					self.raw_file.flush()
+					os.fsync(self.raw_file.fileno())
+			finally:
+				self.raw_file.close()
+		finally:
+			self.index_file.close()
+
+# Writes all pre-proposals into a single JSON Lines file.
+# Each line is an object {"index": ..., "name": ..., "proposal": ...} with the pre-proposal on a single line.
+class JsonLinesWriter(ContainerWriter):
+	indent:Optional[int] = None
+
+	def __init__(self, filename:str, fsync_batch:int = 0, compression:Optional[str] = None, level:int = 6):
+		super().__init__(filename, fsync_batch, compression, level)
+		self.offset = 0
+
+	def write_entry(self, name:str, pre_proposal) -> Tuple[int, int]:
+		prefix = f'{{"index": {self.count}, "name": {json.dumps(name)}, "proposal": '.encode()
+		content = pre_proposal.to_json(indent=self.indent).encode()
+		self.file.write(prefix + content + b"}\n")
+		offset = self.offset + len(prefix)
+		self.offset += len(prefix) + len(content) + 2
+		return (offset, len(content))
+
+# Writes all pre-proposals into an uncompressed tar archive, using the same names and content as the individual files.
+class TarWriter(ContainerWriter):
+	indent:Optional[int] = 4
+
+	def __init__(self, filename:str, fsync_batch:int = 0, compression:Optional[str] = None, level:int = 6):
+		super().__init__(filename, fsync_batch, compression, level)
+		self.archive = tarfile.open(fileobj=self.file, mode='w', format=tarfile.PAX_FORMAT)
+		self.mtime = int(datetime.now().timestamp())
+
+	def write_entry(self, name:str, pre_proposal) -> Tuple[int, int]:
+		content = pre_proposal.to_json(indent=self.indent).encode()
+		info = tarfile.TarInfo(name)
+		info.size = len(content)
+		info.mtime = self.mtime
+		self.archive.addfile(info, io.BytesIO(content))
+		# The archive offset is now at the end of the padded data of the entry.
+		padded_size = -(-len(content) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+		return (self.archive.offset - padded_size, len(content))
+
+	def close(self) -> None:
+		try:
+			self.archive.close()
+		finally:
+			super().close()
+
+# Writes all pre-proposals into an uncompressed zip archive, using the same names and content as the individual files.
+class ZipWriter(ContainerWriter):
+	indent:Optional[int] = 4
+
+	def __init__(self, filename:str, fsync_batch:int = 0, compression:Optional[str] = None, level:int = 6):
+		super().__init__(filename, fsync_batch, compression, level)
+		self.archive = zipfile.ZipFile(self.file, mode='w', compression=zipfile.ZIP_STORED)
+
+	def write_entry(self, name:str, pre_proposal) -> Tuple[int, int]:
+		content = pre_proposal.to_json(indent=self.indent).encode()
+		self.archive.writestr(name, content)
+		info = self.archive.getinfo(name)
+		# The entry data is stored right after the local file header, which has a fixed size plus name and extra field.
+		offset = info.header_offset + zipfile.sizeFileHeader + len(info.filename.encode()) + len(info.extra)
+		return (offset, len(content))
+
+	def close(self) -> None:
+		try:
+			self.archive.close()
+		finally:
+			super().close()
+
+# Writes pre-proposals with another writer in a background thread, such that generation continues while files are written.
+# Pre-proposals are serialized before they are passed to the thread through a bounded queue,
+# which limits the memory used by pre-proposals waiting to be written.
+# The first write error is raised by the next call to write or close, and all later pre-proposals are discarded.
+# Errors other than IOError, e.g., of on_written, are kept the same way, such that the thread never stops before close
+# and write never blocks on a full queue.
+class BackgroundWriter(ProposalFileWriter):
+	def __init__(self, writer:ProposalFileWriter, queue_size:int):
+		self.writer = writer
+		self.indent = writer.indent
+		self.queue:queue.Queue = queue.Queue(maxsize=queue_size)
+		self.error:Optional[Exception] = None
+		self.thread = threading.Thread(target=self.run, name="BackgroundWriter", daemon=True)
+		self.thread.start()
+
+	def run(self) -> None:
+		while True:
+			item = self.queue.get()
+			if item is None:
+				break
+			if self.error is not None:
+				continue
+			(name, pre_proposal, on_written) = item
+			try:
+				self.writer.write(name, pre_proposal, on_written)
+			except Exception as error:
+				self.error = error
+		try:
+			self.writer.close()
+		except Exception as error:
+			if self.error is None:
+				self.error = error
+
+	def write(self, name:str, pre_proposal, on_written:Optional[Callable[[], None]] = None) -> None:
+		if self.error is not None:
+			raise self.error
+		if not isinstance(pre_proposal, SerializedPreProposal):
+			pre_proposal = SerializedPreProposal(pre_proposal.to_json(indent=self.indent), self.indent)
+		self.queue.put((name, pre_proposal, on_written))
+
+	def close(self) -> None:
+		if self.thread.is_alive():
+			self.queue.put(None)
+			self.thread.join()
+		if self.error is not None:
+			raise self.error
+
+# Manifest of the sha256 digests of the pre-proposals generated from a csv file, recorded while they are written,
+# such that integrity checks and approvals never need to read the pre-proposals again.
+# The digests are written to prefix.sha256 in the format of sha256sum. Only uncompressed pre-proposal files can be checked with
+# "sha256sum -c" in the output folder, as the names of pre-proposals in a jsonl, zip or tar container are those of their entries,
+# and compressed files are listed by their name after decompression.
+# Once all pre-proposals are written, prefix.merkle.json is written with the number of pre-proposals, the digest of the sha256 file
+# and the Merkle root over all pre-proposals in row order. The root is the Merkle Tree Hash of RFC 6962, with the leaf
+# "<name>\0<digest>" for each pre-proposal, and is computed incrementally from the roots of at most log2(n) complete subtrees.
+# Digests are always digests of the json of the pre-proposals, whatever the output format and compression.
+class DigestManifest:
+	def __init__(self, prefix:str):
+		self.filename = prefix + ".sha256"
+		self.root_filename = prefix + ".merkle.json"
+		# The root of an earlier run must not be taken for the root of this run if it fails
+		try:
+			os.remove(self.root_filename)
+		except FileNotFoundError:
+			pass
+		self.file = open(self.filename, 'w', newline='\n', buffering=output_buffer_size)
+		self.file_digest = hashlib.sha256()
+		self.count = 0
+		# Sizes and hashes of the complete subtrees of the leaves so far, in decreasing size
+		self.subtrees:List[Tuple[int, bytes]] = []
+
+	# Record the hex digest of the pre-proposal written with the given name.
+	def add(self, name:str, digest:str) -> None:
+		(name, extension) = os.path.splitext(os.path.basename(name))
+		# Digests of compressed files are digests of their json, i.e., of the decompressed file
+		if extension not in compression_suffixes.values():
+			name += extension
+		line = f"{digest}  {name}\n"
+		self.file.write(line)
+		self.file_digest.update(line.encode())
+		self.count += 1
+		size = 1
+		node = hashlib.sha256(b"\0" + name.encode() + b"\0" + digest.encode()).digest()
+		while self.subtrees and self.subtrees[-1][0] == size:
+			node = hashlib.sha256(b"\1" + self.subtrees.pop()[1] + node).digest()
+			size *= 2
+		self.subtrees.append((size, node))
+
+	# Returns the Merkle root of all recorded pre-proposals as hex string.
+	def root(self) -> str:
+		if not self.subtrees:
+			return hashlib.sha256(b"").hexdigest()
+		node = self.subtrees[-1][1]
+		for _, subtree in reversed(self.subtrees[:-1]):
+			node = hashlib.sha256(b"\1" + subtree + node).digest()
+		return node.hex()
+
+	# Close the sha256 file and write the Merkle root, once all pre-proposals are written.
+	def finish(self) -> None:
+		self.close()
+		root = {
+			"algorithm" : "sha256",
+			"tree" : "RFC 6962",
+			"proposals" : self.count,
+			"root" : self.root(),
+			"digests_file" : os.path.basename(self.filename),
+			"digests_file_sha256" : self.file_digest.hexdigest()
+		}
+		with open(self.root_filename, 'w') as root_file:
+			json.dump(root, root_file, indent=4)
+
+	def close(self) -> None:
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+# Writes pre-proposals with another writer and records the digest of each written pre-proposal in a DigestManifest.
+# Pre-proposals are serialized once, and the digest is computed from the same json that is written.
+class DigestingWriter(ProposalFileWriter):
+	def __init__(self, writer:ProposalFileWriter, digests:DigestManifest):
+		self.writer = writer
+		self.indent = writer.indent
+		self.digests = digests
+
+	def write(self, name:str, pre_proposal, on_written:Optional[Callable[[], None]] = None) -> None:
+		if not isinstance(pre_proposal, SerializedPreProposal) or pre_proposal.indent != self.indent:
+			pre_proposal = SerializedPreProposal(pre_proposal.to_json(indent=self.indent), self.indent)
+		self.writer.write(name, pre_proposal, on_written)
+		self.digests.add(name, content_digest(pre_proposal.content))
+
+	def close(self) -> None:
+		try:
+			self.writer.close()
+		finally:
+			self.digests.close()
+
+# Writer classes for the supported output formats.
+output_writers = {
+	"jsonl" : JsonLinesWriter,
+	"tar" : TarWriter,
+	"zip" : ZipWriter
+}
+
+# Open the writer for the given output format. For container formats, all pre-proposals are written to container_filename.
+# If fsync_batch is positive, written files are synced to disk in batches of that many files.
+# If compression is set, each pre-proposal file or the whole container is compressed with the given level.
+def open_writer(output_format:str, container_filename:str, fsync_batch:int = 0, compression:Optional[str] = None, level:int = 6) -> ProposalFileWriter:
+	if output_format == "files":
+		if compression is not None:
+			return CompressedFileWriter(compression, level, fsync_batch)
+		return ProposalFileWriter(fsync_batch)
+	return output_writers[output_format](container_filename, fsync_batch, compression, level)
+
+# Read a single pre-proposal with the given name from a container written by a ContainerWriter,
+# using its index file to only read that pre-proposal.
+def extract_proposal(container_filename:str, name:str) -> Dict[str, Any]:
+	with open(container_filename + ".index") as index_file:
+		for line in index_file:
+			entry = json.loads(line)
+			if entry["name"] == name:
+				with open(container_filename, 'rb') as container:
+					return json.loads(read_container_entry(container, entry))
+	raise KeyError(f"No pre-proposal named \"{name}\" in \"{container_filename}\".")
+
+
+# Collects wall time, number of calls and peak memory for each stage of the generation pipeline.
+# Stages are instrumented by wrapping functions and iterators with timed and timed_iter.
+# Generation without metrics uses the functions and iterators directly, so instrumentation has no overhead when disabled.
+class StageMetrics:
+	def __init__(self, trace_memory:bool = False):
+		# Maps stage name to [seconds, calls, peak traced memory in bytes]
+		self.stages:Dict[str, List[Any]] = {}
+		# Memory can only be measured per stage if the peak of traced memory can be reset
+		self.trace_memory = trace_memory and hasattr(tracemalloc, "reset_peak")
+		# Stages can be recorded by several threads when csv files are processed concurrently
+		self.lock = threading.Lock()
+
+	def start(self) -> float:
+		if self.trace_memory:
+			tracemalloc.reset_peak()
+		return perf_counter()
+
+	def add(self, name:str, start:float, calls:int = 1) -> None:
+		seconds = perf_counter() - start
+		with self.lock:
+			stage = self.stages.setdefault(name, [0.0, 0, None])
+			stage[0] += seconds
+			stage[1] += calls
+			if self.trace_memory:
+				peak = tracemalloc.get_traced_memory()[1]
+				stage[2] = peak if stage[2] is None else max(stage[2], peak)
+
+	# Returns function wrapped such that all its calls are recorded as stage name.
+	def timed(self, name:str, function):
+		def timed_function(*args, **kwargs):
+			start = self.start()
+			try:
+				return function(*args, **kwargs)
+			finally:
+				self.add(name, start)
+		return timed_function
+
+	# Yields the elements of iterable, recording the time spent producing each element as stage name.
+	def timed_iter(self, name:str, iterable:Iterable[Any]) -> Iterator[Any]:
+		iterator = iter(iterable)
+		while True:
+			start = self.start()
+			try:
+				element = next(iterator)
+			except StopIteration:
+				self.add(name, start, calls=0)
+				return
+			self.add(name, start)
+			yield element
+
+	# Returns the peak resident set size of this process in bytes, or None if not available on this platform.
+	@staticmethod
+	def peak_rss() -> Optional[int]:
+		try:
+			import resource
+		except ImportError:
+			return None
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+		return peak if sys.platform == "darwin" else peak * 1024
+
+	# Returns a table with the metrics of all stages.
+	def summary(self) -> str:
+		lines = [f"{'Stage':<24}{'Seconds':>12}{'Calls':>12}{'Peak memory':>16}"]
+		for name, (seconds, calls, peak) in self.stages.items():
+			peak_string = "-" if peak is None else f"{peak / 2**20:.1f} MiB"
+			lines.append(f"{name:<24}{seconds:>12.3f}{calls:>12}{peak_string:>16}")
+		peak_rss = self.peak_rss()
+		if peak_rss is not None:
+			lines.append(f"Peak resident memory: {peak_rss / 2**20:.1f} MiB")
+		return "\n".join(lines)
+
+	def to_json(self) -> Dict[str, Any]:
+		return {
+			"stages" : {name: {"seconds": seconds, "calls": calls, "peak_memory_bytes": peak} for name, (seconds, calls, peak) in self.stages.items()},
+			"peak_rss_bytes" : self.peak_rss()
+		}
+
+	# Returns the metrics in the Prometheus text exposition format, as read by the node exporter textfile collector.
+	def to_prometheus(self) -> str:
+		lines = [
+			"# HELP proposal_generator_stage_seconds_total Wall time spent in each stage of the pre-proposal generation.",
+			"# TYPE proposal_generator_stage_seconds_total counter"
+		]
+		lines += [f'proposal_generator_stage_seconds_total{{stage="{name}"}} {seconds}' for name, (seconds, _, _) in self.stages.items()]
+		lines += [
+			"# HELP proposal_generator_stage_calls_total Number of calls of each stage of the pre-proposal generation.",
+			"# TYPE proposal_generator_stage_calls_total counter"
+		]
+		lines += [f'proposal_generator_stage_calls_total{{stage="{name}"}} {calls}' for name, (_, calls, _) in self.stages.items()]
+		if self.trace_memory:
+			lines += [
+				"# HELP proposal_generator_stage_peak_memory_bytes Peak traced memory during each stage of the pre-proposal generation.",
+				"# TYPE proposal_generator_stage_peak_memory_bytes gauge"
+			]
+			lines += [f'proposal_generator_stage_peak_memory_bytes{{stage="{name}"}} {peak}' for name, (_, _, peak) in self.stages.items() if peak is not None]
+		peak_rss = self.peak_rss()
+		if peak_rss is not None:
+			lines += [
+				"# HELP proposal_generator_peak_rss_bytes Peak resident set size of the pre-proposal generation.",
+				"# TYPE proposal_generator_peak_rss_bytes gauge",
+				f"proposal_generator_peak_rss_bytes {peak_rss}"
+			]
+		return "\n".join(lines) + "\n"
+
+	# Write metrics to filename, in Prometheus text format if filename ends with .prom and as json otherwise.
+	# The file is replaced atomically, so a metrics collector never reads a partially written file.
+	def write(self, filename:str) -> None:
+		temp_filename = filename + ".tmp"
+		with open(temp_filename, 'w') as outFile:
+			if filename.endswith(".prom"):
+				outFile.write(self.to_prometheus())
+			else:
+				json.dump(self.to_json(), outFile, indent=4)
+		os.replace(temp_filename, filename)
+
+# Print and write the collected metrics and profiles. Called by run once generation has finished, also if it failed,
+# such that every run, including each request to the daemon, reports its own metrics.
+def report_profile(metrics:Optional[StageMetrics], metrics_file:Optional[str], profiler:Optional[cProfile.Profile], profile_file:Optional[str]) -> None:
+	if profiler is not None:
+		profiler.disable()
+		profiler.dump_stats(profile_file)
+		print(f"Wrote cProfile statistics to \"{profile_file}\".")
+	if metrics is not None:
+		print(metrics.summary())
+		if metrics.trace_memory:
+			print("Top allocation sites:")
+			for statistic in tracemalloc.take_snapshot().statistics("lineno")[:10]:
+				print(f"  {statistic}")
+		if metrics_file is not None:
+			try:
+				metrics.write(metrics_file)
+			except IOError:
+				print(f"Error writing file \"{metrics_file}\".")
+
+# Returns the sha256 digest of the json content of a pre-proposal file, as hex string.
+def content_digest(content:str) -> str:
+	return hashlib.sha256(content.encode()).hexdigest()
+
+# Returns the sha256 digest of the content of a json file, or None if the file does not exist.
+# Compressed files are decompressed, and the file is read in text mode, such that the digest does not depend on the line endings used by the platform.
+def json_file_digest(filename:str) -> Optional[str]:
+	try:
+		with open_output(filename, 'rt', newline=None) as json_file:
+			return content_digest(json_file.read())
+	except FileNotFoundError:
+		return None
+
+# Memory budget in bytes shared by the SpillingTables of a run, which hold the state kept for every row of the csv files.
+# Tables reserve the estimated memory of each entry they keep in memory, and a table whose entry does not fit moves to disk.
+class MemoryBudget:
+	def __init__(self, limit:int):
+		self.limit = limit
+		self.used = 0
+		# Tables of a csv file are used by the generating thread and the background writer
+		self.lock = threading.Lock()
+
+	# Reserve size bytes and return True if they fit into the budget, and otherwise return False.
+	def reserve(self, size:int) -> bool:
+		with self.lock:
+			if self.used + size > self.limit:
+				return False
+			self.used += size
+			return True
+
+	def release(self, size:int) -> None:
+		with self.lock:
+			self.used -= size
+
+# Table of entries with a unique key, with the interface of a dict whose items are in key order.
+# Keys are tuples of the key columns, or single values if there is only one key column, and values are tuples of the value columns.
+# Entries are kept in a dict as long as they fit into budget, and are then moved to a sqlite3 database in a temporary file,
+# indexed by its key, which is deleted when the table is garbage collected. Without budget, entries are always kept in memory.
+class SpillingTable:
+	# Estimated memory of a dict entry in addition to its key and value
+	entry_overhead:int = 64
+
+	def __init__(self, key_columns:List[str], value_columns:List[str], budget:Optional[MemoryBudget] = None):
+		self.key_columns = key_columns
+		self.value_columns = value_columns
+		self.budget = budget
+		self.entries:Dict[Any, Tuple] = {}
+		# Bytes of budget reserved for the entries in memory
+		self.reserved = 0
+		self.database:Optional[sqlite3.Connection] = None
+		self.lock = threading.Lock()
+		keys = ", ".join(key_columns)
+		self.select_sql = f"SELECT {', '.join(value_columns)} FROM entries WHERE {' AND '.join(column + ' = ?' for column in key_columns)}"
+		self.insert_sql = f"INSERT OR REPLACE INTO entries ({keys}, {', '.join(value_columns)}) VALUES ({', '.join('?' * (len(key_columns) + len(value_columns)))})"
+		self.items_sql = f"SELECT {keys}, {', '.join(value_columns)} FROM entries ORDER BY {keys}"
+
+	def key_tuple(self, key) -> Tuple:
+		return key if len(self.key_columns) > 1 else (key,)
+
+	def entry_size(self, key, value:Tuple) -> int:
+		return self.entry_overhead + sys.getsizeof(key) + sys.getsizeof(value) + sum(sys.getsizeof(item) for item in self.key_tuple(key) + value)
+
+	# Move all entries to a new database, such that no budget is used by this table anymore.
+	def spill(self) -> None:
+		self.database = sqlite3.connect("", check_same_thread=False)
+		# The database is temporary, so it need not survive crashes
+		self.database.execute("PRAGMA journal_mode = OFF")
+		self.database.execute("PRAGMA synchronous = OFF")
+		self.database.execute(f"CREATE TABLE entries ({', '.join(self.key_columns + self.value_columns)}, "\
+			f"PRIMARY KEY ({', '.join(self.key_columns)})) WITHOUT ROWID")
+		self.database.executemany(self.insert_sql, (self.key_tuple(key) + value for key, value in self.entries.items()))
+		self.entries = {}
+		self.budget.release(self.reserved)
+		self.reserved = 0
+
+	def get(self, key, default:Optional[Tuple] = None) -> Optional[Tuple]:
+		with self.lock:
+			if self.database is None:
+				return self.entries.get(key, default)
+			value = self.database.execute(self.select_sql, self.key_tuple(key)).fetchone()
+		return default if value is None else value
+
+	def __setitem__(self, key, value:Tuple) -> None:
+		with self.lock:
+			if self.database is None and self.budget is not None and key not in self.entries:
+				size = self.entry_size(key, value)
+				if self.budget.reserve(size):
+					self.reserved += size
+				else:
+					self.spill()
+			if self.database is None:
+				self.entries[key] = value
+			else:
+				self.database.execute(self.insert_sql, self.key_tuple(key) + tuple(value))
+
+	def __getitem__(self, key) -> Tuple:
+		value = self.get(key)
+		if value is None:
+			raise KeyError(key)
+		return value
+
+	def __contains__(self, key) -> bool:
+		return self.get(key) is not None
+
+	def __len__(self) -> int:
+		with self.lock:
+			if self.database is None:
+				return len(self.entries)
+			return self.database.execute("SELECT count(*) FROM entries").fetchone()[0]
+
+	def __iter__(self) -> Iterator[Any]:
+		for key, _ in self.items():
+			yield key
+
+	# Yields all (key, value) tuples in key order. The table must not be changed while its items are read.
+	def items(self) -> Iterator[Tuple[Any, Tuple]]:
+		if self.database is None:
+			with self.lock:
+				items = sorted(self.entries.items())
+			yield from items
+			return
+		key_count = len(self.key_columns)
+		for row in self.database.execute(self.items_sql):
+			yield (row[:key_count] if key_count > 1 else row[0], row[key_count:])
+
+	# Remove all entries, releasing their budget and closing the database if they were spilled.
+	def close(self) -> None:
+		with self.lock:
+			if self.database is not None:
+				self.database.close()
+				self.database = None
+			self.entries = {}
+			if self.budget is not None:
+				self.budget.release(self.reserved)
+			self.reserved = 0
+
+# Manifest of the pre-proposal files generated from a csv file, used to only rewrite the files of rows that changed.
+# The manifest is a JSON Lines file with one entry per row, holding the file name, the input digest of its pre-proposal
+# (see ScheduledPreProposal.input_digest), the digest of the written file and the expiry of its pre-proposal.
+# The expiry is not part of the input digest, but files that have expired when the manifest is loaded are rewritten.
+# With expiry chunks, the manifest also has a line {"first_expiry": timestamp} with the expiry of the first chunk, which
+# later runs keep until it expires, such that the files of unchanged rows keep the expiry of their chunk.
+# Entries are appended as soon as a file is fully written, so an interrupted run resumes after the last written file.
+# The latest entry of each row is kept in a SpillingTable, which moves to disk once it exceeds budget.
+class ProposalManifest:
+	def __init__(self, filename:str, budget:Optional[MemoryBudget] = None):
+		self.filename = filename
+		self.file = None
+		self.now = int(datetime.now().timestamp())
+		# Expiry of the first expiry chunk, if files were generated in expiry chunks
+		self.first_expiry:Optional[int] = None
+		# Whether first_expiry differs from the one in the file, and must be appended with the next entry
+		self.first_expiry_changed = False
+		# Maps row number to the file name, input digest, output digest and expiry of the latest entry for that row
+		self.entries = SpillingTable(["row"], ["file", "input", "output", "expiry"], budget)
+		try:
+			with open(filename) as manifest_file:
+				for line in manifest_file:
+					try:
+						entry = json.loads(line)
+					except ValueError:
+						# The last line might be incomplete if a run was interrupted
+						continue
+					if "first_expiry" in entry:
+						self.first_expiry = entry["first_expiry"]
+						continue
+					# Entries of earlier versions have no expiry, so their files are rewritten
+					self.entries[entry["row"]] = (entry["file"], entry["input"], entry["output"], entry.get("expiry"))
+		except FileNotFoundError:
+			pass
+
+	# Returns the expiry chunks of this run, which start at the first expiry of the manifest as long as it has not expired,
+	# and otherwise at the first expiry of expiry_chunks, which is then recorded in the manifest.
+	def expiry_chunks(self, expiry_chunks:'ExpiryChunks') -> 'ExpiryChunks':
+		if self.first_expiry is not None and self.first_expiry > self.now:
+			return expiry_chunks.starting_at(self.first_expiry)
+		self.first_expiry = expiry_chunks.first_expiry
+		self.first_expiry_changed = True
+		return expiry_chunks
+
+	# Returns the latest entry of the given row, or None if there is none.
+	def entry(self, row_number:int) -> Optional[Dict[str, Any]]:
+		value = self.entries.get(row_number)
+		if value is None:
+			return None
+		return {"row": row_number, "file": value[0], "input": value[1], "output": value[2], "expiry": value[3]}
+
+	# Returns None if the file of the given row is up to date, and otherwise the reason why it must be written.
+	# If expiry is set, files with another expiry are rewritten as well, e.g., such that they match the expiry of their chunk.
+	def change(self, row_number:int, file_name:str, input_digest:str, expiry:Optional[int] = None) -> Optional[str]:
+		entry = self.entry(row_number)
+		if entry is None or entry["file"] != file_name:
+			return "new"
+		if entry["input"] != input_digest:
+			return "changed"
+		if entry["expiry"] is None or entry["expiry"] <= self.now:
+			return "expired"
+		if expiry is not None and entry["expiry"] != expiry:
+			return "rescheduled"
+		output_digest = json_file_digest(file_name)
+		if output_digest is None:
+			return "missing"
+		if output_digest != entry["output"]:
+			return "modified"
+		return None
+
+	# Record that the file of the given row has been written with the given content and expiry.
+	def add(self, row_number:int, file_name:str, input_digest:str, content:str, expiry:int) -> None:
+		if self.file is None:
+			self.file = open(self.filename, 'a+')
+			# Terminate an incomplete last line of an interrupted run, such that it does not corrupt the new entry
+			if self.file.tell() > 0:
+				self.file.seek(self.file.tell() - 1)
+				if self.file.read(1) != "\n":
+					self.file.write("\n")
+		if self.first_expiry_changed:
+			self.file.write(json.dumps({"first_expiry": self.first_expiry}) + "\n")
+			self.first_expiry_changed = False
+		entry = {"row": row_number, "file": file_name, "input": input_digest, "output": content_digest(content), "expiry": expiry}
+		self.entries[row_number] = (entry["file"], entry["input"], entry["output"], entry["expiry"])
+		self.file.write(json.dumps(entry) + "\n")
+		self.file.flush()
+
+	# Rewrite the manifest with only the latest entries of the first row_count rows, and close it.
+	def compact(self, row_count:int) -> None:
+		self.close_file()
+		try:
+			temp_filename = self.filename + ".tmp"
+			with open(temp_filename, 'w') as manifest_file:
+				if self.first_expiry is not None:
+					manifest_file.write(json.dumps({"first_expiry": self.first_expiry}) + "\n")
+				for row_number, (file_name, input_digest, output_digest, expiry) in self.entries.items():
+					if row_number > row_count:
+						break
+					entry = {"row": row_number, "file": file_name, "input": input_digest, "output": output_digest, "expiry": expiry}
+					manifest_file.write(json.dumps(entry) + "\n")
+			os.replace(temp_filename, self.filename)
+		finally:
+			self.close()
+
+	def close_file(self) -> None:
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+
+	# Close the manifest file and release the entries, after which the manifest cannot be used anymore.
+	def close(self) -> None:
+		self.close_file()
+		self.entries.close()
+
+# Alphabet of Base58Check encoded account addresses
+base58_alphabet:bytes = b"123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+# Lookup table from byte value to base58 digit, -1 for bytes not in the alphabet
+base58_lookup:List[int] = [base58_alphabet.find(bytes([char])) for char in range(256)]
+# Maximal number of distinct addresses for which the validation result is cached
+address_cache_size:int = 1 << 16
+
+# Decode a Base58Check encoded string and return its payload, or None if the string is not valid.
+# Accepts and rejects the same strings as base58.b58decode_check.
+def b58decode_check(address:str) -> Optional[bytes]:
+	try:
+		data = address.rstrip().encode('ascii')
+	except UnicodeEncodeError:
+		return None
+	stripped = data.lstrip(base58_alphabet[0:1])
+	value = 0
+	for char in stripped:
+		digit = base58_lookup[char]
+		if digit < 0:
+			return None
+		value = value * 58 + digit
+	decoded = bytes(len(data) - len(stripped)) + value.to_bytes((value.bit_length() + 7) // 8, 'big')
+	payload, checksum = decoded[:-4], decoded[-4:]
+	if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+		return None
+	return payload
+
+# Check whether address is a valid Base58Check encoded address.
+# Results are cached, as the same addresses typically appear in many rows.
+@lru_cache(maxsize=address_cache_size)
+def is_valid_address(address:str) -> bool:
+	return b58decode_check(address) is not None
+
+# Validate a whole column of addresses at once, where addresses[i] is from row first_row_number+i.
+# Each distinct address is only decoded and hashed once.
+# Raises a ValueError for the first invalid address, with the same message as parse_row.
+def validate_address_column(addresses:Sequence[str], role:str, first_row_number:int = 1) -> None:
+	valid = {address: is_valid_address(address) for address in dict.fromkeys(addresses)}
+	for i, address in enumerate(addresses):
+		if not valid[address]:
+			raise ValueError(f"Invalid {role} address \"{address}\" in row {first_row_number + i}.")
+
+# Check that the configured delimiters can be used to parse the csv file.
+def check_delimiters(decimal_sep:str, thousands_sep:str, csv_delimiter:str) -> None:
 	if len(csv_delimiter) != 1 or len(thousands_sep) != 1 or len(decimal_sep) != 1 or thousands_sep == decimal_sep:
 		raise ValueError(f"Invalid delimiters. Note that all delimiters must be a single character "\
 			"and thousands_sep must be different from decimal_sep.")
-	
-	result = []
 
+# Read csv file and yield a tuple (row_number, row_data) for each row in csv.
+# Rows are read lazily, so only a single row is held in memory at a time.
+def read_csv_rows(filename:str, csv_delimiter:str) -> Iterator[Tuple[int, List[str]]]:
 	with open(filename, newline='', encoding='utf-8-sig') as csvfile:
 		reader = csv.reader(csvfile, delimiter=csv_delimiter)
-		for row_number,row_data in enumerate(reader, start=1): # start counting rows with 1 for error messages
-			# Ensure we have the right number of columns
-			if not is_welcome and len(row_data) != 4:
-				raise ValueError(f"Incorrect file format. Each row must contains exactly 4 entires. Row {row_number} contains {len(row_data)}.")
-			elif is_welcome and len(row_data) != 3:
-				raise ValueError(f"Incorrect file format. Each row must contains exactly 3 entires. Row {row_number} contains {len(row_data)}.")
-			
-			# Read sender and receiver address
-			sender_address = row_data[0]
-			try:
-				b58decode_check(sender_address)
-			except:
-				raise ValueError(f"Invalid sender address \"{sender_address}\" in row {row_number}.")
-			receiver_address = row_data[1]
-			try:
-				b58decode_check(receiver_address)
-			except:
-				raise ValueError(f"Invalid receiver address \"{receiver_address}\" in row {row_number}.")
-			
-			# Read amounts
-			if is_welcome:
-				try:
-					amount = TransferAmount.from_string(row_data[2], decimal_sep, thousands_sep)
-				except ValueError as error:
-					raise ValueError(f"In row {row_number}: {error}")
-
-				result.append({"sender_address" : sender_address,
-					"receiver_address" : receiver_address,
-					"amount" : amount
-				})
-			else:
-				try:
-					initial_amount = TransferAmount.from_string(row_data[2], decimal_sep, thousands_sep)
-					remaining_amount = TransferAmount.from_string(row_data[3], decimal_sep, thousands_sep)
-				except ValueError as error:
-					raise ValueError(f"In row {row_number}: {error}")
+		yield from enumerate(reader, start=1) # start counting rows with 1 for error messages
 
-				result.append({"sender_address" : sender_address,
-					"receiver_address" : receiver_address,
-					"initial_amount" : initial_amount,
-					"remaining_amount" : remaining_amount
-				})
+# Size in bytes of the ranges of a csv file that are parsed by worker processes
+csv_range_size:int = 1<<17
 
-	return result
+# A range of complete records of a csv file, starting at row first_row_number, which can be parsed independently of the rest of the file.
+# If shard is set, only the rows of the range in that shard are returned by read.
+class CsvRange:
+	__slots__ = ("filename", "start", "end", "first_row_number", "row_count", "shard")
+
+	def __init__(self, filename:str, start:int, end:int, first_row_number:int, row_count:int, shard:Optional["Shard"] = None):
+		self.filename = filename
+		self.start = start
+		self.end = end
+		self.first_row_number = first_row_number
+		self.row_count = row_count
+		self.shard = shard
+
+	# Read and parse the rows of the range, returning the same (row_number, row_data) tuples as read_csv_rows.
+	def read(self, csv_delimiter:str) -> List[Tuple[int, List[str]]]:
+		with open(self.filename, 'rb') as csvfile:
+			with mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+				text = data[self.start:self.end].decode('utf-8')
+		reader = csv.reader(io.StringIO(text, newline=''), delimiter=csv_delimiter)
+		rows = enumerate(reader, start=self.first_row_number)
+		if self.shard is not None:
+			return [(row_number, row_data) for row_number, row_data in rows if self.shard.contains(row_number, row_data)]
+		return list(rows)
+
+# Returns a pattern matching a whole csv record with the given delimiter, including its line break, as split by csv.reader with the default
+# dialect over the lines of a file opened with newline='': a quote only starts a quoted field at the start of a field, where two quotes
+# are an escaped quote and the rest of the field after the closing quote is unquoted, and a line ends with \n, \r\n or a lone \r.
+# The only records that do not match are those with an unterminated quoted field, which csv.reader reads to the end of the file.
+def csv_record_pattern(csv_delimiter:str) -> Pattern[bytes]:
+	delimiter = re.escape(csv_delimiter.encode())
+	# A byte of a field that is neither the delimiter nor a line break, where a non-ASCII delimiter has several bytes
+	other = rb'[^' + delimiter + rb'\r\n]' if len(csv_delimiter.encode()) == 1 else rb'(?:(?!' + delimiter + rb')[^\r\n])'
+	field = rb'(?:"[^"]*(?:""[^"]*)*"(?!")|(?!"))' + other + rb'*'
+	return re.compile(field + rb'(?:' + delimiter + field + rb')*(?:\r\n?|\n|\Z)')
+
+# Split a csv file into ranges of about range_size bytes of complete records, such that worker processes can parse them independently.
+# Records are found by matching csv_record_pattern on the memory-mapped file, so ranges have the row numbers of the rows read by
+# read_csv_rows whatever the quoting or line breaks of the file, without decoding or parsing the rows, which is left to the workers.
+# A UTF-8 byte order mark is skipped, as by the utf-8-sig encoding.
+def iter_csv_ranges(filename:str, csv_delimiter:str, range_size:int = csv_range_size) -> Iterator[CsvRange]:
+	if os.path.getsize(filename) == 0:
+		return
+	record = csv_record_pattern(csv_delimiter)
+	with open(filename, 'rb') as csvfile:
+		with mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			size = len(data)
+			start = len(codecs.BOM_UTF8) if data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8 else 0
+			position = start
+			row_number = 1
+			row_count = 0
+			while position < size:
+				match = record.match(data, position)
+				position = size if match is None else match.end()
+				row_count += 1
+				if position - start >= range_size:
+					yield CsvRange(filename, start, position, row_number, row_count)
+					(start, row_number, row_count) = (position, row_number + row_count, 0)
+			if row_count > 0:
+				yield CsvRange(filename, start, position, row_number, row_count)
+
+# Returns the number of rows of a csv file, as read by read_csv_rows, from its records found by iter_csv_ranges.
+def count_csv_rows(filename:str, csv_delimiter:str) -> int:
+	return sum(csv_range.row_count for csv_range in iter_csv_ranges(filename, csv_delimiter))
+
+# Returns the number of lines of a csv file, which end with \n, \r\n or a lone \r, by counting line breaks without decoding the file.
+# This is the number of rows of the file, unless quoted fields contain line breaks, in which case it has fewer rows.
+def count_csv_lines(filename:str) -> int:
+	line_count = 0
+	last = b""
+	with open(filename, 'rb') as csvfile:
+		for block in iter(partial(csvfile.read, 1<<20), b""):
+			line_count += block.count(b'\n') + block.count(b'\r') - block.count(b'\r\n')
+			# A \r\n split between two blocks is a single line break
+			if last == b'\r' and block[:1] == b'\n':
+				line_count -= 1
+			last = block[-1:]
+	# The last line may have no line break
+	if last not in (b"", b"\r", b"\n"):
+		line_count += 1
+	return line_count
+
+# Returns the number of digits of the row numbers in the names of pre-proposal files of a csv file with row_count rows.
+# Numbers have at least 3 digits, and all files of a csv file have the same number of digits, such that they sort by row.
+# Files are named with the digits of the number of lines of the csv file (see count_csv_lines), which are known without parsing it.
+def row_number_digits(row_count:int) -> int:
+	return max(3, len(str(row_count)))
+
+# Part index of count of the rows of a csv file with row_count rows, such that a huge csv file can be generated on several machines.
+# Contiguous shards hold consecutive rows, while hashed shards hold the rows whose sender and receiver hash to the shard,
+# such that all transfers between the same accounts, and thus all duplicates, are in the same shard.
+# Pre-proposal files are numbered by their row in the whole csv file, so the files of all shards can be put into one folder.
+class Shard:
+	__slots__ = ("index", "count", "hashed", "first_row", "last_row")
+
+	def __init__(self, index:int, count:int, hashed:bool = False, row_count:int = 0):
+		self.index = index
+		self.count = count
+		self.hashed = hashed
+		if hashed:
+			self.first_row = 1
+			self.last_row = sys.maxsize
+		else:
+			self.first_row = (index - 1)*row_count//count + 1
+			# The last shard takes all rows up to the end of the file, such that no row is lost if the file has more rows than counted
+			self.last_row = index*row_count//count if index < count else sys.maxsize
+
+	# Returns whether the given row is in this shard. The row data is only used for hashed shards.
+	def contains(self, row_number:int, row_data:List[str]) -> bool:
+		if row_number < self.first_row or row_number > self.last_row:
+			return False
+		if not self.hashed:
+			return True
+		return hashed_shard_index(row_data, self.count) == self.index
+
+	# Returns whether any of row_count rows starting at first_row_number can be in this shard.
+	def overlaps(self, first_row_number:int, row_count:int) -> bool:
+		return first_row_number <= self.last_row and first_row_number + row_count > self.first_row
+
+	# Suffix of the names of the output files that are written once per shard, such as the report.
+	def suffix(self) -> str:
+		return f".shard-{self.index}-of-{self.count}"
+
+# Returns the index, counting from 1, of the hashed shard of count shards that holds a row.
+def hashed_shard_index(row_data:List[str], count:int) -> int:
+	# crc32 does not depend on the process, unlike hash of a str
+	return zlib.crc32("\0".join(row_data[:2]).encode()) % count + 1
+
+# Parse the argument of --shard, which is "i/N" for shard i of N, counting from 1.
+def parse_shard(argument:str) -> Tuple[int, int]:
+	match = re.fullmatch(r"(\d+)/(\d+)", argument)
+	if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+		raise argparse.ArgumentTypeError(f"invalid shard \"{argument}\", expected i/N with 1 <= i <= N")
+	return (int(match.group(1)), int(match.group(2)))
+
+# Validate a single csv row and return its sender, receiver, initial amount and remaining amount, with amounts in microGTU.
+# For welcome transfers, the initial amount is the amount of the transfer, and the remaining amount is 0.
+# Addresses are checked with is_valid and amounts parsed with parse_amount, which are replaced by timed versions for metrics.
+def parse_row_values(
+	row_number:int,
+	row_data:List[str],
+	is_welcome:bool,
+	decimal_sep:str,
+	thousands_sep:str,
+	is_valid:Callable[[str], bool] = is_valid_address,
+	parse_amount:Callable[[str, str, str], int] = TransferAmount.parse_micro_GTU
+	) -> Tuple[str, str, int, int]:
+	# Ensure we have the right number of columns
+	if not is_welcome and len(row_data) != 4:
+		raise ValueError(f"Incorrect file format. Each row must contains exactly 4 entires. Row {row_number} contains {len(row_data)}.")
+	elif is_welcome and len(row_data) != 3:
+		raise ValueError(f"Incorrect file format. Each row must contains exactly 3 entires. Row {row_number} contains {len(row_data)}.")
+	
+	# Read sender and receiver address
+	sender_address = row_data[0]
+	if not is_valid(sender_address):
+		raise ValueError(f"Invalid sender address \"{sender_address}\" in row {row_number}.")
+	receiver_address = row_data[1]
+	if not is_valid(receiver_address):
+		raise ValueError(f"Invalid receiver address \"{receiver_address}\" in row {row_number}.")
+	
+	# Read amounts
+	try:
+		initial_amount = parse_amount(row_data[2], decimal_sep, thousands_sep)
+		remaining_amount = 0 if is_welcome else parse_amount(row_data[3], decimal_sep, thousands_sep)
+	except ValueError as error:
+		raise ValueError(f"In row {row_number}: {error}")
+	return (sender_address, receiver_address, initial_amount, remaining_amount)
+
+# Validate a single csv row and return the corresponding transfer. Further arguments are passed to parse_row_values.
+def parse_row(row_number:int, row_data:List[str], is_welcome:bool, decimal_sep:str, thousands_sep:str, **parsers) -> Dict[str, Any]:
+	(sender_address, receiver_address, initial_amount, remaining_amount) = parse_row_values(row_number, row_data, is_welcome, decimal_sep, thousands_sep, **parsers)
+	if is_welcome:
+		return {"sender_address" : sender_address,
+			"receiver_address" : receiver_address,
+			"amount" : TransferAmount(initial_amount)
+		}
+	else:
+		return {"sender_address" : sender_address,
+			"receiver_address" : receiver_address,
+			"initial_amount" : TransferAmount(initial_amount),
+			"remaining_amount" : TransferAmount(remaining_amount)
+		}
+
+# Same as parse_row for a csv file whose last column is the schedule ID of each row, which is added to the transfer as "schedule_id".
+def parse_scheduled_row(row_number:int, row_data:List[str], is_welcome:bool, decimal_sep:str, thousands_sep:str, schedules:"ScheduleBook", **parsers) -> Dict[str, Any]:
+	(row_data, schedule_id) = schedules.split_row(row_number, row_data, is_welcome)
+	transfer = parse_row(row_number, row_data, is_welcome, decimal_sep, thousands_sep, **parsers)
+	transfer["schedule_id"] = schedule_id
+	return transfer
+
+# Compact columnar storage for a batch of validated transfers.
+# Addresses are interned, so an address that appears in many rows is only stored once,
+# and amounts are stored in microGTU in array('Q') columns instead of as TransferAmount objects.
+# For welcome transfers, initial_amounts holds the amount of each transfer, and remaining_amounts is empty.
+# If the csv file has a schedule-ID column, schedule_ids holds the schedule ID of each transfer.
+class TransferBatch:
+	__slots__ = ("is_welcome", "row_numbers", "senders", "receivers", "initial_amounts", "remaining_amounts", "schedule_ids")
+
+	def __init__(self, is_welcome:bool):
+		self.is_welcome = is_welcome
+		self.row_numbers = array('Q')
+		self.senders: List[str] = []
+		self.receivers: List[str] = []
+		self.initial_amounts = array('Q')
+		self.remaining_amounts = array('Q')
+		self.schedule_ids: List[str] = []
+
+	# Validate a csv row and append it to the batch. Raises the same errors as parse_row, or parse_scheduled_row if schedules are given.
+	def append_row(self, row_number:int, row_data:List[str], decimal_sep:str, thousands_sep:str, schedules:Optional["ScheduleBook"] = None) -> None:
+		if schedules is not None:
+			(row_data, schedule_id) = schedules.split_row(row_number, row_data, self.is_welcome)
+		(sender_address, receiver_address, initial_amount, remaining_amount) = parse_row_values(row_number, row_data, self.is_welcome, decimal_sep, thousands_sep)
+		if schedules is not None:
+			self.schedule_ids.append(schedule_id)
+		self.row_numbers.append(row_number)
+		self.senders.append(sys.intern(sender_address))
+		self.receivers.append(sys.intern(receiver_address))
+		self.initial_amounts.append(initial_amount)
+		if not self.is_welcome:
+			self.remaining_amounts.append(remaining_amount)
+
+	def __len__(self) -> int:
+		return len(self.row_numbers)
+
+	# Returns a batch with the transfers at the given indices.
+	def select(self, indices:List[int]) -> 'TransferBatch':
+		batch = TransferBatch(self.is_welcome)
+		batch.row_numbers = array('Q', [self.row_numbers[i] for i in indices])
+		batch.senders = [self.senders[i] for i in indices]
+		batch.receivers = [self.receivers[i] for i in indices]
+		batch.initial_amounts = array('Q', [self.initial_amounts[i] for i in indices])
+		if not self.is_welcome:
+			batch.remaining_amounts = array('Q', [self.remaining_amounts[i] for i in indices])
+		if self.schedule_ids:
+			batch.schedule_ids = [self.schedule_ids[i] for i in indices]
+		return batch
+
+	# Returns the i-th transfer in the same format as parse_row, or parse_scheduled_row if the batch has schedule IDs
+	def __getitem__(self, i:int) -> Dict[str, Any]:
+		if self.is_welcome:
+			transfer = {"sender_address" : self.senders[i],
+				"receiver_address" : self.receivers[i],
+				"amount" : TransferAmount(self.initial_amounts[i])
+			}
+		else:
+			transfer = {"sender_address" : self.senders[i],
+				"receiver_address" : self.receivers[i],
+				"initial_amount" : TransferAmount(self.initial_amounts[i]),
+				"remaining_amount" : TransferAmount(self.remaining_amounts[i])
+			}
+		if self.schedule_ids:
+			transfer["schedule_id"] = self.schedule_ids[i]
+		return transfer
+
+# Report of duplicate transfers and per-sender totals, built in a single pass over the validated transfers of a csv file.
+# A transfer is an exact duplicate if an earlier row has the same sender, receiver and amounts,
+# and a near duplicate if an earlier row has the same sender and receiver, but different amounts.
+# Memory is bounded by the number of distinct (sender, receiver) pairs, plus one entry per duplicate.
+class TransferReport:
+	# Amounts are kept shifted into the range of signed 64 bit integers, such that they can be stored by sqlite3
+	amount_shift:int = 1 << 63
+
+	def __init__(self, is_welcome:bool, budget:Optional[MemoryBudget] = None):
+		self.is_welcome = is_welcome
+		self.row_count = 0
+		# Maps (sender, receiver) to the row number and shifted amounts of its first transfer
+		self.pairs = SpillingTable(["sender", "receiver"], ["row", "initial_amount", "remaining_amount"], budget)
+		# Maps the row number of each duplicate to the row number of the first transfer of the pair, the pair, and whether it is exact
+		self.duplicates = SpillingTable(["row"], ["first_row", "sender", "receiver", "exact"], budget)
+		# Maps sender to [number of transfers, initial amount, remaining amount] in microGTU
+		self.senders:Dict[str, List[int]] = {}
+		# Number of duplicates and of exact duplicates, kept when the tables are closed
+		self.duplicate_counts:Optional[Tuple[int, int]] = None
+
+	def add(self, row_number:int, sender:str, receiver:str, initial_amount:int, remaining_amount:int) -> None:
+		self.row_count += 1
+		pair = (sender, receiver)
+		first = self.pairs.get(pair)
+		amounts = (initial_amount - self.amount_shift, remaining_amount - self.amount_shift)
+		if first is None:
+			self.pairs[pair] = (row_number,) + amounts
+		else:
+			self.duplicates[row_number] = (first[0], sender, receiver, first[1:] == amounts)
+		totals = self.senders.get(sender)
+		if totals is None:
+			totals = self.senders[sender] = [0, 0, 0]
+		totals[0] += 1
+		totals[1] += initial_amount
+		totals[2] += remaining_amount
+
+	# Add a transfer in the format of parse_row.
+	def add_transfer(self, row_number:int, transfer:Dict[str, Any]) -> None:
+		if self.is_welcome:
+			self.add(row_number, transfer["sender_address"], transfer["receiver_address"], transfer["amount"].amount, 0)
+		else:
+			self.add(row_number, transfer["sender_address"], transfer["receiver_address"], transfer["initial_amount"].amount, transfer["remaining_amount"].amount)
+
+	def add_batch(self, batch:TransferBatch) -> None:
+		remaining_amounts = itertools.repeat(0) if batch.is_welcome else batch.remaining_amounts
+		for row in zip(batch.row_numbers, batch.senders, batch.receivers, batch.initial_amounts, remaining_amounts):
+			self.add(*row)
+
+	def duplicate_count(self) -> int:
+		if self.duplicate_counts is not None:
+			return self.duplicate_counts[0]
+		return len(self.duplicates)
+
+	def exact_duplicate_count(self) -> int:
+		if self.duplicate_counts is not None:
+			return self.duplicate_counts[1]
+		return sum(1 for _, duplicate in self.duplicates.items() if duplicate[3])
+
+	# Release the tables of pairs and duplicates once the report is written. Only the numbers of duplicates remain available.
+	def close(self) -> None:
+		if self.duplicate_counts is None:
+			self.duplicate_counts = (self.duplicate_count(), self.exact_duplicate_count())
+		self.pairs.close()
+		self.duplicates.close()
+
+	def duplicate_entries(self) -> Iterator[Dict[str, Any]]:
+		for row_number, (first_row_number, sender, receiver, exact) in self.duplicates.items():
+			yield {"row": row_number, "first_row": first_row_number, "sender": sender, "receiver": receiver, "type": "exact" if exact else "near"}
+
+	# The total amount sent by a sender is checked against the same range as a single TransferAmount.
+	def sender_entries(self) -> Iterator[Dict[str, Any]]:
+		for sender, (transfers, initial_amount, remaining_amount) in self.senders.items():
+			total_amount = initial_amount + remaining_amount
+			yield {
+				"sender": sender,
+				"transfers": transfers,
+				"initial_amount": initial_amount,
+				"remaining_amount": remaining_amount,
+				"total_amount": total_amount,
+				"total_in_range": 0 < total_amount <= TransferAmount.max_amount
+			}
+
+	# Returns the report as json object, whose list of duplicates is left empty if duplicates is False.
+	def to_json(self, duplicates:bool = True) -> Dict[str, Any]:
+		exact_count = self.exact_duplicate_count()
+		return {
+			"rows": self.row_count,
+			"distinct_pairs": len(self.pairs),
+			"exact_duplicates": exact_count,
+			"near_duplicates": len(self.duplicates) - exact_count,
+			"duplicates": list(self.duplicate_entries()) if duplicates else [],
+			"senders": list(self.sender_entries())
+		}
+
+	# Write the json of to_json with indentation 4 to report_file, writing duplicates one at a time,
+	# as there can be as many of them as rows.
+	def write_json(self, report_file) -> None:
+		(head, tail) = json.dumps(self.to_json(duplicates=False), indent=4).split('"duplicates": []', 1)
+		report_file.write(head + '"duplicates": [')
+		separator = "\n"
+		for entry in self.duplicate_entries():
+			report_file.write(separator + "        " + json.dumps(entry, indent=4).replace("\n", "\n        "))
+			separator = ",\n"
+		report_file.write("" if separator == "\n" else "\n    ")
+		report_file.write("]" + tail)
+
+	# Returns the names of the files written by write.
+	@staticmethod
+	def filenames(prefix:str, report_format:str) -> List[str]:
+		if report_format == "json":
+			return [prefix + ".report.json"]
+		return [prefix + ".senders.csv", prefix + ".duplicates.csv"]
+
+	# Write the report next to the pre-proposals with the given prefix, either as one json file or as two csv files
+	# with the per-sender totals and the duplicates. Returns the names of the written files.
+	def write(self, prefix:str, report_format:str) -> List[str]:
+		filenames = self.filenames(prefix, report_format)
+		if report_format == "json":
+			with open(filenames[0], 'w') as report_file:
+				self.write_json(report_file)
+			return filenames
+		for filename, entries, columns in [
+			(filenames[0], self.sender_entries(), ["sender", "transfers", "initial_amount", "remaining_amount", "total_amount", "total_in_range"]),
+			(filenames[1], self.duplicate_entries(), ["row", "first_row", "sender", "receiver", "type"])]:
+			with open(filename, 'w', newline='', encoding='utf-8') as report_file:
+				writer = csv.DictWriter(report_file, fieldnames=columns)
+				writer.writeheader()
+				writer.writerows(entries)
+		return filenames
+
+# Returns parse, a function with the arguments of parse_row, such that it records the time spent validating addresses
+# and parsing amounts as stages address_validation and amount_parsing of metrics.
+def timed_row_parser(parse:Callable[..., Dict[str, Any]], metrics:StageMetrics) -> Callable[..., Dict[str, Any]]:
+	return partial(parse,
+		is_valid=metrics.timed("address_validation", is_valid_address),
+		parse_amount=metrics.timed("amount_parsing", TransferAmount.parse_micro_GTU))
+
+# Read csv file and yield one validated transfer for each row in csv.
+# Each row is parsed and validated when it is requested, so the whole file is never held in memory.
+# If schedules are given, the last column of each row is the schedule ID of the transfer (see parse_scheduled_row).
+# If metrics are given, reading rows, validating addresses and parsing amounts are recorded as stages csv_read,
+# address_validation and amount_parsing (see timed_row_parser).
+def iter_transfers(
+	filename:str,
+	is_welcome:bool,
+	decimal_sep:str,
+	thousands_sep:str,
+	csv_delimiter:str,
+	metrics:Optional[StageMetrics] = None,
+	schedules:Optional["ScheduleBook"] = None
+	) -> Iterator[Dict[str, Any]]:
+	check_delimiters(decimal_sep, thousands_sep, csv_delimiter)
+	rows = read_csv_rows(filename, csv_delimiter)
+	parse = parse_row if schedules is None else partial(parse_scheduled_row, schedules=schedules)
+	if metrics is not None:
+		rows = metrics.timed_iter("csv_read", rows)
+		parse = timed_row_parser(parse, metrics)
+	for row_number, row_data in rows:
+		yield parse(row_number, row_data, is_welcome, decimal_sep, thousands_sep)
+
+# Read csv file and yield a tuple (row_number, transfer) with a validated transfer for each row of csv in shard.
+# Rows of other shards are not validated. Metrics and schedules are used as by iter_transfers.
+def iter_shard_transfers(
+	filename:str,
+	shard:Shard,
+	is_welcome:bool,
+	decimal_sep:str,
+	thousands_sep:str,
+	csv_delimiter:str,
+	metrics:Optional[StageMetrics] = None,
+	schedules:Optional["ScheduleBook"] = None
+	) -> Iterator[Tuple[int, Dict[str, Any]]]:
+	check_delimiters(decimal_sep, thousands_sep, csv_delimiter)
+	rows = read_csv_rows(filename, csv_delimiter)
+	parse = parse_row if schedules is None else partial(parse_scheduled_row, schedules=schedules)
+	if metrics is not None:
+		rows = metrics.timed_iter("csv_read", rows)
+		parse = timed_row_parser(parse, metrics)
+	for row_number, row_data in rows:
+		if row_number > shard.last_row:
+			break
+		if shard.contains(row_number, row_data):
+			yield (row_number, parse(row_number, row_data, is_welcome, decimal_sep, thousands_sep))
+
+# Read csv file and return a list with one entry for each row in csv.
+def csv_to_list(filename:str, is_welcome:bool, decimal_sep:str, thousands_sep:str, csv_delimiter:str) -> List[Any]:
+	return list(iter_transfers(filename, is_welcome, decimal_sep, thousands_sep, csv_delimiter))
 
 # Build the release schedule
 # Normal schedule consists of num_releases, with first one at initial_release_time,
-# and the remaining ones one month after each other, starting with first_rem_release_time.
+# and the remaining ones one cadence (by default one month) after each other, starting with first_rem_release_time.
 #
 # If the transfer is delayed, some realeases can be in the past. In that case,
 # combine all releases before earliest_release_time into one release at that time.
@@ -211,7 +1707,8 @@ def build_release_schedule(
 	initial_release_time:datetime,
 	first_rem_release_time:datetime,
 	earliest_release_time:datetime,
-	num_releases:int
+	num_releases:int,
+	cadence:relativedelta = relativedelta(months = +1)
 	) -> Tuple[List[datetime],int]:
 	if initial_release_time > first_rem_release_time:
 		raise ValueError("Initial release must be before the remaining ones")
@@ -220,8 +1717,8 @@ def build_release_schedule(
 	release_times = [max(initial_release_time, earliest_release_time)]
 
 	for i in range(num_releases - 1):
-		# remaining realeses are i month after first remaining release
-		planned_release_time = first_rem_release_time + relativedelta(months = +i)
+		# remaining realeses are i cadences after first remaining release
+		planned_release_time = first_rem_release_time + cadence*i
 
 		# Only add release if after earliest_release_time.
 		if planned_release_time > earliest_release_time:
@@ -230,6 +1727,186 @@ def build_release_schedule(
 	skipped_releases = num_releases - len(release_times)
 	return (release_times, skipped_releases)
 
+# Earliest release time used if none is configured: 14:00 CET on the day after the run, as (days after the run, time of day).
+default_earliest_release:Tuple[int, time] = (1, time.fromisoformat("14:00:00+01:00"))
+
+# Release schedule of transfers, as defined in get_config or in a schedule definition file (see load_schedule_file).
+# The schedule consists of num_releases releases, the initial one at initial_release_time and the remaining ones every cadence,
+# starting with first_rem_release_time. Releases before the earliest release time are combined into one release at that time.
+# The earliest release time is either fixed, or given as (days, time of day) after the day of the run.
+class ReleaseSchedule:
+	__slots__ = ("num_releases", "initial_release_time", "first_rem_release_time", "cadence", "earliest_release")
+
+	def __init__(
+		self,
+		num_releases:int,
+		initial_release_time:datetime,
+		first_rem_release_time:datetime,
+		cadence:relativedelta = relativedelta(months = +1),
+		earliest_release:Union[datetime, Tuple[int, time]] = default_earliest_release
+		):
+		self.num_releases = num_releases
+		self.initial_release_time = initial_release_time
+		self.first_rem_release_time = first_rem_release_time
+		self.cadence = cadence
+		self.earliest_release = earliest_release
+
+	def earliest_release_time(self, today:date) -> datetime:
+		if isinstance(self.earliest_release, datetime):
+			return self.earliest_release
+		(days, time_of_day) = self.earliest_release
+		return datetime.combine(today, time_of_day) + relativedelta(days = +days)
+
+	# Compute the release times of the schedule for a run on the given day.
+	# Welcome transfers only have the initial release.
+	def compile(self, is_welcome:bool, today:date) -> 'CompiledSchedule':
+		earliest_release_time = self.earliest_release_time(today)
+		planned_release_times = [self.first_rem_release_time + self.cadence*i for i in range(self.num_releases - 1)]
+		if is_welcome:
+			return CompiledSchedule([max(self.initial_release_time, earliest_release_time)], 0, self.num_releases, self.initial_release_time, planned_release_times)
+		if self.num_releases < 2:
+			# the remaining amount is split into num_releases-1 releases
+			raise ValueError(f"releases must be at least 2 for transfers with a remaining amount, but is {self.num_releases}")
+		(release_times, skipped_releases) = build_release_schedule(
+			self.initial_release_time, self.first_rem_release_time, earliest_release_time, self.num_releases, self.cadence)
+		return CompiledSchedule(release_times, skipped_releases, self.num_releases, self.initial_release_time, planned_release_times)
+
+# Release times of a schedule for the current run, with their timestamps in milliseconds as used in pre-proposals,
+# such that they are computed once for all transfers with this schedule.
+# The timestamps of the initial release and of all planned remaining releases, before skipping any, are kept for verify_proposal.
+class CompiledSchedule:
+	__slots__ = ("release_times", "skipped_releases", "num_releases", "timestamps", "initial_timestamp", "planned_timestamps")
+
+	def __init__(
+		self,
+		release_times:List[datetime],
+		skipped_releases:int,
+		num_releases:int,
+		initial_release_time:Optional[datetime] = None,
+		planned_release_times:Sequence[datetime] = ()
+		):
+		self.release_times = release_times
+		self.skipped_releases = skipped_releases
+		self.num_releases = num_releases
+		self.timestamps = release_timestamps(release_times)
+		self.initial_timestamp = release_timestamps([initial_release_time or release_times[0]])[0]
+		self.planned_timestamps = release_timestamps(list(planned_release_times))
+
+# Release schedules by ID, compiled once for the run, for csv files whose last column is the schedule ID of each transfer.
+# Rows with an empty schedule ID use the schedule default_id.
+class ScheduleBook:
+	def __init__(self, schedules:Dict[str, ReleaseSchedule], default_id:str, is_welcome:bool, today:date):
+		if default_id not in schedules:
+			raise ValueError(f"Default schedule \"{default_id}\" is not defined")
+		self.compiled:Dict[str, CompiledSchedule] = {}
+		for schedule_id, schedule in schedules.items():
+			try:
+				self.compiled[schedule_id] = schedule.compile(is_welcome, today)
+			except ValueError as e:
+				raise ValueError(f"Invalid schedule \"{schedule_id}\": {e}")
+		self.compiled[""] = self.compiled[default_id]
+
+	def default(self) -> CompiledSchedule:
+		return self.compiled[""]
+
+	# Split the schedule ID from a csv row, and return the remaining row and the ID.
+	# Raises a ValueError if the row has the wrong number of columns or an unknown schedule ID.
+	def split_row(self, row_number:int, row_data:List[str], is_welcome:bool) -> Tuple[List[str], str]:
+		num_columns = 4 if is_welcome else 5
+		if len(row_data) != num_columns:
+			raise ValueError(f"Incorrect file format. Each row must contain exactly {num_columns} entries, including the schedule ID. Row {row_number} contains {len(row_data)}.")
+		schedule_id = row_data[-1].strip()
+		if schedule_id not in self.compiled:
+			raise ValueError(f"Unknown schedule \"{schedule_id}\" in row {row_number}.")
+		return (row_data[:-1], sys.intern(schedule_id))
+
+# Returns the schedule of get_config, which is the only schedule if no schedule definition file is given.
+def config_schedule(config:Dict[str, Any], is_welcome:bool) -> ReleaseSchedule:
+	initial_release_time = config["welcome_release_time"] if is_welcome else config["initial_release_time"]
+	return ReleaseSchedule(config["num_releases"], initial_release_time, config["first_rem_release_time"])
+
+# Units of the cadence of schedules in schedule definition files
+cadence_units:List[str] = ["years", "months", "weeks", "days", "hours"]
+
+# Parse an ISO 8601 time with time zone from a schedule definition file.
+def parse_schedule_time(value:Any, name:str) -> datetime:
+	if not isinstance(value, str):
+		raise ValueError(f"{name} must be a string")
+	release_time = datetime.fromisoformat(value)
+	if release_time.tzinfo is None:
+		raise ValueError(f"{name} \"{value}\" must have a time zone")
+	return release_time
+
+# Parse a single schedule of a schedule definition file (see load_schedule_file).
+def parse_schedule_definition(definition:Dict[str, Any]) -> ReleaseSchedule:
+	num_releases = definition["releases"]
+	# Booleans are ints in python, but not numbers in json
+	if not isinstance(num_releases, int) or isinstance(num_releases, bool) or num_releases < 1:
+		raise ValueError("releases must be a positive integer")
+	cadence_definition = definition.get("cadence", {"months": 1})
+	if not isinstance(cadence_definition, dict) or not set(cadence_definition) <= set(cadence_units) \
+		or not all(isinstance(value, int) and not isinstance(value, bool) and value >= 0 for value in cadence_definition.values()):
+		raise ValueError(f"cadence must map some of {', '.join(cadence_units)} to non-negative integers")
+	cadence = relativedelta(**cadence_definition)
+	initial_release_time = parse_schedule_time(definition["initial_release"], "initial_release")
+	if initial_release_time + cadence <= initial_release_time:
+		raise ValueError("cadence must be positive")
+	if "first_remaining_release" in definition:
+		first_rem_release_time = parse_schedule_time(definition["first_remaining_release"], "first_remaining_release")
+	else:
+		first_rem_release_time = initial_release_time + cadence
+	earliest_definition = definition.get("earliest_release")
+	if earliest_definition is None:
+		earliest_release = default_earliest_release
+	elif isinstance(earliest_definition, dict):
+		days = earliest_definition.get("days")
+		if not isinstance(days, int) or isinstance(days, bool) or not isinstance(earliest_definition.get("time"), str):
+			raise ValueError("earliest_release must have an integer \"days\" and a \"time\"")
+		time_of_day = time.fromisoformat(earliest_definition["time"])
+		if time_of_day.tzinfo is None:
+			raise ValueError(f"time \"{earliest_definition['time']}\" of earliest_release must have a time zone")
+		earliest_release = (earliest_definition["days"], time_of_day)
+	else:
+		earliest_release = parse_schedule_time(earliest_definition, "earliest_release")
+	return ReleaseSchedule(num_releases, initial_release_time, first_rem_release_time, cadence, earliest_release)
+
+# Read a schedule definition file, which replaces the schedule and separators of get_config. The file contains a json object with
+#  "schedules": the release schedules by ID, each an object with
+#    "releases": the number of releases, at least 2, which is ignored for welcome transfers,
+#    "initial_release": time of the initial release, which is the only release of welcome transfers,
+#    "first_remaining_release": time of the first remaining release (default one cadence after the initial release),
+#    "cadence": time between the remaining releases, e.g., {"months": 1} (default) or {"weeks": 2},
+#    "earliest_release": releases before this time are combined into one release at this time, either a fixed time
+#      or {"days": d, "time": t} for time t on the d-th day after the run (default {"days": 1, "time": "14:00:00+01:00"}),
+#  "default_schedule": ID of the schedule of rows without schedule ID (default "default"),
+#  "csv_delimiter", "thousands_sep", "decimal_sep": optional separators replacing those of config.
+# Times are ISO 8601 strings with time zone, e.g. "2021-08-26T14:00:00+01:00".
+# Returns the schedules by ID, the ID of the default schedule, and config with the separators of the file.
+def load_schedule_file(filename:str, config:Dict[str, Any]) -> Tuple[Dict[str, ReleaseSchedule], str, Dict[str, Any]]:
+	with open(filename, encoding='utf-8') as schedule_file:
+		definitions = json.load(schedule_file)
+	if not isinstance(definitions, dict) or not isinstance(definitions.get("schedules"), dict) or not definitions["schedules"]:
+		raise ValueError("the file must contain a json object with at least one schedule in \"schedules\"")
+	schedules = {}
+	for schedule_id, definition in definitions["schedules"].items():
+		if schedule_id != schedule_id.strip() or not schedule_id:
+			raise ValueError(f"invalid schedule ID \"{schedule_id}\"")
+		try:
+			schedules[schedule_id] = parse_schedule_definition(definition)
+		except (ValueError, KeyError, TypeError) as e:
+			reason = f"missing {e}" if isinstance(e, KeyError) else str(e)
+			raise ValueError(f"invalid schedule \"{schedule_id}\": {reason}")
+	config = dict(config)
+	for name in ["csv_delimiter", "thousands_sep", "decimal_sep"]:
+		if name in definitions:
+			if not isinstance(definitions[name], str):
+				raise ValueError(f"\"{name}\" must be a string")
+			config[name] = definitions[name]
+	default_schedule_id = definitions.get("default_schedule", "default")
+	if not isinstance(default_schedule_id, str):
+		raise ValueError("\"default_schedule\" must be a schedule ID string")
+	return (schedules, default_schedule_id, config)
+
 # Returns list of amounts contructed by splitting remaining_amount into num_releases
 # and adding all skipped releases with initial_amount into the initial amount
 def amounts_to_scheduled_list(
@@ -245,32 +1922,1402 @@ def amounts_to_scheduled_list(
 		regular_amounts = [initial_amount, *remaining_amount.split_amount(num_releases-1)]
 
 		# add all skipped amounts into initial amount and put remaining ones after that in list
-		initial_amount = sum(regular_amounts[1:(skipped_releases+1)], regular_amounts[0])
+		initial_amount = TransferAmount(sum(amount.amount for amount in regular_amounts[:(skipped_releases+1)]))
 		amounts = [initial_amount, *regular_amounts[skipped_releases+1:]]
 
 		return amounts
 		
 
-# Main function
-def main():
-	config = get_config()
-	num_releases = config["num_releases"]
-	welcome_release_time = config["welcome_release_time"]
-	initial_release_time = config["initial_release_time"]
-	first_rem_release_time = config["first_rem_release_time"]
-	csv_delimiter = config["csv_delimiter"]
-	thousands_sep = config["thousands_sep"]
-	decimal_sep = config["decimal_sep"]
+# Returns the timestamps in milliseconds of the given release times, as used in pre-proposals.
+def release_timestamps(release_times:List[datetime]) -> List[int]:
+	return [int(release_time.timestamp()) * 1000 for release_time in release_times]
 
-	# proposals expire 2 hours from now
-	transaction_expiry = datetime.now() + relativedelta(hours = +2) 
-	# If regular releases are before earliest_release_time, they get combined into one at that time.
-	# earliest_release_time = 14:00 CET tomorrow.
-	# This can be later than all release times, in which case all releases happen at that time.
-	earliest_release_time = datetime.combine(date.today(), time.fromisoformat("14:00:00+01:00")) + relativedelta(days = +1)
+# Compute the compact schedules of all transfers in a batch in one pass over its amount columns.
+# The amounts are exactly those of amounts_to_scheduled_list: the remaining amount is split into num_releases-1 releases
+# using floor division with the remainder in the last release, and the skipped releases are added to the initial release.
+def compact_schedule_batch(batch:TransferBatch, num_releases:int, skipped_releases:int) -> List[CompactSchedule]:
+	if batch.is_welcome:
+		# welcome transfer only has one amount
+		return [CompactSchedule(amount) for amount in batch.initial_amounts]
+	if skipped_releases >= num_releases:
+		raise ValueError("The number of skipped releases must be less than total number of releases.")
+	if num_releases <= 1:
+		raise AssertionError(f"Cannot split into {num_releases - 1} parts")
+	split = CompactSchedule.split
+	return [split(initial_amount, remaining_amount, num_releases, skipped_releases)
+		for initial_amount, remaining_amount in zip(batch.initial_amounts, batch.remaining_amounts)]
+
+# Returns the release amounts in microGTU of a single transfer, exactly as computed by compact_schedule_batch.
+# Raises the errors of CompactSchedule.split, i.e., an AssertionError if the remaining amount cannot be split.
+def release_amounts(initial_amount:int, remaining_amount:int, num_releases:int, skipped_releases:int) -> List[int]:
+	return list(CompactSchedule.split(initial_amount, remaining_amount, num_releases, skipped_releases).amounts())
+
+# Compute the compact schedules of all transfers in a batch with a schedule ID for each transfer, scheduling the transfers of
+# each schedule together with compact_schedule_batch. Returns the schedule of each transfer with the timestamps of its releases.
+def schedule_mixed_batch(batch:TransferBatch, schedules:ScheduleBook) -> List[Tuple[CompactSchedule, List[int]]]:
+	groups:Dict[str, List[int]] = {}
+	for i, schedule_id in enumerate(batch.schedule_ids):
+		groups.setdefault(schedule_id, []).append(i)
+	releases:List[Tuple[CompactSchedule, List[int]]] = [None] * len(batch)
+	for schedule_id, indices in groups.items():
+		schedule = schedules.compiled[schedule_id]
+		for i, compact_schedule in zip(indices, compact_schedule_batch(batch.select(indices), schedule.num_releases, schedule.skipped_releases)):
+			releases[i] = (compact_schedule, schedule.timestamps)
+	return releases
+
+# Returns the compact schedule of a single transfer in the format of parse_row.
+def transfer_schedule(transfer:Dict[str, Any], is_welcome:bool, num_releases:int, skipped_releases:int) -> CompactSchedule:
+	if is_welcome:
+		# welcome transfer only has one amount
+		return CompactSchedule(transfer["amount"].amount)
+	return CompactSchedule.split(transfer["initial_amount"].amount, transfer["remaining_amount"].amount, num_releases, skipped_releases)
+
+# Create the pre-proposal for a single transfer with a schedule ID (see parse_scheduled_row), using its compiled schedule.
+def build_scheduled_pre_proposal(transfer:Dict[str, Any], is_welcome:bool, schedules:ScheduleBook, expiry:datetime) -> CompactPreProposal:
+	schedule = schedules.compiled[transfer["schedule_id"]]
+	compact_schedule = transfer_schedule(transfer, is_welcome, schedule.num_releases, schedule.skipped_releases)
+	return CompactPreProposal(transfer["sender_address"], transfer["receiver_address"], expiry, compact_schedule, schedule.timestamps)
+
+# Create the pre-proposal for a single transfer, using the given release schedule.
+# The timestamps of release_times can be given, such that they are computed once for all transfers.
+def build_pre_proposal(
+	transfer:Dict[str, Any],
+	is_welcome:bool,
+	release_times:List[datetime],
+	skipped_releases:int,
+	num_releases:int,
+	expiry:datetime,
+	timestamps:Optional[List[int]] = None
+	) -> CompactPreProposal:
+	if timestamps is None:
+		timestamps = release_timestamps(release_times)
+	compact_schedule = transfer_schedule(transfer, is_welcome, num_releases, skipped_releases)
+	return CompactPreProposal(transfer["sender_address"], transfer["receiver_address"], expiry, compact_schedule, timestamps)
+
+# Yields (transfer_number, pre_proposal) for the given (transfer_number, transfer) tuples, built with build(transfer_number, transfer).
+# A transfer that cannot be scheduled, e.g., because its remaining amount is too small to split, raises a ValueError with its row number.
+def build_pre_proposals(
+	transfers:Iterable[Tuple[int, Dict[str, Any]]],
+	build:Callable[[int, Dict[str, Any]], CompactPreProposal]
+	) -> Iterator[Tuple[int, CompactPreProposal]]:
+	for transfer_number, transfer in transfers:
+		try:
+			pre_proposal = build(transfer_number, transfer)
+		except (ValueError, AssertionError) as error:
+			raise ValueError(f"In row {transfer_number}: {error}")
+		yield (transfer_number, pre_proposal)
+
+# Expiries of pre-proposals that are generated in chunks of chunk_size rows, for batches that cannot be imported and signed
+# before a single expiry. The first chunk expires at first_expiry, and every further chunk expires later by the time
+# needed to sign one chunk at signing_rate pre-proposals per hour.
+# Chunks are given by row numbers, such that a row gets the same chunk and expiry in every shard and worker process.
+class ExpiryChunks:
+	__slots__ = ("first_expiry", "chunk_size", "chunk_seconds")
+
+	def __init__(self, first_expiry:datetime, chunk_size:int, signing_rate:int):
+		self.first_expiry = int(first_expiry.timestamp())
+		self.chunk_size = chunk_size
+		self.chunk_seconds = chunk_size * 3600 / signing_rate
+
+	# Returns the same chunks, with the first chunk expiring at the given timestamp.
+	def starting_at(self, first_expiry:int) -> 'ExpiryChunks':
+		chunks = copy.copy(self)
+		chunks.first_expiry = first_expiry
+		return chunks
+
+	# Returns the index of the chunk of a row, starting at 0.
+	def chunk(self, row_number:int) -> int:
+		return (row_number - 1) // self.chunk_size
+
+	# Returns the number of chunks of a csv file with row_count rows.
+	def chunk_count(self, row_count:int) -> int:
+		return -(-row_count // self.chunk_size)
+
+	# Returns the expiry timestamp of a chunk.
+	def chunk_expiry(self, chunk:int) -> int:
+		return self.first_expiry + int(chunk * self.chunk_seconds)
+
+	# Returns the expiry of the pre-proposal of a row.
+	def expiry(self, row_number:int) -> datetime:
+		return datetime.fromtimestamp(self.chunk_expiry(self.chunk(row_number)), timezone.utc)
+
+	# Splits runs [first, last] of consecutive rows at chunk boundaries, and yields the runs of each chunk that has rows.
+	def split_runs(self, row_runs:Iterable[List[int]]) -> Iterator[Tuple[int, List[List[int]]]]:
+		chunk = None
+		runs:List[List[int]] = []
+		for first, last in row_runs:
+			while first <= last:
+				run_chunk = self.chunk(first)
+				run_last = min(last, (run_chunk + 1) * self.chunk_size)
+				if run_chunk != chunk:
+					if runs:
+						yield (chunk, runs)
+					(chunk, runs) = (run_chunk, [])
+				runs.append([first, run_last])
+				first = run_last + 1
+		if runs:
+			yield (chunk, runs)
+
+# Returns the expiry of the pre-proposal of a row with the settings of a generation run (see main) or worker job.
+def row_expiry(settings:Dict[str, Any], row_number:int) -> datetime:
+	expiry_chunks = settings["expiry_chunks"]
+	return settings["expiry"] if expiry_chunks is None else expiry_chunks.expiry(row_number)
+
+# Number of csv rows sent to a worker process at a time when generating in parallel.
+parallel_chunk_size:int = 1000
+
+# Settings of the current generation run, set once in each worker process by init_worker.
+worker_job:Dict[str, Any] = {}
+
+def init_worker(job:Dict[str, Any]) -> None:
+	global worker_job
+	worker_job = job
+
+# Serialize a pre-proposal in a worker process, as required by the output format and manifest of the job.
+def serialize_for_job(pre_proposal:Union[ScheduledPreProposal, CompactPreProposal], job:Dict[str, Any]) -> SerializedPreProposal:
+	input_digest = pre_proposal.input_digest() if job["input_digests"] else None
+	return SerializedPreProposal(pre_proposal.to_json(indent=job["indent"]), job["indent"], input_digest)
+
+# Returns the rows of a chunk in a worker process. Chunks are either lists of rows, or ranges of the csv file which are read and parsed here.
+def chunk_rows(chunk:Union[List[Tuple[int, List[str]]], CsvRange], job:Dict[str, Any]) -> List[Tuple[int, List[str]]]:
+	if isinstance(chunk, CsvRange):
+		return chunk.read(job["csv_delimiter"])
+	return chunk
+
+# Validate a chunk of csv rows and serialize their pre-proposals in a worker process.
+# Returns a list of (row_number, pre_proposal) tuples in row order for all rows before the first invalid row,
+# together with the error for that row, if any.
+# If expiry_chunks is set, it replaces the expiry chunks of the job, e.g., those kept by the manifest of the csv file.
+def generate_chunk(
+	rows:Union[List[Tuple[int, List[str]]], CsvRange],
+	expiry_chunks:Optional[ExpiryChunks] = None
+	) -> Tuple[List[Tuple[int, SerializedPreProposal]], Optional[Exception]]:
+	(result, error, _) = generate_chunk_with_batch(rows, expiry_chunks)
+	return (result, error)
+
+# Same as generate_chunk, but also returns the batch of validated transfers, e.g., for a TransferReport.
+def generate_chunk_with_batch(
+	rows:Union[List[Tuple[int, List[str]]], CsvRange],
+	expiry_chunks:Optional[ExpiryChunks] = None
+	) -> Tuple[List[Tuple[int, SerializedPreProposal]], Optional[Exception], TransferBatch]:
+	job = worker_job
+	if expiry_chunks is not None:
+		job = dict(job, expiry_chunks=expiry_chunks)
+	rows = chunk_rows(rows, job)
+	schedules = job["schedules"]
+	batch = TransferBatch(job["is_welcome"])
+	error = None
+	try:
+		for row_number, row_data in rows:
+			batch.append_row(row_number, row_data, job["decimal_sep"], job["thousands_sep"], schedules)
+	except ValueError as row_error:
+		error = row_error
+
+	try:
+		if schedules is None:
+			releases = zip(compact_schedule_batch(batch, job["num_releases"], job["skipped_releases"]), itertools.repeat(job["release_timestamps"]))
+		else:
+			releases = schedule_mixed_batch(batch, schedules)
+	except (ValueError, AssertionError):
+		# Schedule the rows one by one to find the rows before the first one that cannot be scheduled.
+		result = []
+		try:
+			for i in range(len(batch)):
+				if schedules is None:
+					pre_proposal = build_pre_proposal(batch[i], job["is_welcome"], job["release_times"], job["skipped_releases"], job["num_releases"], row_expiry(job, batch.row_numbers[i]))
+				else:
+					pre_proposal = build_scheduled_pre_proposal(batch[i], job["is_welcome"], schedules, row_expiry(job, batch.row_numbers[i]))
+				result.append((batch.row_numbers[i], serialize_for_job(pre_proposal, job)))
+		except (ValueError, AssertionError) as schedule_error:
+			return (result, ValueError(f"In row {batch.row_numbers[i]}: {schedule_error}"), batch)
+		return (result, error, batch)
+
+	result = []
+	if job["indent"] == 4 and not job["input_digests"]:
+		# Fill in the pre-proposal templates directly, without creating pre-proposal dicts
+		expiry = int(job["expiry"].timestamp())
+		expiry_chunks = job["expiry_chunks"]
+		for i, (compact_schedule, timestamps) in enumerate(releases):
+			if expiry_chunks is not None:
+				expiry = expiry_chunks.chunk_expiry(expiry_chunks.chunk(batch.row_numbers[i]))
+			content = pre_proposal_json(batch.senders[i], batch.receivers[i], expiry, compact_schedule.releases(timestamps))
+			result.append((batch.row_numbers[i], SerializedPreProposal(content)))
+		return (result, error, batch)
+	for i, (compact_schedule, timestamps) in enumerate(releases):
+		pre_proposal = CompactPreProposal(batch.senders[i], batch.receivers[i], row_expiry(job, batch.row_numbers[i]), compact_schedule, timestamps)
+		result.append((batch.row_numbers[i], serialize_for_job(pre_proposal, job)))
+	return (result, error, batch)
+
+# Yield the pre-proposals of a finished chunk, and raise the error of its first invalid row afterwards.
+# If report is set, the chunk must be generated by generate_chunk_with_batch, and its transfers are added to the report.
+def chunk_results(future, report:Optional[TransferReport] = None) -> Iterator[Tuple[int, SerializedPreProposal]]:
+	if report is None:
+		(result, error) = future.result()
+	else:
+		(result, error, batch) = future.result()
+		report.add_batch(batch)
+	yield from result
+	if error is not None:
+		raise error
+
+# Split an iterable into lists of at most chunk_size elements.
+def chunked(iterable, chunk_size:int) -> Iterator[List[Any]]:
+	iterator = iter(iterable)
+	while True:
+		chunk = list(itertools.islice(iterator, chunk_size))
+		if not chunk:
+			return
+		yield chunk
+
+# Generate pre-proposals for the given chunks of csv rows or ranges of a csv file (see chunk_rows),
+# with an executor whose workers were initialized with init_worker.
+# The executor can be shared by several csv files that are generated with the same job.
+# Results are yielded in row order, so the output and the first reported error are the same as for a serial run.
+# At most 2*jobs chunks are in flight at any time, which keeps memory bounded for large files.
+# If report is set, all validated transfers are added to it in row order. If expiry_chunks is set, it replaces those of the job.
+def iter_proposals_executor(
+	executor:ProcessPoolExecutor,
+	chunks:Iterable[Union[List[Tuple[int, List[str]]], CsvRange]],
+	jobs:int,
+	report:Optional[TransferReport] = None,
+	expiry_chunks:Optional[ExpiryChunks] = None
+	) -> Iterator[Tuple[int, SerializedPreProposal]]:
+	generate = generate_chunk if report is None else generate_chunk_with_batch
+	pending = deque()
+	try:
+		for chunk in chunks:
+			pending.append(executor.submit(generate, chunk, expiry_chunks))
+			if len(pending) >= 2*jobs:
+				yield from chunk_results(pending.popleft(), report)
+		while pending:
+			yield from chunk_results(pending.popleft(), report)
+	finally:
+		# Do not process remaining chunks if we stopped early, e.g., because of an invalid row.
+		for future in pending:
+			future.cancel()
+
+# Validate a single csv row and return all its errors as (row_number, column, reason) tuples, where column is the
+# 1-based column number, or None if the row has the wrong number of columns.
+# Unlike parse_row, validation continues after the first error, and amounts are also checked against the release schedule.
+# If schedules are given, the last column is the schedule ID, and amounts are checked against that schedule.
+def check_row(
+	row_number:int,
+	row_data:List[str],
+	is_welcome:bool,
+	decimal_sep:str,
+	thousands_sep:str,
+	num_releases:int,
+	skipped_releases:int,
+	schedules:Optional[ScheduleBook] = None
+	) -> List[Tuple[int, Optional[int], str]]:
+	num_columns = 3 if is_welcome else 4
+	errors = []
+	if schedules is not None:
+		# The last column is the schedule ID, whose schedule replaces the given one
+		if len(row_data) != num_columns + 1:
+			return [(row_number, None, f"Row must contain exactly {num_columns + 1} entries, including the schedule ID, but contains {len(row_data)}.")]
+		schedule_id = row_data[num_columns].strip()
+		schedule = schedules.compiled.get(schedule_id)
+		if schedule is None:
+			errors.append((row_number, num_columns + 1, f"Unknown schedule \"{schedule_id}\"."))
+		else:
+			(num_releases, skipped_releases) = (schedule.num_releases, schedule.skipped_releases)
+		row_data = row_data[:num_columns]
+	elif len(row_data) != num_columns:
+		return [(row_number, None, f"Row must contain exactly {num_columns} entries, but contains {len(row_data)}.")]
+	for column, role in [(1, "sender"), (2, "receiver")]:
+		if not is_valid_address(row_data[column - 1]):
+			errors.append((row_number, column, f"Invalid {role} address \"{row_data[column - 1]}\"."))
+	amounts = []
+	for column in range(3, num_columns + 1):
+		try:
+			amounts.append(TransferAmount.parse_micro_GTU(row_data[column - 1], decimal_sep, thousands_sep))
+		except ValueError as error:
+			errors.append((row_number, column, str(error)))
+	if len(amounts) == 2 and (schedules is None or schedule is not None):
+		# Same checks as compact_schedule_batch, such that every row it rejects is reported
+		(initial_amount, remaining_amount) = amounts
+		try:
+			release_amounts(initial_amount, remaining_amount, num_releases, skipped_releases)
+		except AssertionError as error:
+			# the remaining amount cannot be split, or there are no releases to split it into
+			errors.append((row_number, 4 if num_releases > 1 else None, str(error)))
+		except ValueError as error:
+			# the initial release is too large, or the schedule skips all its releases
+			errors.append((row_number, 3 if skipped_releases < num_releases else None, str(error)))
+	return errors
+
+# Validate a chunk of csv rows or a range of a csv file in a worker process, and return the number of rows and the errors of all rows.
+def check_chunk(rows:Union[List[Tuple[int, List[str]]], CsvRange]) -> Tuple[int, List[Tuple[int, Optional[int], str]]]:
+	job = worker_job
+	rows = chunk_rows(rows, job)
+	errors = []
+	for row_number, row_data in rows:
+		errors += check_row(row_number, row_data, job["is_welcome"], job["decimal_sep"], job["thousands_sep"], job["num_releases"], job["skipped_releases"], job["schedules"])
+	return (len(rows), errors)
+
+# Returns the description of an error found by check_row.
+def format_row_error(error:Tuple[int, Optional[int], str]) -> str:
+	(row_number, column, reason) = error
+	if column is None:
+		return f"Row {row_number}: {reason}"
+	return f"Row {row_number}, column {column}: {reason}"
+
+# Returns the name of the file that could not be written because of error.
+# Background writers report errors of earlier files, so the file name of the error is used if it is known.
+def write_error_file_name(error:IOError, output_format:str, out_file_name:str, output_container:str) -> str:
+	if output_format != "files":
+		return output_container
+	return error.filename if error.filename else out_file_name
+
+# Close writer after generation stopped because of an error, such that all pre-proposals before the error are written
+# and recorded in the manifest, if any. Write errors are ignored, as the error that stopped the generation is reported instead.
+def close_writer_after_error(writer:ProposalFileWriter, manifest:Optional[ProposalManifest] = None) -> None:
+	try:
+		writer.close()
+	except Exception:
+		# The error that is already being raised is reported instead
+		pass
+	if manifest is not None:
+		manifest.close()
+
+# Raised when the pre-proposals of a csv file cannot be generated, with the message and exit code to report.
+class GenerationError(Exception):
+	def __init__(self, message:str, exit_code:int):
+		super().__init__(message)
+		self.exit_code = exit_code
+
+# Returns the prefix of the pre-proposal files generated for csv_input_file in output_dir.
+def output_prefix(csv_input_file:str, output_dir:str = "") -> str:
+	return os.path.join(output_dir, "pre-proposal_" + os.path.splitext(os.path.basename(csv_input_file))[0])
+
+# Returns the name of the pre-proposal file of a row of a csv file, for csv files whose row numbers have the given number of digits.
+# Compressed files have the suffix of their compression.
+def proposal_file_name(prefix:str, row_number:int, digits:int, suffix:str = "") -> str:
+	return prefix + "_" + str(row_number).zfill(digits) + ".json" + suffix
+
+# Result of generating the pre-proposals of a csv file with row_count rows, or of a shard of it, whose files have row numbers of digits digits.
+# Unless counted for contiguous shards, row_count is only known once all rows are generated.
+# The rows of the generated pre-proposals are kept as runs [first, last] of consecutive rows, which are few even for huge files.
+# Hashed shards are the exception, as their rows are spread over the whole file. Their rows are not kept, but found again
+# in csv_input_file when needed, such that memory does not grow with the number of rows.
+class GeneratedFile:
+	def __init__(self, row_count:int, digits:int, shard:Optional[Shard] = None, report:Optional[TransferReport] = None, csv_input_file:str = "", csv_delimiter:str = ","):
+		self.row_count = row_count
+		self.digits = digits
+		self.shard = shard
+		self.report = report
+		self.csv_input_file = csv_input_file
+		self.csv_delimiter = csv_delimiter
+		self.keeps_rows = shard is None or not shard.hashed
+		self.row_runs:List[List[int]] = []
+		self.last_generated_row = 0
+		self.transfer_count = 0
+		self.unchanged_count = 0
+		# Merkle root of the pre-proposals, if their digests are recorded
+		self.digest_root:Optional[str] = None
+		# Bytes of the written json before and after compression, if compressed
+		self.output_bytes:Optional[Tuple[int, int]] = None
+		# Chunks of the pre-proposals with their expiry timestamps, if generated in expiry chunks
+		self.chunk_expiries:List[Tuple[int, int]] = []
+
+	def add_row(self, row_number:int) -> None:
+		self.transfer_count += 1
+		self.last_generated_row = row_number
+		if not self.keeps_rows:
+			return
+		if self.row_runs and self.row_runs[-1][1] == row_number - 1:
+			self.row_runs[-1][1] = row_number
+		else:
+			self.row_runs.append([row_number, row_number])
+
+	def row_numbers(self) -> Iterator[int]:
+		if not self.keeps_rows:
+			for row_number, row_data in read_csv_rows(self.csv_input_file, self.csv_delimiter):
+				if self.shard.contains(row_number, row_data):
+					yield row_number
+			return
+		for first, last in self.row_runs:
+			yield from range(first, last + 1)
+
+	# Yields the runs [first, last] of consecutive generated rows.
+	def runs(self) -> Iterator[List[int]]:
+		if self.keeps_rows:
+			yield from self.row_runs
+			return
+		run = None
+		for row_number in self.row_numbers():
+			if run is not None and run[1] == row_number - 1:
+				run[1] = row_number
+				continue
+			if run is not None:
+				yield run
+			run = [row_number, row_number]
+		if run is not None:
+			yield run
+
+	def last_row(self) -> int:
+		return self.last_generated_row
+
+# Returns the sha256 digest of a csv file, such that shards can be checked to be generated from the same file.
+def csv_file_digest(filename:str) -> str:
+	digest = hashlib.sha256()
+	with open(filename, 'rb') as csvfile:
+		for block in iter(partial(csvfile.read, 1<<20), b""):
+			digest.update(block)
+	return digest.hexdigest()
+
+# Write the shard manifest of a generated shard of csv_input_file, which is checked by --merge-shards.
+# The manifest of a contiguous shard has the runs of its rows, while the rows of a hashed shard are given by its index,
+# number of shards and the csv file, and are found again by --merge-shards.
+def write_shard_manifest(filename:str, csv_input_file:str, result:GeneratedFile, output_format:str, compression:Optional[str] = None) -> None:
+	shard_manifest = {
+		"input_csv" : os.path.basename(csv_input_file),
+		"input_digest" : csv_file_digest(csv_input_file),
+		"rows" : result.row_count,
+		"shard" : result.shard.index,
+		"shards" : result.shard.count,
+		"mode" : "hashed" if result.shard.hashed else "contiguous",
+		"output_format" : output_format,
+		"compression" : compression,
+		"digits" : result.digits,
+		"transfers" : result.transfer_count,
+		"csv_delimiter" : result.csv_delimiter
+	}
+	if not result.shard.hashed:
+		shard_manifest["row_runs"] = result.row_runs
+	with open(filename, 'w') as manifest_file:
+		json.dump(shard_manifest, manifest_file)
+
+# Returns the name of the manifest of a chunk of a csv file with chunk_count chunks.
+def chunk_manifest_file_name(prefix:str, chunk:int, chunk_count:int) -> str:
+	return prefix + ".chunk" + str(chunk).zfill(len(str(max(chunk_count - 1, 0)))) + ".json"
+
+# Write a manifest for each chunk of expiry_chunks that has generated pre-proposals, with the expiry of the chunk and the names of its
+# pre-proposals, i.e., the files next to the manifest or the entries of container, such that chunks can be imported and signed one after another.
+# Returns the written chunks with their expiry timestamps.
+def write_chunk_manifests(
+	prefix:str,
+	proposal_prefix:str,
+	csv_input_file:str,
+	result:GeneratedFile,
+	expiry_chunks:ExpiryChunks,
+	output_format:str,
+	container:Optional[str] = None,
+	file_suffix:str = ""
+	) -> List[Tuple[int, int]]:
+	chunk_count = expiry_chunks.chunk_count(result.row_count)
+	chunk_expiries = []
+	for chunk, runs in expiry_chunks.split_runs(result.runs()):
+		expiry = expiry_chunks.chunk_expiry(chunk)
+		names = [proposal_file_name(proposal_prefix, row_number, result.digits, file_suffix) for first, last in runs for row_number in range(first, last + 1)]
+		chunk_manifest = {
+			"input_csv" : os.path.basename(csv_input_file),
+			"chunk" : chunk,
+			"chunks" : chunk_count,
+			"expiry" : expiry,
+			"expiry_time" : datetime.fromtimestamp(expiry, timezone.utc).isoformat(),
+			"output_format" : output_format,
+			"container" : os.path.basename(container) if container is not None else None,
+			"transfers" : len(names),
+			"row_runs" : runs,
+			"proposals" : names if container is not None else [os.path.basename(name) for name in names]
+		}
+		with open(chunk_manifest_file_name(prefix, chunk, chunk_count), 'w') as manifest_file:
+			json.dump(chunk_manifest, manifest_file, indent=4)
+		chunk_expiries.append((chunk, expiry))
+	return chunk_expiries
+
+# Generate the pre-proposals for a single csv file with the given settings (see main).
+# If executor is set, rows are validated and serialized by its jobs worker processes, which must be initialized with the job of settings.
+# If a shard is set, only the rows of that shard are generated, numbered by their row in the whole csv file, and a shard manifest is written.
+# Returns the rows of the generated pre-proposals, the number of unchanged pre-proposals that were not rewritten,
+# and the report of duplicates and per-sender totals, which is written next to the pre-proposals unless disabled in settings.
+def generate_file(
+	csv_input_file:str,
+	settings:Dict[str, Any],
+	metrics:Optional[StageMetrics] = None,
+	executor:Optional[ProcessPoolExecutor] = None,
+	jobs:int = 1
+	) -> GeneratedFile:
+	output_format = settings["output_format"]
+	dry_run = settings["dry_run"]
+	prefix = output_prefix(csv_input_file, settings["output_dir"])
+
+	# The number of lines sets the number of digits of the file names. Only contiguous shards need the number of rows before generating,
+	# otherwise rows are counted while they are generated, such that the first pre-proposal is written right away.
+	try:
+		check_delimiters(settings["decimal_sep"], settings["thousands_sep"], settings["csv_delimiter"])
+		digits = row_number_digits(count_csv_lines(csv_input_file))
+		is_contiguous_shard = settings["shard"] is not None and settings["shard_mode"] == "contiguous"
+		row_count = count_csv_rows(csv_input_file, settings["csv_delimiter"]) if is_contiguous_shard else 0
+	except IOError as e:
+		raise GenerationError(f"Error reading file \"{csv_input_file}\": {e}", 3)
+	except ValueError as e:
+		raise GenerationError(f"Error: {e}", 2)
+	shard = None
+	if settings["shard"] is not None:
+		(shard_index, shard_count) = settings["shard"]
+		shard = Shard(shard_index, shard_count, settings["shard_mode"] == "hashed", row_count)
+		# Files written once per csv file are written once per shard, such that shards do not overwrite each other's files
+		shard_prefix = prefix + shard.suffix()
+	else:
+		shard_prefix = prefix
+	#In container formats, all pre-proposals are written to a single file, which is compressed as a whole
+	suffix = compression_suffix(settings["compression"])
+	file_suffix = suffix if output_format == "files" else ""
+	output_container = shard_prefix + "." + output_format + suffix
+
+	try:
+		writer = open_writer(output_format, output_container, settings["fsync_batch"], settings["compression"], settings["compress_level"])
+	except IOError:
+		raise GenerationError(f"Error writing file \"{output_container}\".", 3)
+	# Compressed bytes are counted by the writer of the output format
+	output_writer = writer
+	if settings["async_write"]:
+		writer = BackgroundWriter(writer, settings["write_queue_size"])
+
+	# Digests are recorded in row order as pre-proposals are passed to the writer, also if they are written in the background
+	digests = None
+	if settings["digests"] and not dry_run:
+		try:
+			digests = DigestManifest(shard_prefix)
+		except IOError:
+			close_writer_after_error(writer)
+			raise GenerationError(f"Error writing file \"{shard_prefix}.sha256\".", 3)
+		writer = DigestingWriter(writer, digests)
+
+	manifest = None
+	if settings["incremental"]:
+		manifest_file_name = shard_prefix + ".manifest"
+		try:
+			manifest = ProposalManifest(manifest_file_name, settings["memory_budget"])
+		except (IOError, ValueError, KeyError):
+			close_writer_after_error(writer)
+			raise GenerationError(f"Error reading file \"{manifest_file_name}\".", 3)
+		if settings["expiry_chunks"] is not None:
+			# Chunks keep the expiries of the earlier run, such that unchanged files are not rescheduled
+			settings = dict(settings, expiry_chunks=manifest.expiry_chunks(settings["expiry_chunks"]))
+
+	report = None if settings["report"] == "none" else TransferReport(settings["is_welcome"], settings["memory_budget"])
+	result = GeneratedFile(row_count, digits, shard, report, csv_input_file, settings["csv_delimiter"])
+
+	# Stream transfers from the csv file and write one pre-proposal per transfer as soon as its row is validated.
+	try:
+		if executor is not None:
+			check_delimiters(settings["decimal_sep"], settings["thousands_sep"], settings["csv_delimiter"])
+			# Workers read and parse ranges of the file themselves, so only record boundaries are found here
+			csv_ranges = iter_csv_ranges(csv_input_file, settings["csv_delimiter"])
+			if shard is not None:
+				csv_ranges = shard_ranges(csv_ranges, shard)
+			if metrics is not None:
+				csv_ranges = metrics.timed_iter("csv_split", csv_ranges)
+			pre_proposals = iter_proposals_executor(executor, csv_ranges, jobs, report=report, expiry_chunks=settings["expiry_chunks"])
+			if metrics is not None:
+				# Time spent waiting for worker processes to validate, schedule and serialize rows
+				pre_proposals = metrics.timed_iter("parallel_generation", pre_proposals)
+		else:
+			is_welcome = settings["is_welcome"]
+			schedules = settings["schedules"]
+			if shard is None:
+				transfers = enumerate(iter_transfers(csv_input_file, is_welcome, settings["decimal_sep"], settings["thousands_sep"], settings["csv_delimiter"], metrics, schedules), start=1)
+			else:
+				transfers = iter_shard_transfers(csv_input_file, shard, is_welcome, settings["decimal_sep"], settings["thousands_sep"], settings["csv_delimiter"], metrics, schedules)
+			if report is not None:
+				transfers = report_transfers(report, transfers)
+			if schedules is None:
+				build = build_pre_proposal if metrics is None else metrics.timed("scheduling", build_pre_proposal)
+				timestamps = release_timestamps(settings["release_times"])
+				pre_proposals = build_pre_proposals(transfers, lambda transfer_number, transfer: build(transfer, is_welcome,
+					settings["release_times"], settings["skipped_releases"], settings["num_releases"], row_expiry(settings, transfer_number), timestamps))
+			else:
+				build = build_scheduled_pre_proposal if metrics is None else metrics.timed("scheduling", build_scheduled_pre_proposal)
+				pre_proposals = build_pre_proposals(transfers, lambda transfer_number, transfer: build(transfer, is_welcome, schedules, row_expiry(settings, transfer_number)))
+		write = writer.write
+		serialize = lambda pre_proposal, indent: SerializedPreProposal(pre_proposal.to_json(indent=indent), indent)
+		if metrics is not None:
+			# Pre-proposals are serialized before they are passed to the writer, such that serialization and writing are separate stages
+			serialize = metrics.timed("serialization", serialize)
+			write = metrics.timed("file_write", writer.write)
+
+		for transfer_number, pre_proposal in pre_proposals:
+			out_file_name = proposal_file_name(prefix, transfer_number, result.digits, file_suffix)
+			
+			if manifest is not None:
+				input_digest = pre_proposal.input_digest()
+				expiry = int(row_expiry(settings, transfer_number).timestamp())
+				# In expiry chunks, files are rewritten unless they have the expiry of their chunk, which the chunk manifest lists
+				change = manifest.change(transfer_number, out_file_name, input_digest, expiry if settings["expiry_chunks"] is not None else None)
+				if change is None:
+					result.unchanged_count += 1
+					result.add_row(transfer_number)
+					# The digest of the unchanged file was recorded by the manifest when it was written
+					if digests is not None:
+						digests.add(out_file_name, manifest.entry(transfer_number)["output"])
+					continue
+				if dry_run:
+					print(f"Row {transfer_number}: {out_file_name} is {change}.")
+					result.add_row(transfer_number)
+					continue
+				pre_proposal = serialize(pre_proposal, 4)
+
+			# Finally write json file
+			if metrics is not None and not isinstance(pre_proposal, SerializedPreProposal):
+				pre_proposal = serialize(pre_proposal, writer.indent)
+			on_written = None
+			if manifest is not None:
+				on_written = partial(manifest.add, transfer_number, out_file_name, input_digest, pre_proposal.content, expiry)
+			try:
+				write(out_file_name, pre_proposal, on_written)
+			except IOError as e:
+				close_writer_after_error(writer, manifest)
+				raise GenerationError(f"Error writing file \"{write_error_file_name(e, output_format, out_file_name, output_container)}\".", 3)
+			result.add_row(transfer_number)
+	except IOError as e:
+		close_writer_after_error(writer, manifest)
+		raise GenerationError(f"Error reading file \"{csv_input_file}\": {e}", 3)
+	except (ValueError, AssertionError) as e:
+		# Scheduling errors are raised as AssertionError by CompactSchedule.split
+		close_writer_after_error(writer, manifest)
+		raise GenerationError(f"Error: {e}", 2)
+	except GenerationError:
+		raise
+	except Exception:
+		# Unexpected errors are raised as they are, but a background writer must not be left waiting, e.g., in the daemon
+		close_writer_after_error(writer, manifest)
+		raise
+
+	try:
+		writer.close()
+	except IOError as e:
+		close_writer_after_error(writer, manifest)
+		raise GenerationError(f"Error writing file \"{write_error_file_name(e, output_format, output_container, output_container)}\".", 3)
+	if settings["compression"] is not None and not dry_run:
+		result.output_bytes = (output_writer.uncompressed_bytes, output_writer.compressed_bytes)
+	if not is_contiguous_shard:
+		# All rows of an unsharded file are generated, while hashed shards skip the rows of other shards
+		try:
+			result.row_count = result.last_row() if shard is None else count_csv_rows(csv_input_file, settings["csv_delimiter"])
+		except IOError as e:
+			raise GenerationError(f"Error reading file \"{csv_input_file}\": {e}", 3)
+
+	if manifest is not None:
+		if dry_run:
+			manifest.close()
+			if report is not None:
+				report.close()
+			return result
+		try:
+			manifest.compact(result.last_row())
+		except IOError:
+			raise GenerationError(f"Error writing file \"{manifest.filename}\".", 3)
+
+	expiry_chunks = settings["expiry_chunks"]
+	if expiry_chunks is not None:
+		container = output_container if output_format != "files" else None
+		try:
+			result.chunk_expiries = write_chunk_manifests(shard_prefix, prefix, csv_input_file, result, expiry_chunks, output_format, container, file_suffix)
+		except IOError as e:
+			raise GenerationError(f"Error writing file \"{e.filename}\".", 3)
+
+	if digests is not None:
+		try:
+			digests.finish()
+		except IOError:
+			raise GenerationError(f"Error writing file \"{digests.root_filename}\".", 3)
+		result.digest_root = digests.root()
+
+	if report is not None:
+		try:
+			report.write(shard_prefix, settings["report"])
+		except IOError as e:
+			raise GenerationError(f"Error writing file \"{e.filename}\".", 3)
+		finally:
+			report.close()
+
+	if shard is not None:
+		shard_manifest_file_name = shard_prefix + ".json"
+		try:
+			write_shard_manifest(shard_manifest_file_name, csv_input_file, result, output_format, settings["compression"])
+		except IOError:
+			raise GenerationError(f"Error writing file \"{shard_manifest_file_name}\".", 3)
+	return result
+
+# Yields the csv ranges that contain rows of shard, such that only those rows are read by worker processes.
+def shard_ranges(csv_ranges:Iterable[CsvRange], shard:Shard) -> Iterator[CsvRange]:
+	for csv_range in csv_ranges:
+		if shard.overlaps(csv_range.first_row_number, csv_range.row_count):
+			csv_range.shard = shard
+			yield csv_range
+
+# Yields the (row_number, transfer) tuples in row order and adds the transfers to report.
+def report_transfers(report:TransferReport, transfers:Iterable[Tuple[int, Dict[str, Any]]]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+	for row_number, transfer in transfers:
+		report.add_transfer(row_number, transfer)
+		yield (row_number, transfer)
+
+# Returns a description of the given runs [first, last] of rows, listing at most limit runs.
+def format_row_runs(runs:List[Tuple[int, int]], limit:int = 10) -> str:
+	description = ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in runs[:limit])
+	if len(runs) > limit:
+		description += f" and {len(runs) - limit} more"
+	return description
+
+# Returns the runs (first, last) of consecutive rows in the sorted row_numbers.
+def group_row_runs(row_numbers:Iterable[int]) -> List[Tuple[int, int]]:
+	runs = []
+	for row_number in row_numbers:
+		if runs and runs[-1][1] + 1 >= row_number:
+			runs[-1] = (runs[-1][0], row_number)
+		else:
+			runs.append((row_number, row_number))
+	return runs
+
+# Returns the runs [first, last] of rows r with counts[r] == value for r >= 1.
+def find_row_runs(counts:bytearray, value:int) -> List[Tuple[int, int]]:
+	return [(match.start() + 1, match.end()) for match in re.finditer(re.escape(bytes([value])) + b"+", counts[1:])]
+
+# Check that the shards of csv_input_file in output_dir, generated with --shard, can be merged, i.e., that they were generated
+# from the same csv file with the same number of shards, and that together they contain the pre-proposal of every row exactly once.
+# Returns the number of rows and the list of problems found, which is empty if the shards can be merged.
+def check_shards(csv_input_file:str, output_dir:str = "") -> Tuple[int, List[str]]:
+	prefix = output_prefix(csv_input_file, output_dir)
+	shard_manifests = {}
+	problems = []
+	for filename in sorted(glob.glob(glob.escape(prefix) + ".shard-*-of-*.json")):
+		if re.fullmatch(r"\.shard-\d+-of-\d+\.json", filename[len(prefix):]) is None:
+			continue
+		try:
+			with open(filename) as manifest_file:
+				shard_manifest = json.load(manifest_file)
+			shard_manifests[filename] = shard_manifest
+			if shard_manifest["mode"] != "hashed":
+				shard_manifest["row_runs"] = [(int(first), int(last)) for first, last in shard_manifest["row_runs"]]
+		except (ValueError, KeyError, TypeError):
+			problems.append(f"Invalid shard manifest \"{filename}\".")
+	if not shard_manifests:
+		return (0, problems + [f"No shard manifests \"{prefix}.shard-<i>-of-<N>.json\" found."])
+	if problems:
+		return (0, problems)
+
+	run_keys = ["input_digest", "rows", "shards", "mode", "output_format", "compression", "digits", "csv_delimiter"]
+	runs = {tuple(shard_manifest.get(key) for key in run_keys) for shard_manifest in shard_manifests.values()}
+	if len(runs) > 1:
+		return (0, [f"Shard manifests differ in {', '.join(key for i, key in enumerate(run_keys) if len({run[i] for run in runs}) > 1)}, "\
+			"so they were not generated from the same csv file with the same options."])
+	(input_digest, row_count, shard_count, mode, output_format, compression, digits, csv_delimiter) = runs.pop()
+	if csv_file_digest(csv_input_file) != input_digest:
+		problems.append(f"Shards were generated from a different version of the csv file.")
+	shards = sorted(shard_manifest["shard"] for shard_manifest in shard_manifests.values())
+	missing_shards = sorted(set(range(1, shard_count + 1)) - set(shards))
+	if missing_shards:
+		problems.append(f"Missing shards {', '.join(map(str, missing_shards))} of {shard_count}.")
+	repeated_shards = sorted({shard for shard in shards if shards.count(shard) > 1})
+	if repeated_shards:
+		problems.append(f"Shards {', '.join(map(str, repeated_shards))} have several manifests.")
+
+	# Number of shards containing each row, capped at 2
+	counts = bytearray(row_count + 1)
+	increment = bytes([1, 2, 2]) + bytes(253)
+	hashed_shards = [0] * (shard_count + 1)
+	for filename, shard_manifest in shard_manifests.items():
+		if mode == "hashed":
+			if 1 <= shard_manifest["shard"] <= shard_count:
+				hashed_shards[shard_manifest["shard"]] += 1
+			continue
+		for first, last in shard_manifest["row_runs"]:
+			if first < 1 or last > row_count or first > last:
+				problems.append(f"Shard manifest \"{filename}\" contains rows {first}-{last}, but the csv file has {row_count} rows.")
+				continue
+			counts[first:last + 1] = counts[first:last + 1].translate(increment)
+	if mode == "hashed":
+		# The rows of hashed shards are found again from the csv file, as they are spread over the whole file
+		for row_number, row_data in read_csv_rows(csv_input_file, csv_delimiter or ","):
+			if row_number > row_count:
+				problems.append(f"The csv file has more than the {row_count} rows of the shard manifests.")
+				break
+			counts[row_number] = min(2, hashed_shards[hashed_shard_index(row_data, shard_count)])
+	missing_rows = find_row_runs(counts, 0)
+	if missing_rows:
+		problems.append(f"Rows {format_row_runs(missing_rows)} are not in any shard.")
+	duplicate_rows = find_row_runs(counts, 2)
+	if duplicate_rows:
+		problems.append(f"Rows {format_row_runs(duplicate_rows)} are in several shards.")
+
+	# The pre-proposal files of all shards are expected in output_dir
+	if output_format == "files":
+		existing_files = set(os.listdir(output_dir or "."))
+		missing_files = bytearray(row_count + 1)
+		for row_number in range(1, row_count + 1):
+			if counts[row_number] != 0 and os.path.basename(proposal_file_name(prefix, row_number, digits, compression_suffix(compression))) not in existing_files:
+				missing_files[row_number] = 1
+		missing_runs = find_row_runs(missing_files, 1)
+		if missing_runs:
+			problems.append(f"Pre-proposal files of rows {format_row_runs(missing_runs)} are missing.")
+	return (row_count, problems)
+
+# Check the shards of all given csv files (see check_shards) and print the result of each file.
+# Returns the exit code: 2 if shards of any file cannot be merged, 3 if a csv file cannot be read, and 0 otherwise.
+def merge_shards(csv_input_files:List[str], output_dir:str = "") -> int:
+	exit_code = 0
+	for csv_input_file in csv_input_files:
+		prefix = f"{csv_input_file}: " if len(csv_input_files) > 1 else ""
+		try:
+			(row_count, problems) = check_shards(csv_input_file, output_dir)
+		except IOError as e:
+			print(f"{prefix}Error reading file \"{e.filename}\": {e.strerror}")
+			exit_code = exit_code or 3
+			continue
+		for problem in problems:
+			print(prefix + problem)
+		if problems:
+			exit_code = exit_code or 2
+		else:
+			print(f"{prefix}All {row_count} rows are in exactly one shard, and all shards can be merged.")
+	return exit_code
+
+# Returns the messages reporting the result of generating transfer_count pre-proposals, of which unchanged_count were not rewritten.
+# If digest_root is set, the Merkle root of the digests of the pre-proposals is reported, e.g., to be compared by a second approver.
+# If output_bytes is set, the bytes of the pre-proposals before and after compression are reported.
+def result_messages(
+	transfer_count:int,
+	unchanged_count:int,
+	settings:Dict[str, Any],
+	report:Optional[TransferReport] = None,
+	digest_root:Optional[str] = None,
+	output_bytes:Optional[Tuple[int, int]] = None,
+	chunk_expiries:Optional[List[Tuple[int, int]]] = None
+	) -> List[str]:
+	if settings["dry_run"]:
+		return [f"{transfer_count - unchanged_count} of {transfer_count} proposals would be written."]
+	messages = []
+	if report is not None and report.duplicate_count() > 0:
+		exact_count = report.exact_duplicate_count()
+		messages.append(f"Warning: found {report.duplicate_count()} duplicate transfers ({exact_count} exact, {report.duplicate_count() - exact_count} near duplicates).")
+	if unchanged_count > 0:
+		messages.append(f"{unchanged_count} unchanged proposals were not rewritten.")
+	if (transfer_count == 0):
+		messages.append(f"CSV file does not contain any transfers.")
+	elif (transfer_count == 1):
+		messages.append(f"Successfully generated {transfer_count} proposal.")
+	else:
+		messages.append(f"Successfully generated {transfer_count} proposals.")
+	if output_bytes is not None and output_bytes[0] > 0:
+		(uncompressed_bytes, compressed_bytes) = output_bytes
+		messages.append(f"Compressed {uncompressed_bytes} bytes of proposals to {compressed_bytes} bytes ({compressed_bytes / uncompressed_bytes:.1%}).")
+	if digest_root is not None:
+		messages.append(f"Merkle root of the proposal digests: {digest_root}")
+	if chunk_expiries:
+		first_expiry = datetime.fromtimestamp(chunk_expiries[0][1], timezone.utc).isoformat()
+		last_expiry = datetime.fromtimestamp(chunk_expiries[-1][1], timezone.utc).isoformat()
+		messages.append(f"Wrote {len(chunk_expiries)} chunk manifests, with expiries from {first_expiry} to {last_expiry}.")
+	return messages
+
+# Returns the csv files given as input_csv arguments, in order and without duplicates.
+# Arguments can be csv files, directories, whose csv files are used, or glob patterns.
+def expand_input_files(input_csv:List[str]) -> List[str]:
+	files = []
+	for argument in input_csv:
+		if os.path.isdir(argument):
+			matches = sorted(glob.glob(os.path.join(glob.escape(argument), "*.csv")))
+		elif glob.has_magic(argument):
+			matches = sorted(glob.glob(argument))
+		else:
+			matches = [argument]
+		if not matches:
+			raise ValueError(f"No csv files found for \"{argument}\".")
+		files.extend(filename for filename in matches if filename not in files)
+	# Files with the same name would overwrite each other's pre-proposals
+	prefixes = {}
+	for filename in files:
+		other = prefixes.setdefault(output_prefix(filename), filename)
+		if other != filename:
+			raise ValueError(f"The csv files \"{other}\" and \"{filename}\" would generate the same pre-proposal files.")
+	return files
+
+# Validate all rows of a csv file without generating pre-proposals, and print every error found, prefixed by prefix.
+# If executor is set, chunks of rows are validated by its jobs worker processes.
+# Returns the number of rows and the number of errors.
+def check_file(
+	csv_input_file:str,
+	settings:Dict[str, Any],
+	executor:Optional[ProcessPoolExecutor] = None,
+	jobs:int = 1,
+	prefix:str = ""
+	) -> Tuple[int, int]:
+	row_count = 0
+	error_count = 0
+	pending = deque()
+	def report(rows:int, errors:List[Tuple[int, Optional[int], str]]) -> None:
+		nonlocal row_count, error_count
+		for error in errors:
+			print(prefix + format_row_error(error))
+		row_count += rows
+		error_count += len(errors)
+
+	try:
+		check_delimiters(settings["decimal_sep"], settings["thousands_sep"], settings["csv_delimiter"])
+		if executor is None:
+			for row_number, row_data in read_csv_rows(csv_input_file, settings["csv_delimiter"]):
+				report(1, check_row(row_number, row_data, settings["is_welcome"],
+					settings["decimal_sep"], settings["thousands_sep"], settings["num_releases"], settings["skipped_releases"], settings["schedules"]))
+		else:
+			# Workers read and parse ranges of the file themselves
+			for csv_range in iter_csv_ranges(csv_input_file, settings["csv_delimiter"]):
+				pending.append(executor.submit(check_chunk, csv_range))
+				if len(pending) >= 2*jobs:
+					report(*pending.popleft().result())
+			while pending:
+				report(*pending.popleft().result())
+	except IOError as e:
+		raise GenerationError(f"Error reading file \"{csv_input_file}\": {e}", 3)
+	except ValueError as e:
+		raise GenerationError(f"Error: {e}", 2)
+	finally:
+		for future in pending:
+			future.cancel()
+	return (row_count, error_count)
+
+# Validate all given csv files one after the other and print a report with all errors.
+# Returns the exit code: 2 if any row is invalid, 3 if a file cannot be read, and 0 otherwise.
+def check_files(csv_input_files:List[str], settings:Dict[str, Any], executor:Optional[ProcessPoolExecutor], jobs:int) -> int:
+	exit_code = 0
+	for csv_input_file in csv_input_files:
+		prefix = f"{csv_input_file}: " if len(csv_input_files) > 1 else ""
+		try:
+			(row_count, error_count) = check_file(csv_input_file, settings, executor, jobs, prefix)
+		except GenerationError as e:
+			print(prefix + str(e))
+			exit_code = exit_code or e.exit_code
+			continue
+		if error_count == 0:
+			print(f"{prefix}Checked {row_count} rows, no errors found.")
+		else:
+			print(f"{prefix}Checked {row_count} rows, found {error_count} errors.")
+			exit_code = exit_code or 2
+	return exit_code
+
+# Check the json content of the pre-proposal of a csv row against the row and its release schedule from schedule_book,
+# given by the last column of the row if schedule_column is set. The check does not depend on the day the pre-proposal was
+# generated on: the remaining releases must be the last planned releases of the schedule, and the first release must be
+# between the initial release and the first remaining release, and not before any skipped release.
+# The amounts must sum up to the amounts of the row, and be split as by compact_schedule_batch.
+# Returns the reasons why the pre-proposal does not match, which are empty if it matches.
+def verify_proposal(
+	row_number:int,
+	row_data:List[str],
+	content:Union[str, bytes],
+	is_welcome:bool,
+	decimal_sep:str,
+	thousands_sep:str,
+	schedule_book:ScheduleBook,
+	schedule_column:bool = False
+	) -> List[str]:
+	schedule_id = ""
+	try:
+		if schedule_column:
+			(row_data, schedule_id) = schedule_book.split_row(row_number, row_data, is_welcome)
+		(sender_address, receiver_address, initial_amount, remaining_amount) = parse_row_values(row_number, row_data, is_welcome, decimal_sep, thousands_sep)
+	except ValueError as e:
+		return [f"Invalid csv row: {e}"]
+	schedule = schedule_book.compiled[schedule_id]
+	try:
+		data = json.loads(content)
+		releases = [(int(release["amount"]), int(release["timestamp"])) for release in data["payload"]["schedule"]]
+		(proposal_sender, proposal_receiver) = (data["sender"], data["payload"]["toAddress"])
+	except (ValueError, KeyError, TypeError):
+		return ["Invalid pre-proposal json."]
+
+	reasons = []
+	if proposal_sender != sender_address:
+		reasons.append(f"Sender \"{proposal_sender}\" differs from \"{sender_address}\" in the csv file.")
+	if proposal_receiver != receiver_address:
+		reasons.append(f"Receiver \"{proposal_receiver}\" differs from \"{receiver_address}\" in the csv file.")
+	if data.get("transactionKind") != 19:
+		reasons.append(f"Transaction kind {data.get('transactionKind')} is not a transfer with schedule.")
+	amounts = [amount for amount, _ in releases]
+	timestamps = [timestamp for _, timestamp in releases]
+	amount_sum_matches = sum(amounts) == initial_amount + remaining_amount
+	if not amount_sum_matches:
+		reasons.append(f"Releases sum up to {sum(amounts)} microGTU instead of {initial_amount + remaining_amount} microGTU.")
+	if is_welcome:
+		if len(releases) != 1:
+			reasons.append(f"Welcome transfer has {len(releases)} releases instead of 1.")
+		elif timestamps[0] < schedule.initial_timestamp:
+			reasons.append(f"Release at {timestamps[0]} is before the initial release at {schedule.initial_timestamp}.")
+		return reasons
+
+	planned = schedule.planned_timestamps
+	remaining_count = len(releases) - 1
+	if remaining_count < 0 or remaining_count > len(planned):
+		reasons.append(f"Transfer has {len(releases)} releases, but the schedule has {len(planned) + 1}.")
+		return reasons
+	skipped_releases = len(planned) - remaining_count
+	if timestamps[1:] != planned[skipped_releases:]:
+		reasons.append(f"Release times {timestamps[1:]} are not the last {remaining_count} planned release times of the schedule.")
+	elif timestamps[0] < schedule.initial_timestamp or (remaining_count > 0 and timestamps[0] > timestamps[1]) \
+		or (skipped_releases > 0 and timestamps[0] < planned[skipped_releases - 1]):
+		reasons.append(f"First release at {timestamps[0]} is not between the initial release, the skipped releases and the remaining releases of the schedule.")
+	if amount_sum_matches:
+		try:
+			expected_amounts = release_amounts(initial_amount, remaining_amount, schedule.num_releases, skipped_releases)
+		except (ValueError, AssertionError) as e:
+			reasons.append(f"Amounts cannot be split as by the schedule: {e}")
+		else:
+			if amounts != expected_amounts:
+				reasons.append(f"Release amounts {amounts} are not split as by the schedule, which gives {expected_amounts}.")
+	return reasons
+
+# Yields (row_number, row_data, source) for each row of a csv file in row order, where source locates its pre-proposal
+# with the given file name prefix: the name of its file for the files output format, or its entry in the index of
+# container_filename (see read_container_entry), or None if the container has no entry for the row. Rows of entries of the container index
+# without a csv row are appended to extra_rows. The csv file and index are streamed, so memory does not depend on their size.
+def iter_verification_rows(
+	csv_input_file:str,
+	csv_delimiter:str,
+	prefix:str,
+	digits:int,
+	container_filename:Optional[str],
+	extra_rows:List[int],
+	file_suffix:str = ""
+	) -> Iterator[Tuple[int, List[str], Any]]:
+	rows = read_csv_rows(csv_input_file, csv_delimiter)
+	if container_filename is None:
+		for row_number, row_data in rows:
+			yield (row_number, row_data, proposal_file_name(prefix, row_number, digits, file_suffix))
+		return
+	name_pattern = re.compile(r"_(\d+)\.json$")
+	with open(container_filename + ".index") as index_file:
+		def next_entry() -> Optional[Tuple[int, Dict[str, Any]]]:
+			for line in index_file:
+				entry = json.loads(line)
+				match = name_pattern.search(entry["name"])
+				if match is not None:
+					return (int(match.group(1)), entry)
+			return None
+		entry = next_entry()
+		for row_number, row_data in rows:
+			while entry is not None and entry[0] < row_number:
+				extra_rows.append(entry[0])
+				entry = next_entry()
+			if entry is not None and entry[0] == row_number:
+				yield (row_number, row_data, entry[1])
+				entry = next_entry()
+			else:
+				yield (row_number, row_data, None)
+		while entry is not None:
+			extra_rows.append(entry[0])
+			entry = next_entry()
+
+# Verify the pre-proposals of a chunk of (row_number, row_data, source) tuples (see iter_verification_rows), reading
+# them from their files or from container_filename. Uses the settings of job, or of the worker process if job is None.
+# Returns the number of rows and the (row_number, reason) tuples of all mismatches.
+def verify_chunk(
+	chunk:List[Tuple[int, List[str], Any]],
+	container_filename:Optional[str],
+	job:Optional[Dict[str, Any]] = None
+	) -> Tuple[int, List[Tuple[int, str]]]:
+	job = worker_job if job is None else job
+	mismatches = []
+	container = open(container_filename, 'rb') if container_filename is not None else None
+	try:
+		for row_number, row_data, source in chunk:
+			if container is None:
+				try:
+					with open_output(source) as json_file:
+						content = json_file.read()
+				except FileNotFoundError:
+					mismatches.append((row_number, f"Pre-proposal file \"{source}\" is missing."))
+					continue
+			elif source is None:
+				mismatches.append((row_number, f"Pre-proposal is missing in \"{container_filename}\"."))
+				continue
+			else:
+				content = read_container_entry(container, source)
+			for reason in verify_proposal(row_number, row_data, content, job["is_welcome"], job["decimal_sep"], job["thousands_sep"],
+				job["schedule_book"], job["schedules"] is not None):
+				mismatches.append((row_number, reason))
+	finally:
+		if container is not None:
+			container.close()
+	return (len(chunk), mismatches)
+
+# Verify the pre-proposals generated from a csv file with the given settings against the csv file, and print every
+# mismatch found, prefixed by prefix. Pre-proposals are read from the output folder or container of the output format of settings.
+# If executor is set, chunks of rows are verified by its jobs worker processes.
+# Returns the number of rows and the number of mismatches, including pre-proposals without csv row.
+def verify_file(
+	csv_input_file:str,
+	settings:Dict[str, Any],
+	executor:Optional[ProcessPoolExecutor] = None,
+	jobs:int = 1,
+	prefix:str = ""
+	) -> Tuple[int, int]:
+	output_prefix_name = output_prefix(csv_input_file, settings["output_dir"])
+	suffix = compression_suffix(settings["compression"])
+	file_suffix = suffix if settings["output_format"] == "files" else ""
+	container_filename = None
+	if settings["output_format"] != "files":
+		container_filename = output_prefix_name + "." + settings["output_format"] + suffix
+	row_count = 0
+	mismatch_count = 0
+	extra_rows = []
+	pending = deque()
+	def report(rows:int, mismatches:List[Tuple[int, str]]) -> None:
+		nonlocal row_count, mismatch_count
+		for row_number, reason in mismatches:
+			print(f"{prefix}Row {row_number}: {reason}")
+		row_count += rows
+		mismatch_count += len({row_number for row_number, _ in mismatches})
+
+	try:
+		check_delimiters(settings["decimal_sep"], settings["thousands_sep"], settings["csv_delimiter"])
+		digits = row_number_digits(count_csv_lines(csv_input_file))
+		rows = iter_verification_rows(csv_input_file, settings["csv_delimiter"], output_prefix_name, digits, container_filename, extra_rows, file_suffix)
+		for chunk in chunked(rows, parallel_chunk_size):
+			if executor is None:
+				report(*verify_chunk(chunk, container_filename, settings))
+				continue
+			pending.append(executor.submit(verify_chunk, chunk, container_filename))
+			if len(pending) >= 2*jobs:
+				report(*pending.popleft().result())
+		while pending:
+			report(*pending.popleft().result())
+		if container_filename is None:
+			# Files of rows beyond the end of the csv file, e.g., of an earlier version of it
+			name_pattern = re.compile(re.escape(os.path.basename(output_prefix_name)) + r"_(\d+)\.json" + re.escape(file_suffix))
+			with os.scandir(settings["output_dir"] or ".") as entries:
+				for entry in entries:
+					match = name_pattern.fullmatch(entry.name)
+					if match is not None and (int(match.group(1)) > row_count or len(match.group(1)) != digits):
+						extra_rows.append(int(match.group(1)))
+	except IOError as e:
+		raise GenerationError(f"Error reading file \"{e.filename or csv_input_file}\": {e.strerror or e}", 3)
+	except ValueError as e:
+		raise GenerationError(f"Error: {e}", 2)
+	finally:
+		for future in pending:
+			future.cancel()
+	if extra_rows:
+		extra_rows.sort()
+		print(f"{prefix}Found {len(extra_rows)} pre-proposals without csv row, of rows {format_row_runs(group_row_runs(extra_rows))}.")
+	return (row_count, mismatch_count + len(extra_rows))
+
+# Verify the pre-proposals of all given csv files one after the other (see verify_file), and print a pass or fail report.
+# Returns the exit code: 2 if any pre-proposal does not match, 3 if a file cannot be read, and 0 otherwise.
+def verify_files(csv_input_files:List[str], settings:Dict[str, Any], executor:Optional[ProcessPoolExecutor], jobs:int) -> int:
+	exit_code = 0
+	for csv_input_file in csv_input_files:
+		prefix = f"{csv_input_file}: " if len(csv_input_files) > 1 else ""
+		try:
+			(row_count, mismatch_count) = verify_file(csv_input_file, settings, executor, jobs, prefix)
+		except GenerationError as e:
+			print(prefix + str(e))
+			exit_code = exit_code or e.exit_code
+			continue
+		if mismatch_count == 0:
+			print(f"{prefix}PASS: verified the pre-proposals of {row_count} rows.")
+		else:
+			print(f"{prefix}FAIL: {mismatch_count} of the pre-proposals of {row_count} rows do not match the csv file.")
+			exit_code = exit_code or 2
+	return exit_code
+
+# Returns the structured result of generating the pre-proposals of a csv file, as returned by the daemon,
+# with the numbers of transfers, unchanged pre-proposals and duplicates, the written files and the error, if any.
+def file_result(
+	csv_input_file:str,
+	settings:Dict[str, Any],
+	result:Optional[GeneratedFile] = None,
+	error:Optional[GenerationError] = None
+	) -> Dict[str, Any]:
+	prefix = output_prefix(csv_input_file, settings["output_dir"])
+	output_files = []
+	report = None
+	if result is not None:
+		report = result.report
+		shard_prefix = prefix if result.shard is None else prefix + result.shard.suffix()
+		suffix = compression_suffix(settings["compression"])
+		if not settings["dry_run"]:
+			if settings["output_format"] == "files":
+				output_files += [proposal_file_name(prefix, row_number, result.digits, suffix) for row_number in result.row_numbers()]
+			else:
+				container = shard_prefix + "." + settings["output_format"] + suffix
+				output_files += [container, container + ".index"]
+			if settings["incremental"]:
+				output_files.append(shard_prefix + ".manifest")
+			if settings["digests"]:
+				output_files += [shard_prefix + ".sha256", shard_prefix + ".merkle.json"]
+			if result.chunk_expiries:
+				chunk_count = settings["expiry_chunks"].chunk_count(result.row_count)
+				output_files += [chunk_manifest_file_name(shard_prefix, chunk, chunk_count) for chunk, _ in result.chunk_expiries]
+			if report is not None:
+				output_files += TransferReport.filenames(shard_prefix, settings["report"])
+			if result.shard is not None:
+				output_files.append(shard_prefix + ".json")
+	return {
+		"input_csv" : csv_input_file,
+		"transfers" : result.transfer_count if result is not None else 0,
+		"unchanged" : result.unchanged_count if result is not None else 0,
+		"duplicates" : report.duplicate_count() if report is not None else 0,
+		"output_files" : output_files,
+		"digest_root" : result.digest_root if result is not None else None,
+		"output_bytes" : None if result is None or result.output_bytes is None else {"uncompressed": result.output_bytes[0], "compressed": result.output_bytes[1]},
+		"error" : None if error is None else str(error)
+	}
 
+# Generate the pre-proposals of several csv files concurrently in this process, using at most concurrent_files threads.
+# All files share the release schedule, the address validation cache and the worker processes of executor.
+# Prints the result of each file and a combined summary, and returns the exit code of the first failed file or 0.
+# If results is set, the result of each file is appended to it (see file_result).
+def generate_files(
+	csv_input_files:List[str],
+	settings:Dict[str, Any],
+	metrics:Optional[StageMetrics],
+	executor:Optional[ProcessPoolExecutor],
+	jobs:int,
+	concurrent_files:int,
+	results:Optional[List[Dict[str, Any]]] = None
+	) -> int:
+	def generate(csv_input_file:str) -> GeneratedFile:
+		return generate_file(csv_input_file, settings, metrics, executor, jobs)
+
+	total_transfers = 0
+	total_unchanged = 0
+	total_duplicates = 0
+	failed = []
+	with ThreadPoolExecutor(max_workers=concurrent_files) as file_executor:
+		futures = [file_executor.submit(generate, csv_input_file) for csv_input_file in csv_input_files]
+		for csv_input_file, future in zip(csv_input_files, futures):
+			try:
+				result = future.result()
+			except GenerationError as e:
+				print(f"{csv_input_file}: {e}")
+				failed.append(e.exit_code)
+				if results is not None:
+					results.append(file_result(csv_input_file, settings, error=e))
+				continue
+			if results is not None:
+				results.append(file_result(csv_input_file, settings, result))
+			for message in result_messages(result.transfer_count, result.unchanged_count, settings, result.report, result.digest_root, result.output_bytes, result.chunk_expiries):
+				print(f"{csv_input_file}: {message}")
+			total_transfers += result.transfer_count
+			total_unchanged += result.unchanged_count
+			total_duplicates += result.report.duplicate_count() if result.report is not None else 0
+
+	summary = f"Processed {len(csv_input_files)} csv files with {total_transfers} transfers"
+	if settings["dry_run"]:
+		summary += f", of which {total_transfers - total_unchanged} proposals would be written"
+	elif total_unchanged > 0:
+		summary += f", of which {total_unchanged} unchanged proposals were not rewritten"
+	if total_duplicates > 0:
+		summary += f". {total_duplicates} transfers are duplicates"
+	if failed:
+		summary += f". {len(failed)} files failed"
+	print(summary + ".")
+	return failed[0] if failed else 0
+
+# Unix domain socket of the daemon started with --serve, if no other socket is given.
+# proposal_client.py uses the same default.
+default_socket:str = os.environ.get("PROPOSAL_GENERATOR_SOCKET", os.path.join(tempfile.gettempdir(), "proposal_generator.sock"))
+
+# Handles a single request to the daemon. A request is a json object on a single line with the fields
+# "input_csv" (list of csv files, directories or glob patterns), "welcome", "output_dir", "arguments" (further command line arguments)
+# and "cwd" (the directory relative paths are resolved against). All fields are optional.
+# The response is a json object on a single line with the "exit_code", the result of each csv file (see file_result)
+# in "files", and the lines that would have been printed by the command line interface in "output". Every request gets a response,
+# and unexpected errors are reported in "output" with exit code 1.
+class ProposalRequestHandler(socketserver.StreamRequestHandler):
+	def handle(self) -> None:
+		output = io.StringIO()
+		results = []
+		with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+			try:
+				exit_code = self.server.run_request(json.loads(self.rfile.readline()), results)
+			except SystemExit as e:
+				# Raised by argparse for invalid arguments and --help
+				exit_code = e.code if isinstance(e.code, int) else 0 if e.code is None else 2
+			except (ValueError, TypeError, KeyError) as e:
+				print(f"Error: invalid request: {e}")
+				exit_code = 2
+			except Exception as e:
+				# The daemon keeps serving further requests, and the client gets the error instead of no response
+				print(f"Error: {type(e).__name__}: {e}")
+				exit_code = 1
+		response = {"exit_code": exit_code, "files": results, "output": output.getvalue().splitlines()}
+		self.wfile.write(json.dumps(response).encode() + b"\n")
+
+# Daemon that generates pre-proposals for requests on a Unix domain socket, such that the interpreter start, imports
+# and caches like the address validation cache are shared by all requests. Requests are run one after the other,
+# as each request already uses all configured worker processes.
+class ProposalServer(socketserver.UnixStreamServer):
+	def __init__(self, socket_path:str, config:Dict[str, Any], parser:argparse.ArgumentParser):
+		self.config = config
+		self.parser = parser
+		super().__init__(socket_path, ProposalRequestHandler)
+
+	def server_bind(self) -> None:
+		# Only the user running the daemon may send requests, as requests can write files anywhere
+		old_umask = os.umask(0o177)
+		try:
+			super().server_bind()
+		finally:
+			os.umask(old_umask)
+
+	def run_request(self, request:Dict[str, Any], results:List[Dict[str, Any]]) -> int:
+		cwd = request.get("cwd", os.getcwd())
+		arguments = list(request.get("arguments", [])) + list(request.get("input_csv", []))
+		if request.get("welcome"):
+			arguments.append("--welcome")
+		if request.get("output_dir") is not None:
+			arguments += ["--output-dir", request["output_dir"]]
+		args = self.parser.parse_args(arguments)
+		if args.serve:
+			self.parser.error("--serve cannot be used in requests")
+		# The daemon does not change its working directory, so all paths are made absolute
+		args.input_csv = [os.path.join(cwd, filename) for filename in args.input_csv]
+		args.output_dir = os.path.join(cwd, args.output_dir or "")
+		for name in ["metrics_file", "cprofile", "schedules"]:
+			if getattr(args, name) is not None:
+				setattr(args, name, os.path.join(cwd, getattr(args, name)))
+		return run(args, self.config, self.parser, results)
+
+# Run the daemon on socket_path until it is interrupted.
+def serve(socket_path:str, config:Dict[str, Any], parser:argparse.ArgumentParser) -> None:
+	if not hasattr(socket, "AF_UNIX"):
+		print("Error: --serve requires Unix domain sockets, which are not supported on this platform.")
+		sys.exit(2)
+	if os.path.exists(socket_path):
+		# Remove the socket of a daemon that did not shut down cleanly, but do not take over the socket of a running one
+		with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+			try:
+				probe.connect(socket_path)
+			except OSError:
+				os.remove(socket_path)
+			else:
+				print(f"Error: a daemon is already listening on \"{socket_path}\".")
+				sys.exit(2)
+	try:
+		server = ProposalServer(socket_path, config, parser)
+	except OSError as e:
+		print(f"Error listening on \"{socket_path}\": {e}")
+		sys.exit(3)
+	print(f"Listening on \"{socket_path}\".")
+	sys.stdout.flush()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		os.remove(socket_path)
+
+# Returns the argument parser of the command line interface, which is also used for requests to the daemon.
+def build_argument_parser(config:Dict[str, Any]) -> argparse.ArgumentParser:
+	thousands_sep = config["thousands_sep"]
+	decimal_sep = config["decimal_sep"]
 	parser = argparse.ArgumentParser(description="Generate pre-proposals from the csv file \"input_csv\".\n"\
-		"For each row in the csv file, a json file with the corresponding pre-proposal is generated in the same folder.\n"
+		"For each row in the csv file, a json file with the corresponding pre-proposal is generated in the current folder.\n"
+		"If several csv files are given, they are processed concurrently and a combined summary is printed at the end.\n"
 		"\n"
 		"The expected format of that file is a UTF-8 csv file with:\n"\
 		"One row for each transfer, columns separated by ','.\n"\
@@ -282,71 +3329,232 @@ def main():
 		"If the optional argument \"--welcome\" is present, the tool generates pre-proposals for welcome transfers.\n"\
 		"These only have one release, and thus expect a csv file with only 3 columns: sender, receiver, and amount.\n"
 		"\n"
-		"The release schedules are hard-coded in this script.", formatter_class=argparse.RawDescriptionHelpFormatter)
-	parser.add_argument("input_csv", type=str, help="Filename of a csv file to generate pre-proposals from.")
+		"The release schedules are hard-coded in this script, unless a schedule definition file is given with \"--schedules\".\n"\
+		"With \"--schedule-column\", an additional last column contains the ID of the release schedule of each transfer.", formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("input_csv", type=str, nargs="*", help="Filename of a csv file to generate pre-proposals from. "\
+		"Several files, directories containing csv files or glob patterns can be given to process all their csv files in one run.")
 	parser.add_argument("--welcome", help="Generate welcome transfers with only one release.", action="store_true")
-	args = parser.parse_args()
-	
-	is_welcome = args.welcome
-	csv_input_file = args.input_csv
-	#Output files contain the csv_input_file name 
-	json_output_prefix = "pre-proposal_" + os.path.splitext(os.path.basename(csv_input_file))[0] + "_"
+	parser.add_argument("--jobs", type=int, metavar="N", help="Number of worker processes used to generate pre-proposals (default 1, 0 uses all cores). "\
+		"With --check and --verify, all cores are used by default.")
+	parser.add_argument("--report", choices=["json", "csv", "none"], default="json",
+		help="Write a report of duplicate transfers and per-sender totals next to the pre-proposals, as pre-proposal_<name>.report.json (default), "\
+		"as pre-proposal_<name>.senders.csv and pre-proposal_<name>.duplicates.csv, or not at all.")
+	parser.add_argument("--check", help="Only validate all rows and report every invalid column, without generating pre-proposals.", action="store_true")
+	parser.add_argument("--verify", help="Verify the generated pre-proposals in the output folder, or in the container of --output-format, against the csv file "\
+		"and print a pass or fail report with all mismatched rows, without generating pre-proposals. All cores are used by default.", action="store_true")
+	parser.add_argument("--output-format", choices=["files", "jsonl", "zip", "tar"], default="files",
+		help="Write one json file per pre-proposal (default), or all pre-proposals into a single JSON Lines file, zip or tar archive "\
+		"together with an index file for extracting single pre-proposals.")
+	parser.add_argument("--output-dir", type=str, metavar="DIR", help="Write all output files to DIR instead of the current folder.")
+	parser.add_argument("--concurrent-files", type=int, default=4, metavar="N", help="Number of csv files processed concurrently if several are given (default 4).")
+	parser.add_argument("--compress", choices=sorted(compression_suffixes), help="Compress each pre-proposal file, e.g., to .json.gz, "\
+		"or the whole container of --output-format, e.g., to .jsonl.gz. Implies --async-write, such that compression runs while the next pre-proposals are generated.")
+	parser.add_argument("--compress-level", type=int, choices=range(10), default=6, metavar="N", help="Compression level of --compress from 0 to 9 (default 6).")
+	parser.add_argument("--async-write", help="Write files in a background thread while generating the next pre-proposals.", action="store_true")
+	parser.add_argument("--write-queue-size", type=int, default=1024, metavar="N", help="Maximal number of pre-proposals waiting to be written with --async-write (default 1024).")
+	parser.add_argument("--fsync-batch", type=int, default=0, metavar="N", help="Sync written files to disk in batches of N files (default 0, no sync).")
+	parser.add_argument("--incremental", help="Keep a manifest of the generated files next to them, and only rewrite files of rows that changed or are missing. "\
+		"This also resumes an interrupted run. Only supported for the files output format.", action="store_true")
+	parser.add_argument("--digests", help="Record the sha256 digest of the json of each pre-proposal while writing it in a sha256sum file next to the pre-proposals, "\
+		"and the Merkle root over all pre-proposals in a .merkle.json file, such that they never need to be read again to be checked. "\
+		"The sha256sum file can only be checked with sha256sum -c for uncompressed files, as it lists the entries of containers and the json of compressed files.", action="store_true")
+	parser.add_argument("--dry-run", help="List the rows whose files would be rewritten by --incremental, without writing anything.", action="store_true")
+	parser.add_argument("--memory-budget", type=int, metavar="MB", help="Keep the state kept for every row, i.e., the duplicate detection of the report "\
+		"and the manifest of --incremental, within MB megabytes of memory, and move it to temporary sqlite databases on disk once the budget is reached.")
+	parser.add_argument("--expiry-chunk", type=int, metavar="N", help="Group the pre-proposals into chunks of N rows, and let each chunk expire later than the previous one "\
+		"by the time needed to sign a chunk at --signing-rate, such that large batches can be signed chunk by chunk. A manifest of each chunk with its expiry "\
+		"and pre-proposals is written next to the pre-proposals.")
+	parser.add_argument("--signing-rate", type=int, metavar="N", help="Estimated number of pre-proposals imported and signed per hour, used to stagger the expiries of --expiry-chunk.")
+	parser.add_argument("--profile", help="Record wall time, number of calls and peak memory of each stage, and print a summary at exit.", action="store_true")
+	parser.add_argument("--metrics-file", type=str, metavar="FILE", help="Write the recorded metrics to FILE, in Prometheus text format if FILE ends with .prom and as json otherwise. Implies --profile.")
+	parser.add_argument("--tracemalloc", help="Trace memory allocations to record peak memory per stage and print the top allocation sites. Implies --profile.", action="store_true")
+	parser.add_argument("--cprofile", type=str, metavar="FILE", help="Profile the generation with cProfile and write the statistics to FILE.")
+	parser.add_argument("--shard", type=parse_shard, metavar="i/N", help="Only generate the pre-proposals of shard i of N of the csv file, e.g., on one of N machines. "\
+		"Files are numbered by their row in the whole csv file, and a shard manifest pre-proposal_<name>.shard-<i>-of-<N>.json is written for --merge-shards.")
+	parser.add_argument("--shard-mode", choices=["contiguous", "hashed"], default="contiguous",
+		help="Assign consecutive rows to each shard (default), or assign rows by a hash of sender and receiver, such that duplicates are reported by the same shard.")
+	parser.add_argument("--merge-shards", help="Check that the shards in the output folder were generated from the same csv file and contain every row exactly once.", action="store_true")
+	parser.add_argument("--schedules", type=str, metavar="FILE", help="Read the release schedules and separators from the schedule definition file FILE "\
+		"instead of using the hard-coded ones (see load_schedule_file for the format).")
+	parser.add_argument("--schedule-column", help="The last column of each row is the ID of the schedule of the transfer in the schedule definition file. "\
+		"Rows with an empty ID use the default schedule.", action="store_true")
+	parser.add_argument("--serve", type=str, nargs="?", const=default_socket, metavar="SOCKET",
+		help=f"Run as a daemon that generates pre-proposals for requests on the Unix domain socket SOCKET (default {default_socket}), "\
+		"e.g., sent by proposal_client.py with the same arguments as this script.")
+	return parser
 
-	# Build release schedule
-	if is_welcome:
-		# Release schedule for welcome transfer is just single date
-		release_times = [max(welcome_release_time, earliest_release_time)]
-		skipped_releases = 0
-	else:
+# Generate pre-proposals as requested by the parsed command line arguments args, and return the exit code.
+# If results is set, the structured result of each csv file is appended to it (see file_result).
+def run(args:argparse.Namespace, config:Dict[str, Any], parser:argparse.ArgumentParser, results:Optional[List[Dict[str, Any]]] = None) -> int:
+	if not args.input_csv:
+		parser.error("the following arguments are required: input_csv")
+	try:
+		csv_input_files = expand_input_files(args.input_csv)
+	except ValueError as e:
+		print(f"Error: {e}")
+		return 2
+	if (args.incremental or args.dry_run) and args.output_format != "files":
+		parser.error("--incremental and --dry-run are only supported for the files output format")
+	if (args.expiry_chunk is None) != (args.signing_rate is None):
+		parser.error("--expiry-chunk and --signing-rate must be used together")
+	if args.expiry_chunk is not None and (args.expiry_chunk <= 0 or args.signing_rate <= 0):
+		parser.error("--expiry-chunk and --signing-rate must be positive")
+	if args.merge_shards:
+		if args.shard is not None:
+			parser.error("--merge-shards cannot be used with --shard")
+		return merge_shards(csv_input_files, args.output_dir or "")
+
+	# Instrumentation is only set up if requested, such that it has no overhead otherwise.
+	metrics = None
+	profiler = None
+	if args.profile or args.metrics_file or args.tracemalloc:
+		if args.tracemalloc:
+			tracemalloc.start()
+		metrics = StageMetrics(trace_memory=args.tracemalloc)
+	if args.cprofile:
+		profiler = cProfile.Profile()
+		profiler.enable()
+	try:
+		return run_generation(args, config, csv_input_files, metrics, results)
+	finally:
+		if metrics is not None or profiler is not None:
+			report_profile(metrics, args.metrics_file, profiler, args.cprofile)
+		if args.tracemalloc:
+			tracemalloc.stop()
+
+# Generate the pre-proposals of csv_input_files as requested by args, and return the exit code.
+def run_generation(
+	args:argparse.Namespace,
+	config:Dict[str, Any],
+	csv_input_files:List[str],
+	metrics:Optional[StageMetrics],
+	results:Optional[List[Dict[str, Any]]]
+	) -> int:
+	is_welcome = args.welcome
+	# A schedule definition file replaces the schedule and separators of config
+	if args.schedules:
 		try:
-			(release_times,skipped_releases) = build_release_schedule(
-				initial_release_time,
-				first_rem_release_time,
-				earliest_release_time,
-				num_releases)
+			(schedules, default_schedule_id, config) = load_schedule_file(args.schedules, config)
+		except IOError as e:
+			print(f"Error reading file \"{args.schedules}\": {e.strerror}")
+			return 3
 		except ValueError as e:
-			print(f"Error: {e}")
-			sys.exit(2)
+			print(f"Error: invalid schedule file \"{args.schedules}\": {e}")
+			return 2
+	else:
+		(schedules, default_schedule_id) = ({"default": config_schedule(config, is_welcome)}, "default")
+	csv_delimiter = config["csv_delimiter"]
+	thousands_sep = config["thousands_sep"]
+	decimal_sep = config["decimal_sep"]
+	incremental = args.incremental or args.dry_run
+	output_format = args.output_format
+	jobs = args.jobs if args.jobs is not None else (0 if args.check or args.verify else 1)
+	if jobs <= 0:
+		jobs = os.cpu_count() or 1
 
-	
-	# read csv file
+	# proposals expire 2 hours from now
+	transaction_expiry = datetime.now() + relativedelta(hours = +2) 
+	# in expiry chunks, only the first chunk expires then, and later chunks get the time needed to sign the chunks before them
+	expiry_chunks = ExpiryChunks(transaction_expiry, args.expiry_chunk, args.signing_rate) if args.expiry_chunk is not None else None
+	# Build the release schedules once for all transfers.
+	# If regular releases are before the earliest release time, by default 14:00 CET tomorrow, they get combined into one at that time.
+	# This can be later than all release times, in which case all releases happen at that time.
+	# The release schedule of welcome transfers is just the single initial release.
 	try:
-		transfers = csv_to_list(csv_input_file, is_welcome, decimal_sep, thousands_sep, csv_delimiter)
-	except IOError as e:
-		print(f"Error reading file \"{csv_input_file}\": {e}")
-		sys.exit(3)
+		schedule_book = ScheduleBook(schedules, default_schedule_id, is_welcome, date.today())
 	except ValueError as e:
 		print(f"Error: {e}")
-		sys.exit(2)
+		return 2
+	default_schedule = schedule_book.default()
+	release_times = default_schedule.release_times
+	skipped_releases = default_schedule.skipped_releases
+	num_releases = default_schedule.num_releases
+	# Without a schedule-ID column, all transfers have the default schedule
+	row_schedules = schedule_book if args.schedule_column else None
 
-	# process all transfers in list
-	for transfer_number, transfer in enumerate(transfers, start=1):
-		out_file_name = json_output_prefix + str(transfer_number).zfill(3) + ".json"
-		
-		if is_welcome:
-			# welcome transfer only has one amount
-			amounts = [transfer["amount"]]
-		else:
-			amounts = amounts_to_scheduled_list(transfer["initial_amount"], transfer["remaining_amount"], num_releases, skipped_releases)
+	settings = {
+		"is_welcome" : is_welcome,
+		"decimal_sep" : decimal_sep,
+		"thousands_sep" : thousands_sep,
+		"csv_delimiter" : csv_delimiter,
+		"release_times" : release_times,
+		"skipped_releases" : skipped_releases,
+		"num_releases" : num_releases,
+		"expiry" : transaction_expiry,
+		"expiry_chunks" : expiry_chunks,
+		"output_format" : output_format,
+		"fsync_batch" : args.fsync_batch,
+		# Compression runs in the background writer, such that generation continues meanwhile
+		"async_write" : args.async_write or args.compress is not None,
+		"write_queue_size" : args.write_queue_size,
+		"incremental" : incremental,
+		"dry_run" : args.dry_run,
+		"report" : args.report,
+		"output_dir" : args.output_dir or "",
+		"shard" : args.shard,
+		"shard_mode" : args.shard_mode,
+		"digests" : args.digests,
+		"compression" : args.compress,
+		"compress_level" : args.compress_level,
+		# The budget is shared by all csv files generated concurrently
+		"memory_budget" : MemoryBudget(args.memory_budget << 20) if args.memory_budget is not None else None,
+		"schedules" : row_schedules,
+		"schedule_book" : schedule_book
+	}
+
+	# The worker processes are shared by all csv files
+	with contextlib.ExitStack() as stack:
+		executor = None
+		if jobs > 1:
+			job = {
+				"is_welcome" : is_welcome,
+				"decimal_sep" : decimal_sep,
+				"thousands_sep" : thousands_sep,
+				"csv_delimiter" : csv_delimiter,
+				"release_times" : release_times,
+				"release_timestamps" : default_schedule.timestamps,
+				"skipped_releases" : skipped_releases,
+				"num_releases" : num_releases,
+				"expiry" : transaction_expiry,
+				"expiry_chunks" : expiry_chunks,
+				"indent" : output_writers.get(output_format, ProposalFileWriter).indent,
+				"input_digests" : incremental,
+				"schedules" : row_schedules,
+				"schedule_book" : schedule_book
+			}
+			executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(job,)))
+
+		if args.check:
+			return check_files(csv_input_files, settings, executor, jobs)
+		if args.verify:
+			return verify_files(csv_input_files, settings, executor, jobs)
+		if len(csv_input_files) > 1:
+			return generate_files(csv_input_files, settings, metrics, executor, jobs, args.concurrent_files, results)
 
-		# create pre-proposal and add all releases
-		pre_proposal = ScheduledPreProposal(transfer["sender_address"], transfer["receiver_address"], transaction_expiry)
-		for i in range(len(release_times)):
-			pre_proposal.add_release(amounts[i], release_times[i])
-		
-		# Finally write json file
 		try:
-			pre_proposal.write_json(out_file_name)
-		except IOError:
-			print(f"Error writing file \"{out_file_name}\".")
-			sys.exit(3)
-	
-	if (len(transfers) == 0):
-		print(f"CSV file does not contain any transfers.")
-	elif (len(transfers) == 1):
-		print(f"Successfully generated {len(transfers)} proposal.")
-	else:
-		print(f"Successfully generated {len(transfers)} proposals.")
+			result = generate_file(csv_input_files[0], settings, metrics, executor, jobs)
+		except GenerationError as e:
+			print(e)
+			if results is not None:
+				results.append(file_result(csv_input_files[0], settings, error=e))
+			return e.exit_code
+	if results is not None:
+		results.append(file_result(csv_input_files[0], settings, result))
+	for message in result_messages(result.transfer_count, result.unchanged_count, settings, result.report, result.digest_root, result.output_bytes, result.chunk_expiries):
+		print(message)
+	return 0
+
+# Main function
+def main():
+	config = get_config()
+	parser = build_argument_parser(config)
+	args = parser.parse_args()
+	if args.serve:
+		serve(args.serve, config, parser)
+		return
+	exit_code = run(args, config, parser)
+	if exit_code != 0:
+		sys.exit(exit_code)
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main()
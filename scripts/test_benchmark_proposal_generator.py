@@ -0,0 +1,66 @@
+# Tests for benchmark_proposal_generator.py
+
+import unittest
+import os
+import tempfile
+from benchmark_proposal_generator import *
+from proposal_generator import csv_to_list
+
+
+class TestSyntheticCSV(unittest.TestCase):
+
+    def test_valid_and_deterministic(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for is_welcome in [False, True]:
+                with self.subTest(is_welcome):
+                    filename1 = os.path.join(directory, "test1.csv")
+                    filename2 = os.path.join(directory, "test2.csv")
+                    generate_csv(filename1, 200, is_welcome, 7)
+                    generate_csv(filename2, 200, is_welcome, 7)
+                    with open(filename1) as file1, open(filename2) as file2:
+                        content = file1.read()
+                        self.assertEqual(content, file2.read())
+                    #Both separator styles are used
+                    self.assertIn('"', content)
+                    self.assertEqual(len(csv_to_list(filename1, is_welcome, '.', ',', ',')), 200)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run_all(self):
+        results = run_all([20], ["welcome", "scheduled"], 1, 1)
+        self.assertEqual([(result["mode"], result["rows"]) for result in results["results"]], [("welcome", 20), ("scheduled", 20)])
+        for result in results["results"]:
+            self.assertEqual(list(result["stages"]), ["csv_read", "address_validation", "amount_parsing", "scheduling", "serialization", "file_write"])
+
+    def test_run_benchmark(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_filename = os.path.join(directory, "test.csv")
+            generate_csv(csv_filename, 30, False, 3)
+            for jobs in [1, 2]:
+                with self.subTest(jobs=jobs):
+                    output_dir = os.path.join(directory, f"output_{jobs}")
+                    os.mkdir(output_dir)
+                    (timings, total) = run_benchmark(csv_filename, output_dir, False, jobs)
+                    self.assertGreater(total, 0)
+                    #The files are those of the generator
+                    self.assertEqual(sorted(os.listdir(output_dir)), [f"pre-proposal_test_{i:03}.json" for i in range(1, 31)])
+                    if jobs == 1:
+                        self.assertEqual(list(timings), ["csv_read", "address_validation", "amount_parsing", "scheduling", "serialization", "file_write"])
+                        #All stages were run
+                        self.assertTrue(all(seconds > 0 for seconds in timings.values()))
+                    else:
+                        self.assertIn("parallel_generation", timings)
+            with open(os.path.join(directory, "output_1", "pre-proposal_test_030.json")) as serial, open(os.path.join(directory, "output_2", "pre-proposal_test_030.json")) as parallel:
+                self.assertEqual(json.load(serial)["payload"], json.load(parallel)["payload"])
+
+    def test_find_regressions(self):
+        def results(seconds):
+            return {"results": [{"mode": "welcome", "rows": 10, "stages": {"csv_read": {"seconds": seconds}}}]}
+        self.assertEqual(find_regressions(results(1.0), results(1.1), 0.2), [])
+        self.assertEqual(len(find_regressions(results(1.0), results(1.3), 0.2)), 1)
+        self.assertEqual(find_regressions(results(0.001), results(0.003), 0.2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,13 @@
 from decimal import Decimal
 import unittest
 import random
+import tempfile
+from functools import partial
 from unittest.case import skip
 from dateutil.relativedelta import relativedelta
 from unittest.mock import patch, mock_open
 from proposal_generator import *
+from proposal_client import send_request
 
 
 class TestTransferAmount(unittest.TestCase):
@@ -52,6 +55,29 @@ class TestTransferAmount(unittest.TestCase):
         #Too large
         self.assertRaises(ValueError, TransferAmount.from_string,str(TransferAmount.max_amount//1000000+1),'.',',')
 
+    def test_from_string_separators(self):
+        self.assertEqual(TransferAmount.from_string('1.278,123456',',','.'),TransferAmount(1278123456))
+        self.assertEqual(TransferAmount.from_string('1 278 000,5',',',' '),TransferAmount(1278000500000))
+        self.assertEqual(TransferAmount.from_string('1278',',','.'),TransferAmount(1278000000))
+        self.assertRaises(ValueError, TransferAmount.from_string,'1,278.123456',',','.')
+        self.assertRaises(ValueError, TransferAmount.from_string,'1278.1',',','.')
+
+    def test_from_string_error_messages(self):
+        with self.assertRaises(ValueError) as context:
+            TransferAmount.from_string(' 12,0 ','.',',')
+        self.assertEqual(str(context.exception), '"12,0" is not a valid amount string.')
+        with self.assertRaises(ValueError) as context:
+            TransferAmount.from_string('0.000','.',',')
+        self.assertEqual(str(context.exception), f"Amount 0 not in valid range (0,{TransferAmount.max_amount}]")
+
+    def test_parse_many(self):
+        amount_strings = [f"{random.randrange(1,10**12):,}.{random.randrange(0,10**6):06}" for _ in range(1000)]
+        result = TransferAmount.parse_many(amount_strings,'.',',')
+        self.assertEqual(result.typecode, 'Q')
+        self.assertEqual(list(result), [int(Decimal(a.replace(',','')) * 1000000) for a in amount_strings])
+        self.assertEqual(list(TransferAmount.parse_many([str(TransferAmount.max_amount//1000000)],'.',',')), [TransferAmount.max_amount//1000000*1000000])
+        self.assertRaises(ValueError, TransferAmount.parse_many, ['1.0', '1,0'],'.',',')
+
     def test_addition(self):
         #Random additions in valid range
         for i in range(0,1000):
@@ -74,6 +100,49 @@ class TestTransferAmount(unittest.TestCase):
             self.assertEqual(y[i],TransferAmount(1))
         self.assertEqual(y[-1],TransferAmount(2))
 
+class TestAddressValidation(unittest.TestCase):
+
+    def test_same_as_base58(self):
+        import base58
+        addresses = ['38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7 ',
+            '39Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', ' 4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7',
+            '', '1', '111', '0OIl', '٠', base58.b58encode_check(b'').decode(), base58.b58encode_check(b'\0\0abc').decode()]
+        for i in range(200):
+            payload = bytes(random.randrange(0,256) for _ in range(random.randrange(0,40)))
+            address = base58.b58encode_check(payload).decode()
+            position = random.randrange(0,len(address))
+            addresses += [address, address[:position] + random.choice('123abcXYZ') + address[position+1:]]
+        for address in addresses:
+            with self.subTest(address):
+                try:
+                    expected = base58.b58decode_check(address)
+                except:
+                    expected = None
+                self.assertEqual(b58decode_check(address), expected)
+                self.assertEqual(is_valid_address(address), expected is not None)
+
+    def test_validate_column(self):
+        valid = '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+        invalid = '39Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+        validate_address_column([valid] * 100, "sender")
+        with self.assertRaisesRegex(ValueError, f'Invalid receiver address "{invalid}" in row 14.'):
+            validate_address_column([valid] * 3 + [invalid] + [valid, invalid], "receiver", 11)
+
+class TestPreProposalJson(unittest.TestCase):
+
+    def test_same_as_json_dumps(self):
+        for num_releases in [0, 1, 2, 10, 100]:
+            with self.subTest(num_releases):
+                pre_proposal = ScheduledPreProposal('38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', datetime.now())
+                for _ in range(num_releases):
+                    pre_proposal.add_release(TransferAmount(random.randrange(1,TransferAmount.max_amount)), datetime.now() + relativedelta(days = random.randrange(0,1000)))
+                self.assertEqual(pre_proposal.to_json(), json.dumps(pre_proposal.data, indent=4))
+                self.assertEqual(pre_proposal.to_json(indent=None), json.dumps(pre_proposal.data))
+
+    def test_escaping(self):
+        pre_proposal = ScheduledPreProposal('a"b\\c', 'ü\n', datetime.now())
+        self.assertEqual(pre_proposal.to_json(), json.dumps(pre_proposal.data, indent=4))
+
 class TestCSVReader(unittest.TestCase):
 
     def test_valid_release(self):
@@ -181,6 +250,94 @@ class TestCSVReader(unittest.TestCase):
             self.assertRaises(ValueError,csv_to_list,test_filename,False,'.',',',',')
             mock_file.assert_called_once_with(test_filename, newline='', encoding='utf-8-sig')
 
+    def test_streaming_reader(self):
+        release_test_data = ( #third row is bad
+            '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7," 1,000.000000 "," 2,000.000000 "\n'
+            '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7," 2,000.000000 "," 2,000.000000 "\n'
+            '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7," 3,000.0000000 "," 2,000.000000 "\n'
+        )
+        test_filename = './test.csv'
+        with patch('builtins.open', new=mock_open(read_data=release_test_data)) as mock_file:
+            transfers = iter_transfers(test_filename,False,'.',',',',')
+            #valid rows are available before the bad row is read
+            self.assertEqual(next(transfers)["initial_amount"],TransferAmount(1000000000))
+            self.assertEqual(next(transfers)["initial_amount"],TransferAmount(2000000000))
+            with self.assertRaisesRegex(ValueError,"In row 3:"):
+                next(transfers)
+            mock_file.assert_called_once_with(test_filename, newline='', encoding='utf-8-sig')
+
+    def test_csv_ranges(self):
+        rows = [
+            ['38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', ' 1,000.000000 ', '2.000000'],
+            ['multi\nline', 'with "quotes"', '', 'a,b'],
+            [],
+            ['"\r\n"', 'x']
+        ] * 20
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "test.csv")
+            for encoding, line_terminator in [('utf-8', '\n'), ('utf-8-sig', '\r\n')]:
+                with open(filename, 'w', newline='', encoding=encoding) as csv_file:
+                    csv.writer(csv_file, lineterminator=line_terminator).writerows(rows)
+                    csv_file.write("last,row")
+                expected = list(read_csv_rows(filename, ','))
+                for range_size in [1, 10, 100, 1<<20]:
+                    with self.subTest(encoding=encoding, range_size=range_size):
+                        csv_ranges = list(iter_csv_ranges(filename, ',', range_size))
+                        self.assertEqual([row for csv_range in csv_ranges for row in csv_range.read(',')], expected)
+                        #Ranges can be read in any order and still have the right row numbers
+                        self.assertEqual(sorted(row for csv_range in reversed(csv_ranges) for row in csv_range.read(',')), expected)
+                        self.assertEqual(sum(csv_range.row_count for csv_range in csv_ranges), len(expected))
+                self.assertEqual(count_csv_rows(filename, ','), len(expected))
+            # Quotes inside unquoted fields are literal, and lines can end with only a carriage return
+            for content in ['a,1"5,c\nb,"q\nx",d\n', 'a,b\rc,"d\re"\r', 'x,"a"b"c,\n"multi\nline"\r\n', 'a"b,"c\nd",""""\n']:
+                with open(filename, 'w', newline='') as csv_file:
+                    csv_file.write(content * 30)
+                expected = list(read_csv_rows(filename, ','))
+                for range_size in [1, 10, 1<<20]:
+                    with self.subTest(content=content, range_size=range_size):
+                        csv_ranges = list(iter_csv_ranges(filename, ',', range_size))
+                        self.assertEqual([row for csv_range in csv_ranges for row in csv_range.read(',')], expected)
+                        self.assertEqual([csv_range.first_row_number for csv_range in csv_ranges],
+                            list(itertools.accumulate([1] + [csv_range.row_count for csv_range in csv_ranges[:-1]])))
+                self.assertEqual(count_csv_rows(filename, ','), len(expected))
+            # An unterminated quoted field runs to the end of the file, and delimiters can be non-ASCII characters
+            for content, delimiter in [('a,b\n"open\nc,d\n', ','), ('a§"b\n§"§c\nd§é\n', '§')]:
+                with open(filename, 'w', newline='', encoding='utf-8') as csv_file:
+                    csv_file.write(content)
+                csv_ranges = list(iter_csv_ranges(filename, delimiter, 1))
+                self.assertEqual([row for csv_range in csv_ranges for row in csv_range.read(delimiter)], list(read_csv_rows(filename, delimiter)))
+            open(filename, 'w').close()
+            self.assertEqual(list(iter_csv_ranges(filename, ',')), [])
+
+class TestTransferBatch(unittest.TestCase):
+    sender = '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+    receiver = '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7'
+
+    def test_same_as_parse_row(self):
+        for is_welcome in [False, True]:
+            with self.subTest(is_welcome):
+                rows = [(i, [self.sender, self.receiver, f"{i:,}.5"] + ([] if is_welcome else [f"{i}.000001"])) for i in range(1,2000,7)]
+                batch = TransferBatch(is_welcome)
+                for row_number, row_data in rows:
+                    batch.append_row(row_number, row_data, '.', ',')
+                self.assertEqual(len(batch), len(rows))
+                self.assertEqual(list(batch.row_numbers), [row_number for row_number, _ in rows])
+                for i, (row_number, row_data) in enumerate(rows):
+                    self.assertEqual(batch[i], parse_row(row_number, row_data, is_welcome, '.', ','))
+                self.assertEqual(len(set(map(id, batch.senders))), 1)
+
+    def test_invalid_row(self):
+        batch = TransferBatch(False)
+        batch.append_row(1, [self.sender, self.receiver, "1", "1"], '.', ',')
+        with self.assertRaisesRegex(ValueError, "In row 2:"):
+            batch.append_row(2, [self.sender, self.receiver, "1", "0"], '.', ',')
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(len(batch.remaining_amounts), 1)
+
+    def test_slots(self):
+        self.assertFalse(hasattr(TransferAmount(1), '__dict__'))
+        self.assertFalse(hasattr(TransferBatch(False), '__dict__'))
+
 class TestReleaseScheduleBuilder(unittest.TestCase):
 
     def test_valid_releases(self):
@@ -219,6 +376,91 @@ class TestReleaseScheduleBuilder(unittest.TestCase):
         not_relevant = time1
         self.assertRaises(ValueError,build_release_schedule,time2,time1,not_relevant,num_releases)
 
+    def test_cadence(self):
+        ir_time = datetime.fromisoformat("2030-01-01T12:00:00+00:00")
+        (release_times,skipped_releases) = build_release_schedule(ir_time,ir_time,ir_time,4,relativedelta(weeks = +2))
+        self.assertEqual(release_times,[ir_time] + [ir_time + relativedelta(days = +14*i) for i in range(1,3)])
+        self.assertEqual(skipped_releases,1)
+
+class TestScheduleBook(unittest.TestCase):
+    sender = '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+    receiver = '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7'
+    definitions = {
+        "default_schedule" : "monthly",
+        "decimal_sep" : ',',
+        "thousands_sep" : '.',
+        "schedules" : {
+            "monthly" : {"releases": 3, "initial_release": "2030-01-15T14:00:00+01:00", "first_remaining_release": "2030-02-15T14:00:00+01:00"},
+            "weekly" : {"releases": 3, "initial_release": "2030-03-01T12:00:00+00:00", "cadence": {"weeks": 1}},
+            "late" : {"releases": 3, "initial_release": "2020-01-01T12:00:00+00:00", "earliest_release": "2020-02-15T00:00:00+00:00"}
+        }
+    }
+
+    def load_schedules(self, definitions):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "schedules.json")
+            with open(filename, 'w') as schedule_file:
+                json.dump(definitions, schedule_file)
+            return load_schedule_file(filename, get_config())
+
+    def test_load_schedule_file(self):
+        (schedules, default_id, config) = self.load_schedules(self.definitions)
+        self.assertEqual((config["decimal_sep"], config["thousands_sep"], config["csv_delimiter"]), (',', '.', ','))
+        book = ScheduleBook(schedules, default_id, False, date(2025, 1, 1))
+        self.assertIs(book.default(), book.compiled["monthly"])
+        weekly = datetime.fromisoformat("2030-03-01T12:00:00+00:00")
+        self.assertEqual(book.compiled["weekly"].release_times, [weekly, weekly + relativedelta(weeks = +1), weekly + relativedelta(weeks = +2)])
+        self.assertEqual(book.compiled["weekly"].timestamps, [int(release_time.timestamp())*1000 for release_time in book.compiled["weekly"].release_times])
+        late = book.compiled["late"]
+        self.assertEqual((late.release_times[0], late.skipped_releases), (datetime.fromisoformat("2020-02-15T00:00:00+00:00"), 1))
+        welcome_book = ScheduleBook(schedules, default_id, True, date(2025, 1, 1))
+        self.assertEqual(welcome_book.compiled["weekly"].release_times, [weekly])
+        for definition, message in [
+            ({"releases": 0, "initial_release": "2030-01-01T00:00:00+00:00"}, "releases must be a positive integer"),
+            ({"releases": True, "initial_release": "2030-01-01T00:00:00+00:00"}, "releases must be a positive integer"),
+            ({"releases": 2, "initial_release": "2030-01-01T00:00:00+00:00", "cadence": {"months": True}}, "cadence must map"),
+            ({"releases": 2, "initial_release": "2030-01-01T00:00:00"}, "must have a time zone"),
+            ({"releases": 2, "initial_release": "2030-01-01T00:00:00+00:00", "cadence": {"fortnights": 1}}, "cadence must map"),
+            ({"releases": 2}, "missing 'initial_release'")]:
+            with self.subTest(message):
+                with self.assertRaisesRegex(ValueError, message):
+                    self.load_schedules({"schedules": {"a": definition}})
+        for name, value, message in [
+            ("csv_delimiter", 1, "\"csv_delimiter\" must be a string"),
+            ("decimal_sep", None, "\"decimal_sep\" must be a string"),
+            ("default_schedule", ["monthly"], "\"default_schedule\" must be a schedule ID")]:
+            with self.subTest(name):
+                with self.assertRaisesRegex(ValueError, message):
+                    self.load_schedules(dict(self.definitions, **{name: value}))
+        self.assertRaisesRegex(ValueError, "Default schedule", ScheduleBook, schedules, "default", False, date.today())
+        # A single release leaves no release for the remaining amount, except for welcome transfers
+        (single, default_id, _) = self.load_schedules({"schedules": {"default": {"releases": 1, "initial_release": "2030-01-01T00:00:00+00:00"}}})
+        self.assertRaisesRegex(ValueError, "Invalid schedule \"default\": releases must be at least 2", ScheduleBook, single, default_id, False, date(2025, 1, 1))
+        self.assertEqual(ScheduleBook(single, default_id, True, date(2025, 1, 1)).default().num_releases, 1)
+
+    def test_mixed_schedules(self):
+        (schedules, default_id, _) = self.load_schedules(self.definitions)
+        book = ScheduleBook(schedules, default_id, False, date(2025, 1, 1))
+        rows = [(i, [self.sender, self.receiver, f"{i}.000,5", f"{i},000009", ["monthly", "weekly", "late", ""][i % 4]]) for i in range(1, 40)]
+        self.assertEqual(book.split_row(1, rows[0][1], False), (rows[0][1][:4], "weekly"))
+        self.assertRaisesRegex(ValueError, "Unknown schedule \"other\" in row 3", book.split_row, 3, rows[0][1][:4] + ["other"], False)
+        self.assertRaisesRegex(ValueError, "Row 3 contains 4", book.split_row, 3, rows[0][1][:4], False)
+        expected = []
+        for row_number, row_data in rows:
+            transfer = parse_scheduled_row(row_number, row_data, False, ',', '.', book)
+            expected.append((row_number, build_scheduled_pre_proposal(transfer, False, book, datetime.now()).to_json()))
+        self.assertEqual(json.loads(expected[1][1])["payload"]["schedule"][0]["timestamp"], book.compiled["late"].timestamps[0])
+        job = dict(TestParallelGeneration().get_job(), decimal_sep=',', thousands_sep='.', schedules=book)
+        with ProcessPoolExecutor(max_workers=2, initializer=init_worker, initargs=(job,)) as executor:
+            result = [(n, p.content) for (n, p) in iter_proposals_executor(executor, chunked(rows, 7), 2)]
+        self.assertEqual(len(result), len(expected))
+        for (n, content), (expected_n, expected_content) in zip(result, expected):
+            self.assertEqual(n, expected_n)
+            self.assertEqual(json.loads(content)["payload"], json.loads(expected_content)["payload"])
+        self.assertEqual(check_row(5, rows[0][1][:4] + ["other"], False, ',', '.', 3, 0, book), [(5, 5, 'Unknown schedule "other".')])
+        self.assertEqual(check_row(5, rows[0][1][:4], False, ',', '.', 3, 0, book)[0][0:2], (5, None))
+        self.assertEqual(check_row(5, rows[0][1], False, ',', '.', 3, 0, book), [])
+
 class TestAmountToScheduledList(unittest.TestCase):
 
     def test_valid_amounts(self):
@@ -252,7 +494,959 @@ class TestAmountToScheduledList(unittest.TestCase):
     def test_invalid_amounts(self):
         self.assertRaises(ValueError,amounts_to_scheduled_list,TransferAmount(1),TransferAmount(1),10,10)
 
+class TestExpiryChunks(unittest.TestCase):
+
+    def test_chunks(self):
+        expiry_chunks = ExpiryChunks(datetime.fromtimestamp(1700000000, timezone.utc), 100, 400)
+        self.assertEqual([expiry_chunks.chunk(row_number) for row_number in [1, 100, 101, 250]], [0, 0, 1, 2])
+        self.assertEqual(expiry_chunks.chunk_count(250), 3)
+        self.assertEqual(expiry_chunks.chunk_expiry(2), 1700000000 + 1800)
+        self.assertEqual(expiry_chunks.expiry(150).timestamp(), 1700000000 + 900)
+
+    def test_split_runs(self):
+        expiry_chunks = ExpiryChunks(datetime.fromtimestamp(1700000000, timezone.utc), 10, 10)
+        self.assertEqual(list(expiry_chunks.split_runs([[3, 5], [8, 25], [41, 42]])), [
+            (0, [[3, 5], [8, 10]]), (1, [[11, 20]]), (2, [[21, 25]]), (4, [[41, 42]])])
+        self.assertEqual(list(expiry_chunks.split_runs([])), [])
+
+class TestCompactSchedule(unittest.TestCase):
+
+    def test_same_as_amounts_to_scheduled_list(self):
+        for i in range(0,500):
+            with self.subTest(i):
+                num_releases = random.randrange(2,25)
+                skipped = random.randrange(0,num_releases)
+                initial_amount = random.randrange(1,10**random.randrange(1,15))
+                remaining_amount = random.randrange(num_releases-1,10**random.randrange(3,15))
+                schedule = CompactSchedule.split(initial_amount, remaining_amount, num_releases, skipped)
+                expected = amounts_to_scheduled_list(TransferAmount(initial_amount),TransferAmount(remaining_amount),num_releases,skipped)
+                self.assertEqual(list(schedule.amounts()), [amount.get_micro_GTU() for amount in expected])
+                self.assertEqual(len(schedule), len(expected))
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, CompactSchedule.split, 1, 10, 10, 10)
+        self.assertRaisesRegex(ValueError, "not in valid range", CompactSchedule.split, TransferAmount.max_amount, 10, 10, 1)
+        self.assertRaisesRegex(AssertionError, "too small", CompactSchedule.split, 1, 10, 12, 1)
+        self.assertRaises(AssertionError, CompactSchedule.split, 1, 10, 1, 0)
+
+    def test_same_as_expanded(self):
+        timestamps = [1700000000000 + 1000*i for i in range(10)]
+        expiry = datetime.fromtimestamp(1690000000, timezone.utc)
+        pre_proposal = CompactPreProposal("sender\"", "receiver", expiry, CompactSchedule.split(1000, 10, 10, 3), timestamps)
+        expanded = pre_proposal.expand()
+        self.assertEqual(len(expanded.data["payload"]["schedule"]), 7)
+        self.assertEqual(pre_proposal.to_json(), expanded.to_json())
+        self.assertEqual(pre_proposal.to_json(None), expanded.to_json(None))
+        self.assertEqual(pre_proposal.input_digest(), expanded.input_digest())
+
+
+class TestParallelGeneration(unittest.TestCase):
+    sender = '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+    receiver = '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7'
+
+    def get_job(self):
+        release_time = datetime.combine(date.today(), time.fromisoformat("14:00:00+01:00"))
+        release_times = [release_time + relativedelta(months = +i) for i in range(10)]
+        return {
+            "is_welcome" : False,
+            "decimal_sep" : '.',
+            "thousands_sep" : ',',
+            "release_times" : release_times,
+            "release_timestamps" : release_timestamps(release_times),
+            "skipped_releases" : 0,
+            "num_releases" : 10,
+            "expiry" : release_time,
+            "expiry_chunks" : None,
+            "indent" : 4,
+            "input_digests" : False,
+            "schedules" : None
+        }
+
+    def test_same_as_serial(self):
+        job = self.get_job()
+        rows = [(i, [self.sender, self.receiver, f"{i},000.5", f"{i}.000009"]) for i in range(1,50)]
+        expected = []
+        for row_number, row_data in rows:
+            transfer = parse_row(row_number, row_data, False, '.', ',')
+            pre_proposal = build_pre_proposal(transfer, False, job["release_times"], 0, 10, job["expiry"])
+            expected.append((row_number, pre_proposal.to_json()))
+        with ProcessPoolExecutor(max_workers=3, initializer=init_worker, initargs=(job,)) as executor:
+            result = [(n, p.content) for (n, p) in iter_proposals_executor(executor, chunked(rows, 4), 3)]
+        self.assertEqual(result, expected)
+
+    def test_unschedulable_row(self):
+        rows = [(i, [self.sender, self.receiver, "1.0", "1.0"]) for i in range(1,10)]
+        rows[5] = (6, [self.sender, self.receiver, "1.0", "0.000008"])
+        init_worker(self.get_job())
+        (result, error) = generate_chunk(rows)
+        self.assertEqual([row_number for row_number, _ in result], [1,2,3,4,5])
+        self.assertIsInstance(error, ValueError)
+        self.assertEqual(str(error), "In row 6: Cannot split 8 into 9 parts, amount is too small")
+        rows[5] = (6, [self.sender, self.receiver, "1.0", "1.0", "1.0"])
+        (result, error) = generate_chunk(rows)
+        self.assertEqual([row_number for row_number, _ in result], [1,2,3,4,5])
+        self.assertRegex(str(error), "Row 6 contains 5")
+
+    def test_first_error_reported(self):
+        rows = [(i, [self.sender, self.receiver, "1.0", "1.0"]) for i in range(1,30)]
+        rows[16] = (17, [self.sender, self.receiver, "1.0", "-1.0"])
+        rows[24] = (25, [self.sender, self.receiver, "1.0"])
+        with ProcessPoolExecutor(max_workers=2, initializer=init_worker, initargs=(self.get_job(),)) as executor:
+            with self.assertRaisesRegex(ValueError, "In row 17:"):
+                list(iter_proposals_executor(executor, chunked(rows, 3), 2))
+
+    def test_csv_ranges(self):
+        job = dict(self.get_job(), csv_delimiter=',')
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "test.csv")
+            with open(filename, 'w') as csv_file:
+                for i in range(1, 30):
+                    csv_file.write(f'{self.sender},{self.receiver},"1,{i:03}.0",' + ('-1.0' if i == 23 else '1.0') + '\n')
+            result = []
+            with ProcessPoolExecutor(max_workers=2, initializer=init_worker, initargs=(job,)) as executor:
+                expected = [(n, p.content) for (n, p) in iter_proposals_executor(executor, chunked(itertools.islice(read_csv_rows(filename, ','), 22), 4), 2)]
+                with self.assertRaisesRegex(ValueError, "In row 23:"):
+                    for (n, p) in iter_proposals_executor(executor, iter_csv_ranges(filename, ',', 200), 2):
+                        result.append((n, p.content))
+            self.assertEqual(result, expected)
+
+
+class TestContainerWriters(unittest.TestCase):
+
+    def test_extract_proposals(self):
+        pre_proposals = []
+        for i in range(1,6):
+            pre_proposal = ScheduledPreProposal('38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', datetime.now())
+            pre_proposal.add_release(TransferAmount(i*1000), datetime.now())
+            pre_proposals.append((f"pre-proposal_test_{i:03}.json", pre_proposal))
+        with tempfile.TemporaryDirectory() as directory:
+            for output_format in ["jsonl", "tar", "zip"]:
+                with self.subTest(output_format):
+                    filename = os.path.join(directory, "test." + output_format)
+                    with open_writer(output_format, filename) as writer:
+                        for name, pre_proposal in pre_proposals:
+                            writer.write(name, pre_proposal)
+                    for name, pre_proposal in reversed(pre_proposals):
+                        self.assertEqual(extract_proposal(filename, name), pre_proposal.data)
+                    self.assertRaises(KeyError, extract_proposal, filename, "missing.json")
+
+    def test_archive_content(self):
+        pre_proposal = ScheduledPreProposal('38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', datetime.now())
+        pre_proposal.add_release(TransferAmount(1000), datetime.now())
+        with tempfile.TemporaryDirectory() as directory:
+            with open_writer("zip", os.path.join(directory, "test.zip")) as writer:
+                writer.write("a.json", pre_proposal)
+            with open_writer("tar", os.path.join(directory, "test.tar")) as writer:
+                writer.write("a.json", pre_proposal)
+            with zipfile.ZipFile(os.path.join(directory, "test.zip")) as archive:
+                self.assertEqual(archive.read("a.json").decode(), json.dumps(pre_proposal.data, indent=4))
+            with tarfile.open(os.path.join(directory, "test.tar")) as archive:
+                self.assertEqual(archive.extractfile("a.json").read().decode(), json.dumps(pre_proposal.data, indent=4))
+
+    def test_compressed(self):
+        pre_proposal = ScheduledPreProposal('38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', datetime.now())
+        pre_proposal.add_release(TransferAmount(1000), datetime.now())
+        content = json.dumps(pre_proposal.data, indent=4)
+        with tempfile.TemporaryDirectory() as directory:
+            for compression in ["gzip", "xz"]:
+                for output_format in ["jsonl", "tar", "zip"]:
+                    with self.subTest((output_format, compression)):
+                        filename = os.path.join(directory, "test." + output_format + compression_suffix(compression))
+                        with open_writer(output_format, filename, compression=compression, level=1) as writer:
+                            for name in ["a.json", "b.json", "c.json"]:
+                                writer.write(name, pre_proposal)
+                        for name in ["c.json", "a.json"]:
+                            self.assertEqual(extract_proposal(filename, name), pre_proposal.data)
+                        self.assertEqual(writer.compressed_bytes, os.path.getsize(filename))
+                        # Entries are compressed separately, and the whole file decompresses to the container
+                        with open_output(filename) as container_file:
+                            container = container_file.read()
+                        self.assertEqual(writer.uncompressed_bytes, len(container))
+                        if output_format == "jsonl":
+                            self.assertEqual([json.loads(line)["name"] for line in container.splitlines()], ["a.json", "b.json", "c.json"])
+                        elif output_format == "tar":
+                            with tarfile.open(fileobj=io.BytesIO(container)) as archive:
+                                self.assertEqual(archive.extractfile("b.json").read().decode(), content)
+                        else:
+                            with zipfile.ZipFile(io.BytesIO(container)) as archive:
+                                self.assertEqual(archive.read("b.json").decode(), content)
+
+                    filename = os.path.join(directory, "a.json" + compression_suffix(compression))
+                    with open_writer("files", "", 2, compression) as writer:
+                        writer.write(filename, pre_proposal)
+                    self.assertEqual((writer.uncompressed_bytes, writer.compressed_bytes), (len(content), os.path.getsize(filename)))
+                    with open_output(filename, 'rt') as json_file:
+                        self.assertEqual(json_file.read(), content)
+                    self.assertEqual(json_file_digest(filename), content_digest(content))
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def get_pre_proposal(self, amount):
+        pre_proposal = ScheduledPreProposal('38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', datetime.now())
+        pre_proposal.add_release(TransferAmount(amount), datetime.now())
+        return pre_proposal
+
+    def test_writes_all_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for fsync_batch in [0, 3]:
+                with self.subTest(fsync_batch=fsync_batch):
+                    written = []
+                    pre_proposals = [(os.path.join(directory, f"test_{fsync_batch}_{i:03}.json"), self.get_pre_proposal(i)) for i in range(1, 11)]
+                    writer = BackgroundWriter(open_writer("files", "", fsync_batch), 2)
+                    for name, pre_proposal in pre_proposals:
+                        writer.write(name, pre_proposal, partial(written.append, name))
+                    writer.close()
+                    self.assertEqual(written, [name for name, _ in pre_proposals])
+                    for name, pre_proposal in pre_proposals:
+                        with open(name) as json_file:
+                            self.assertEqual(json_file.read(), json.dumps(pre_proposal.data, indent=4))
+
+    def test_fsync_batch_open_files(self):
+        try:
+            import resource
+        except ImportError:
+            self.skipTest("resource limits are not supported on this platform")
+        (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+        with tempfile.TemporaryDirectory() as directory:
+            #Batches larger than the limit of open files are written, as files are only reopened one at a time to sync them
+            resource.setrlimit(resource.RLIMIT_NOFILE, (64, hard))
+            try:
+                for compression in [None, "gzip"]:
+                    with self.subTest(compression=compression):
+                        written = []
+                        writer = open_writer("files", "", 1000, compression)
+                        for i in range(1, 201):
+                            writer.write(os.path.join(directory, f"test_{compression}_{i:03}.json"), self.get_pre_proposal(i), partial(written.append, i))
+                        self.assertEqual(written, [])
+                        writer.close()
+                        self.assertEqual(written, list(range(1, 201)))
+            finally:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    def test_container(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "test.jsonl")
+            writer = BackgroundWriter(open_writer("jsonl", filename), 2)
+            pre_proposal = self.get_pre_proposal(1000)
+            writer.write("a.json", pre_proposal)
+            writer.close()
+            self.assertEqual(extract_proposal(filename, "a.json"), pre_proposal.data)
+
+    def test_write_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            missing = os.path.join(directory, "missing", "test_001.json")
+            written = []
+            writer = BackgroundWriter(open_writer("files", ""), 2)
+            writer.write(missing, self.get_pre_proposal(1))
+            writer.write(os.path.join(directory, "test_002.json"), self.get_pre_proposal(2), partial(written.append, 2))
+            with self.assertRaises(IOError) as context:
+                writer.close()
+            self.assertEqual(context.exception.filename, missing)
+            #Files after the error are not written
+            self.assertEqual(written, [])
+            self.assertFalse(os.path.exists(os.path.join(directory, "test_002.json")))
+
+    def test_callback_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            def fail():
+                raise RuntimeError("callback failed")
+            writer = BackgroundWriter(open_writer("files", ""), 1)
+            writer.write(os.path.join(directory, "test_001.json"), self.get_pre_proposal(1), fail)
+            #The thread keeps draining the queue, so writes do not block on the full queue
+            for i in range(2, 6):
+                try:
+                    writer.write(os.path.join(directory, f"test_{i:03}.json"), self.get_pre_proposal(i))
+                except RuntimeError:
+                    break
+            self.assertRaisesRegex(RuntimeError, "callback failed", writer.close)
+            self.assertFalse(writer.thread.is_alive())
+
+class TestProposalManifest(unittest.TestCase):
+
+    def test_changes(self):
+        for budget in [None, MemoryBudget(0)]:
+            with self.subTest(budget=budget):
+                self.check_changes(budget)
+
+    def check_changes(self, budget):
+        with tempfile.TemporaryDirectory() as directory:
+            manifest_file = os.path.join(directory, "test.manifest")
+            file_name = os.path.join(directory, "test_001.json")
+            manifest = ProposalManifest(manifest_file, budget)
+            expiry = manifest.now + 3600
+            self.assertEqual(manifest.change(1, file_name, "a"), "new")
+            with open(file_name, 'w') as json_file:
+                json_file.write("content")
+            manifest.add(1, file_name, "a", "content", expiry)
+            manifest.close()
+            #Simulate interrupted write of the next entry
+            with open(manifest_file, 'a') as partial:
+                partial.write('{"row": 2, "fi')
+            manifest = ProposalManifest(manifest_file, budget)
+            self.assertIsNone(manifest.change(1, file_name, "a"))
+            self.assertIsNone(manifest.change(1, file_name, "a", expiry))
+            self.assertEqual(manifest.change(1, file_name, "a", expiry + 1), "rescheduled")
+            self.assertEqual(manifest.change(1, file_name, "b"), "changed")
+            self.assertEqual(manifest.change(2, file_name, "a"), "new")
+            manifest.now = expiry
+            self.assertEqual(manifest.change(1, file_name, "a"), "expired")
+            manifest.now = expiry - 1
+            with open(file_name, 'w') as json_file:
+                json_file.write("edited")
+            self.assertEqual(manifest.change(1, file_name, "a"), "modified")
+            os.remove(file_name)
+            self.assertEqual(manifest.change(1, file_name, "a"), "missing")
+            manifest.add(2, file_name, "c", "content", expiry)
+            self.assertEqual(sorted(ProposalManifest(manifest_file).entries), [1, 2])
+            manifest.compact(1)
+            #Compacting closes the manifest and its spilled entries
+            self.assertIsNone(manifest.entries.database)
+            self.assertEqual(len(manifest.entries), 0)
+            self.assertEqual(sorted(ProposalManifest(manifest_file).entries), [1])
+            self.assertEqual(ProposalManifest(manifest_file).entry(1)["expiry"], expiry)
+            #Entries without expiry were written by an earlier version, and are rewritten
+            with open(manifest_file, 'w') as legacy:
+                legacy.write(json.dumps({"row": 1, "file": file_name, "input": "a", "output": content_digest("content")}) + "\n")
+            with open(file_name, 'w') as json_file:
+                json_file.write("content")
+            manifest = ProposalManifest(manifest_file, budget)
+            self.assertEqual(manifest.change(1, file_name, "a"), "expired")
+            manifest.close()
+
+    def test_input_digest(self):
+        pre_proposal = ScheduledPreProposal('38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', datetime.now())
+        pre_proposal.add_release(TransferAmount(1000), datetime.now())
+        later = ScheduledPreProposal('38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', datetime.now() + relativedelta(hours = +1))
+        later.data["payload"]["schedule"] = list(pre_proposal.data["payload"]["schedule"])
+        #Expiry does not change the input digest
+        self.assertEqual(pre_proposal.input_digest(), later.input_digest())
+        self.assertEqual(SerializedPreProposal(pre_proposal.to_json()).input_digest(), pre_proposal.input_digest())
+        later.add_release(TransferAmount(1), datetime.now())
+        self.assertNotEqual(pre_proposal.input_digest(), later.input_digest())
+
+class TestDigestManifest(unittest.TestCase):
+
+    # Merkle Tree Hash of RFC 6962, computed recursively
+    def merkle_tree_hash(self, leaves):
+        if not leaves:
+            return hashlib.sha256(b"").digest()
+        if len(leaves) == 1:
+            return hashlib.sha256(b"\0" + leaves[0]).digest()
+        k = 1
+        while 2 * k < len(leaves):
+            k *= 2
+        return hashlib.sha256(b"\1" + self.merkle_tree_hash(leaves[:k]) + self.merkle_tree_hash(leaves[k:])).digest()
+
+    def test_merkle_root(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for count in range(12):
+                with self.subTest(count=count):
+                    digests = DigestManifest(os.path.join(directory, "test"))
+                    leaves = []
+                    for i in range(count):
+                        digest = hashlib.sha256(str(i).encode()).hexdigest()
+                        digests.add(os.path.join(directory, f"test_{i:03}.json"), digest)
+                        leaves.append(f"test_{i:03}.json\0{digest}".encode())
+                    digests.finish()
+                    self.assertEqual(digests.root(), self.merkle_tree_hash(leaves).hex())
+                    with open(os.path.join(directory, "test.merkle.json")) as root_file:
+                        root = json.load(root_file)
+                    self.assertEqual((root["proposals"], root["root"]), (count, digests.root()))
+                    with open(os.path.join(directory, "test.sha256"), 'rb') as digests_file:
+                        self.assertEqual(hashlib.sha256(digests_file.read()).hexdigest(), root["digests_file_sha256"])
+
+    def test_generate_digests(self):
+        use_temporary_directory(self)
+        write_transfers_csv("test.csv", 5)
+        # Files that have not expired yet are not rewritten by incremental runs
+        settings = dict(batch_settings(), digests=True, report="none", expiry=datetime.now() + relativedelta(hours = +2))
+        roots = []
+        for async_write, incremental in [(False, False), (True, False), (False, True), (False, True)]:
+            settings.update(async_write=async_write, incremental=incremental)
+            result = generate_file("test.csv", settings)
+            with open("pre-proposal_test.merkle.json") as root_file:
+                self.assertEqual(json.load(root_file)["root"], result.digest_root)
+            roots.append(result.digest_root)
+        # The last incremental run does not rewrite any file, but records the same digests
+        self.assertEqual(result.unchanged_count, 5)
+        self.assertEqual(len(set(roots)), 1)
+        with open("pre-proposal_test.sha256") as digests_file:
+            lines = digests_file.read().splitlines()
+        expected = []
+        for i in range(1, 6):
+            with open(f"pre-proposal_test_{i:03}.json", 'rb') as json_file:
+                expected.append(f"{hashlib.sha256(json_file.read()).hexdigest()}  pre-proposal_test_{i:03}.json")
+        self.assertEqual(lines, expected)
+        self.assertIn("pre-proposal_test.merkle.json", file_result("test.csv", settings, result)["output_files"])
+
+class TestStageMetrics(unittest.TestCase):
+
+    def test_stages(self):
+        metrics = StageMetrics()
+        double = metrics.timed("double", lambda x: 2*x)
+        self.assertEqual([double(x) for x in metrics.timed_iter("read", range(5))], [0,2,4,6,8])
+        self.assertEqual(metrics.stages["read"][1], 5)
+        self.assertEqual(metrics.stages["double"][1], 5)
+        self.assertRaises(TypeError, double, None)
+        self.assertEqual(metrics.stages["double"][1], 6)
+        self.assertIn("double", metrics.summary())
+
+    def test_write(self):
+        metrics = StageMetrics()
+        list(metrics.timed_iter("csv_read", range(3)))
+        with tempfile.TemporaryDirectory() as directory:
+            metrics.write(os.path.join(directory, "metrics.json"))
+            with open(os.path.join(directory, "metrics.json")) as metrics_file:
+                self.assertEqual(json.load(metrics_file)["stages"]["csv_read"]["calls"], 3)
+            metrics.write(os.path.join(directory, "metrics.prom"))
+            with open(os.path.join(directory, "metrics.prom")) as metrics_file:
+                self.assertIn('proposal_generator_stage_calls_total{stage="csv_read"} 3\n', metrics_file.read())
+            self.assertEqual(sorted(os.listdir(directory)), ["metrics.json", "metrics.prom"])
+
+
+class TestTransferReport(unittest.TestCase):
+
+    def test_duplicates_and_totals(self):
+        a = '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+        b = '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7'
+        report = TransferReport(False)
+        report.add(1, a, b, 10, 90)
+        report.add(2, b, a, 10, 90)
+        report.add(3, a, b, 10, 90)
+        report.add(4, a, b, 20, 90)
+        report.add(5, b, b, TransferAmount.max_amount, 1)
+        self.assertEqual(list(report.duplicate_entries()), [
+            {"row": 3, "first_row": 1, "sender": a, "receiver": b, "type": "exact"},
+            {"row": 4, "first_row": 1, "sender": a, "receiver": b, "type": "near"}
+        ])
+        senders = list(report.sender_entries())
+        self.assertEqual(senders[0], {"sender": a, "transfers": 3, "initial_amount": 40, "remaining_amount": 270, "total_amount": 310, "total_in_range": True})
+        self.assertEqual((senders[1]["transfers"], senders[1]["total_in_range"]), (2, False))
+        self.assertEqual(report.to_json()["distinct_pairs"], 3)
+        #The numbers of duplicates remain once the tables are closed
+        report.close()
+        self.assertEqual((report.duplicate_count(), report.exact_duplicate_count(), len(report.pairs)), (2, 1, 0))
+
+    def test_same_as_parallel(self):
+        rows = [['38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7', f"{1 + i % 3}.000000", "9.000000"] for i in range(25)]
+        serial = TransferReport(False)
+        for row_number, row_data in enumerate(rows, start=1):
+            serial.add_transfer(row_number, parse_row(row_number, row_data, False, '.', ','))
+        parallel = TransferReport(False)
+        job = TestParallelGeneration().get_job()
+        with ProcessPoolExecutor(max_workers=2, initializer=init_worker, initargs=(job,)) as executor:
+            list(iter_proposals_executor(executor, chunked(enumerate(rows, start=1), 4), 2, report=parallel))
+        self.assertEqual(parallel.to_json(), serial.to_json())
+
+    def test_write(self):
+        report = TransferReport(True)
+        report.add(1, "a", "b", 10, 0)
+        report.add(2, "a", "b", 10, 0)
+        with tempfile.TemporaryDirectory() as directory:
+            prefix = os.path.join(directory, "pre-proposal_test")
+            self.assertEqual(report.write(prefix, "json"), [prefix + ".report.json"])
+            with open(prefix + ".report.json") as report_file:
+                self.assertEqual(json.load(report_file), report.to_json())
+            self.assertEqual(report.write(prefix, "csv"), [prefix + ".senders.csv", prefix + ".duplicates.csv"])
+            with open(prefix + ".duplicates.csv") as report_file:
+                self.assertEqual(report_file.read().splitlines(), ["row,first_row,sender,receiver,type", "2,1,a,b,exact"])
+
+    def test_write_json(self):
+        for budget in [None, MemoryBudget(0)]:
+            report = TransferReport(False, budget)
+            with self.subTest(budget=budget):
+                for row_number in range(1, 5):
+                    output = io.StringIO()
+                    report.write_json(output)
+                    self.assertEqual(output.getvalue(), json.dumps(report.to_json(), indent=4))
+                    report.add(row_number, "a", "b", TransferAmount.max_amount, row_number // 3)
+                self.assertEqual([entry["type"] for entry in report.duplicate_entries()], ["exact", "near", "near"])
+                report.close()
+
+class TestSpillingTable(unittest.TestCase):
+
+    def test_spill(self):
+        budget = MemoryBudget(2000)
+        pairs = SpillingTable(["sender", "receiver"], ["row", "amount"], budget)
+        rows = SpillingTable(["row"], ["name"], budget)
+        for i in range(50, 0, -1):
+            pairs[(f"sender{i % 3}", f"receiver{i}")] = (i, -i)
+            if i <= 5:
+                rows[i] = (f"file_{i}.json",)
+        #The table that does not fit into the budget anymore is moved to disk
+        self.assertIsNotNone(pairs.database)
+        self.assertIsNone(rows.database)
+        self.assertEqual(budget.used, rows.reserved)
+        self.assertEqual(list(rows), [1, 2, 3, 4, 5])
+        rows.spill()
+        self.assertEqual(budget.used, 0)
+        for i in range(6, 51):
+            rows[i] = (f"file_{i}.json",)
+        for table in [pairs, rows]:
+            with self.subTest(table.key_columns):
+                self.assertEqual(len(table), 50)
+                keys = list(table)
+                self.assertEqual(keys, sorted(keys))
+        rows[7] = ("changed.json",)
+        self.assertEqual(rows[7], ("changed.json",))
+        self.assertEqual(pairs.get(("sender1", "receiver7")), (7, -7))
+        self.assertNotIn(51, rows)
+        self.assertIsNone(pairs.get(("sender0", "receiver7")))
+        self.assertEqual(list(rows.items())[:2], [(1, ("file_1.json",)), (2, ("file_2.json",))])
+        self.assertEqual(len(rows), 50)
+        small = SpillingTable(["row"], ["name"], budget)
+        small[1] = ("file_1.json",)
+        self.assertGreater(budget.used, 0)
+        for table in [pairs, rows, small]:
+            table.close()
+            self.assertIsNone(table.database)
+            self.assertEqual(len(table), 0)
+        self.assertEqual(budget.used, 0)
+
+class TestCheckMode(unittest.TestCase):
+
+    def test_check_row(self):
+        sender = '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+        receiver = '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7'
+        self.assertEqual(check_row(1, [sender, receiver, "1.000000", "9.000000"], False, '.', ',', 10, 0), [])
+        self.assertEqual(check_row(2, [sender, receiver, "1.000000"], False, '.', ',', 10, 0),
+            [(2, None, "Row must contain exactly 4 entries, but contains 3.")])
+        errors = check_row(3, ["invalid", receiver, "1.0.0", "0.000001"], False, '.', ',', 10, 0)
+        self.assertEqual([(row, column) for (row, column, _) in errors], [(3, 1), (3, 3)])
+        errors = check_row(4, [sender, "invalid", "1.000000", "0.000001"], False, '.', ',', 10, 0)
+        self.assertEqual([(row, column) for (row, column, _) in errors], [(4, 2), (4, 4)])
+        self.assertEqual(check_row(5, [sender, receiver, "1,000.000000"], True, '.', ',', 1, 0), [])
+        # Rows rejected by generation are errors, whatever the schedule
+        self.assertEqual(check_row(6, [sender, receiver, "1.000000", "0.000009"], False, '.', ',', 11, 0),
+            [(6, 4, "Cannot split 9 into 10 parts, amount is too small")])
+        self.assertEqual([(row, column) for (row, column, _) in check_row(7, [sender, receiver, "1.000000", "9.000000"], False, '.', ',', 1, 0)], [(7, None)])
+        self.assertEqual([(row, column) for (row, column, _) in check_row(8, [sender, receiver, "1.000000", "9.000000"], False, '.', ',', 3, 3)], [(8, None)])
+        errors = check_row(9, [sender, receiver, f"{TransferAmount.max_amount // 10**6}.000000", "9.000000"], False, '.', ',', 10, 2)
+        self.assertEqual([(row, column) for (row, column, _) in errors], [(9, 3)])
+        for row_data, num_releases, skipped_releases in [([sender, receiver, "1.000000", "0.000009"], 11, 0), ([sender, receiver, "1.000000", "9.000000"], 1, 0)]:
+            batch = TransferBatch(False)
+            batch.append_row(1, row_data, '.', ',')
+            self.assertRaises(AssertionError, compact_schedule_batch, batch, num_releases, skipped_releases)
+
+    def test_check_file(self):
+        release_time = datetime.combine(date.today(), time.fromisoformat("14:00:00+01:00"))
+        settings = {
+            "is_welcome" : False,
+            "decimal_sep" : '.',
+            "thousands_sep" : ',',
+            "csv_delimiter" : ',',
+            "release_times" : [release_time + relativedelta(months = +i) for i in range(10)],
+            "release_timestamps" : [],
+            "skipped_releases" : 0,
+            "num_releases" : 10,
+            "expiry" : release_time,
+            "expiry_chunks" : None,
+            "indent" : 4,
+            "input_digests" : False,
+            "schedules" : None
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "test.csv")
+            with open(filename, 'w') as csv_file:
+                for i in range(1, 2501):
+                    sender = "invalid" if i % 1000 == 0 else '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+                    csv_file.write(f"{sender},4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,1.000000,{'x' if i == 7 else '9.000000'}\n")
+            with patch('sys.stdout', new=io.StringIO()) as output:
+                self.assertEqual(check_file(filename, settings), (2500, 3))
+            self.assertEqual(output.getvalue().splitlines(), [
+                'Row 7, column 4: "x" is not a valid amount string.',
+                'Row 1000, column 1: Invalid sender address "invalid".',
+                'Row 2000, column 1: Invalid sender address "invalid".'
+            ])
+            with ProcessPoolExecutor(max_workers=2, initializer=init_worker, initargs=(settings,)) as executor:
+                with patch('sys.stdout', new=io.StringIO()) as parallel_output:
+                    self.assertEqual(check_file(filename, settings, executor, 2), (2500, 3))
+            self.assertEqual(parallel_output.getvalue(), output.getvalue())
+
+# Settings of generate_file for welcome transfers released today, writing files next to the csv file.
+def batch_settings():
+    release_time = datetime.combine(date.today(), time.fromisoformat("14:00:00+01:00"))
+    return {
+        "is_welcome" : True,
+        "decimal_sep" : '.',
+        "thousands_sep" : ',',
+        "csv_delimiter" : ',',
+        "release_times" : [release_time],
+        "skipped_releases" : 0,
+        "num_releases" : 1,
+        "expiry" : release_time,
+        "expiry_chunks" : None,
+        "output_format" : "files",
+        "fsync_batch" : 0,
+        "async_write" : False,
+        "write_queue_size" : 16,
+        "incremental" : False,
+        "digests" : False,
+        "compression" : None,
+        "compress_level" : 6,
+        "memory_budget" : None,
+        "dry_run" : False,
+        "report" : "json",
+        "output_dir" : "",
+        "shard" : None,
+        "shard_mode" : "contiguous",
+        "schedules" : None
+    }
+
+# Write a csv file with the given number of rows of valid welcome transfers, where row i has an amount of i GTU.
+def write_transfers_csv(filename, rows):
+    with open(filename, 'w') as csv_file:
+        for i in range(rows):
+            csv_file.write(f"38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,{i+1}.000000\n")
+
+# Run test_case in a new temporary directory, which is removed after the test, as files are generated in the current directory.
+def use_temporary_directory(test_case):
+    directory = tempfile.TemporaryDirectory()
+    test_case.addCleanup(directory.cleanup)
+    test_case.addCleanup(os.chdir, os.getcwd())
+    os.chdir(directory.name)
+
+class TestBatchMode(unittest.TestCase):
+
+    def setUp(self):
+        use_temporary_directory(self)
+
+    def test_expand_input_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ["b.csv", "a.csv", "c.txt"]:
+                open(os.path.join(directory, name), 'w').close()
+            a = os.path.join(directory, "a.csv")
+            b = os.path.join(directory, "b.csv")
+            self.assertEqual(expand_input_files([directory]), [a, b])
+            self.assertEqual(expand_input_files([b, os.path.join(directory, "*.csv")]), [b, a])
+            self.assertRaises(ValueError, expand_input_files, [os.path.join(directory, "*.json")])
+            os.mkdir(os.path.join(directory, "other"))
+            open(os.path.join(directory, "other", "a.csv"), 'w').close()
+            self.assertRaises(ValueError, expand_input_files, [a, os.path.join(directory, "other")])
+
+    def test_generate_files(self):
+        write_transfers_csv("first.csv", 3)
+        write_transfers_csv("second.csv", 12)
+        with open("invalid.csv", 'w') as csv_file:
+            csv_file.write("invalid,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,1.000000\n")
+        with patch('sys.stdout', new=io.StringIO()) as output:
+            exit_code = generate_files(["first.csv", "second.csv", "invalid.csv"], batch_settings(), None, None, 1, 2)
+        self.assertEqual(exit_code, 2)
+        self.assertIn("Processed 3 csv files with 15 transfers. 13 transfers are duplicates. 1 files failed.", output.getvalue())
+        with open("pre-proposal_second.report.json") as report_file:
+            self.assertEqual(json.load(report_file)["near_duplicates"], 11)
+        self.assertEqual(sorted(glob.glob("pre-proposal_first_*.json")), [f"pre-proposal_first_{i:03}.json" for i in range(1, 4)])
+        self.assertEqual(len(glob.glob("pre-proposal_second_*.json")), 12)
+        with open("pre-proposal_second_012.json") as json_file:
+            self.assertEqual(json.load(json_file)["payload"]["schedule"][0]["amount"], 12000000)
+
+    def test_generate_files_unsplittable(self):
+        settings = dict(batch_settings(), is_welcome=False, num_releases=11, report=None)
+        settings["release_times"] = settings["release_times"] * 11
+        with open("valid.csv", 'w') as csv_file:
+            csv_file.write("38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,1.000000,10.000000\n")
+        with open("small.csv", 'w') as csv_file:
+            csv_file.write("38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,1.000000,10.000000\n")
+            csv_file.write("38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,1.000000,0.000009\n")
+        # The remaining amount of row 2 cannot be split into 10 releases, which fails only its file
+        with patch('sys.stdout', new=io.StringIO()) as output:
+            self.assertEqual(generate_files(["small.csv", "valid.csv"], settings, None, None, 1, 2), 2)
+        self.assertIn("small.csv: Error: In row 2: Cannot split 9 into 10 parts, amount is too small", output.getvalue())
+        self.assertIn("Processed 2 csv files with 1 transfers. 1 files failed.", output.getvalue())
+        self.assertTrue(os.path.exists("pre-proposal_valid_001.json"))
+        job = dict(settings, release_timestamps=release_timestamps(settings["release_times"]), indent=4, input_digests=False)
+        with ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(job,)) as executor:
+            with self.assertRaisesRegex(GenerationError, "In row 2: Cannot split 9 into 10 parts") as error:
+                generate_file("small.csv", settings, None, executor, 1)
+        self.assertEqual(error.exception.exit_code, 2)
+
+    def test_generate_file_metrics(self):
+        write_transfers_csv("test.csv", 5)
+        for incremental in [False, True]:
+            with self.subTest(incremental=incremental):
+                metrics = StageMetrics()
+                generate_file("test.csv", dict(batch_settings(), incremental=incremental, report=None), metrics)
+                self.assertEqual(list(metrics.stages), ["csv_read", "address_validation", "amount_parsing", "scheduling", "serialization", "file_write"])
+                #Both addresses of each row are validated
+                self.assertEqual(metrics.stages["address_validation"][1], 10)
+                self.assertEqual(metrics.stages["file_write"][1], 5)
+        with open("pre-proposal_test_005.json") as json_file:
+            self.assertEqual(json.load(json_file)["payload"]["schedule"][0]["amount"], 5000000)
+
+    def test_row_count(self):
+        write_transfers_csv("test.csv", 1000)
+        # Without contiguous shards, rows are counted while they are generated
+        with patch('proposal_generator.count_csv_rows', side_effect=AssertionError("counted")):
+            result = generate_file("test.csv", dict(batch_settings(), report=None))
+        self.assertEqual((result.row_count, result.digits), (1000, 4))
+        self.assertTrue(os.path.exists("pre-proposal_test_0001.json"))
+        with open("lines.csv", 'w', newline='') as csv_file:
+            csv_file.write("a\r\nb\rc\n\nd")
+        self.assertEqual(count_csv_lines("lines.csv"), 5)
+        for mode in ["contiguous", "hashed"]:
+            with self.subTest(mode=mode):
+                result = generate_file("test.csv", dict(batch_settings(), report=None, shard=(2, 3), shard_mode=mode))
+                self.assertEqual((result.row_count, result.digits), (1000, 4))
+
+    def test_expiry_chunks(self):
+        write_transfers_csv("big.csv", 25)
+        settings = batch_settings()
+        settings["expiry_chunks"] = ExpiryChunks(settings["expiry"], 10, 20)
+        result = generate_file("big.csv", settings)
+        first_expiry = int(settings["expiry"].timestamp())
+        self.assertEqual(result.chunk_expiries, [(0, first_expiry), (1, first_expiry + 1800), (2, first_expiry + 3600)])
+        for row_number, expiry in [(1, first_expiry), (10, first_expiry), (11, first_expiry + 1800), (25, first_expiry + 3600)]:
+            with open(f"pre-proposal_big_{row_number:03}.json") as json_file:
+                self.assertEqual(json.load(json_file)["expiry"]["value"], expiry)
+        with open("pre-proposal_big.chunk2.json") as manifest_file:
+            chunk_manifest = json.load(manifest_file)
+        self.assertEqual(chunk_manifest["expiry"], first_expiry + 3600)
+        self.assertEqual(chunk_manifest["row_runs"], [[21, 25]])
+        self.assertEqual(chunk_manifest["proposals"], [f"pre-proposal_big_{i:03}.json" for i in range(21, 26)])
+        self.assertIn("pre-proposal_big.chunk0.json", file_result("big.csv", settings, result)["output_files"])
+
+    def test_incremental_expiry_chunks(self):
+        write_transfers_csv("big.csv", 25)
+        settings = batch_settings()
+        settings["incremental"] = True
+        expiry = datetime.now() + relativedelta(hours = +2)
+        settings["expiry_chunks"] = ExpiryChunks(expiry, 10, 20)
+        first = generate_file("big.csv", settings)
+        #A later run computes a later first expiry, but keeps the one of the manifest
+        settings["expiry_chunks"] = ExpiryChunks(expiry + relativedelta(seconds = +1), 10, 20)
+        job = dict(settings, release_timestamps=release_timestamps(settings["release_times"]), indent=4, input_digests=True)
+        with ProcessPoolExecutor(max_workers=1, initializer=init_worker, initargs=(job,)) as executor:
+            for run_executor in [None, executor]:
+                with self.subTest(parallel=run_executor is not None):
+                    result = generate_file("big.csv", settings, None, run_executor, 1)
+                    self.assertEqual((result.transfer_count, result.unchanged_count), (25, 25))
+                    self.assertEqual(result.chunk_expiries, first.chunk_expiries)
+        with open("pre-proposal_big.manifest") as manifest_file:
+            self.assertEqual(json.loads(manifest_file.readline()), {"first_expiry": int(expiry.timestamp())})
+        #Once the first chunk has expired, all files get the expiries of the new run
+        with open("pre-proposal_big.manifest") as manifest_file:
+            lines = manifest_file.read().splitlines()
+        with open("pre-proposal_big.manifest", 'w') as manifest_file:
+            manifest_file.write("\n".join([json.dumps({"first_expiry": 1})] + lines[1:]) + "\n")
+        result = generate_file("big.csv", settings)
+        self.assertEqual(result.unchanged_count, 0)
+        self.assertEqual(result.chunk_expiries[0][1], int(expiry.timestamp()) + 1)
+
+    def test_hashed_shards(self):
+        (a, b) = ('38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE', '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7')
+        with open("big.csv", 'w') as csv_file:
+            for i in range(1, 101):
+                csv_file.write(f"{a},{b},{i}.000000\n" if i % 3 else f"{b},{a},{i}.000000\n")
+        settings = batch_settings()
+        settings["shard_mode"] = "hashed"
+        rows = []
+        for i in range(1, 3):
+            settings["shard"] = (i, 2)
+            result = generate_file("big.csv", settings)
+            # The rows of hashed shards are not kept, but found again from the csv file
+            self.assertEqual(result.row_runs, [])
+            rows += list(result.row_numbers())
+            self.assertEqual(len(list(result.row_numbers())), result.transfer_count)
+            with open(f"pre-proposal_big.shard-{i}-of-2.json") as manifest_file:
+                self.assertNotIn("row_runs", json.load(manifest_file))
+        self.assertEqual(sorted(rows), list(range(1, 101)))
+        self.assertEqual(check_shards("big.csv"), (100, []))
+        os.remove("pre-proposal_big.shard-2-of-2.json")
+        problems = check_shards("big.csv")[1]
+        self.assertEqual(problems[0], "Missing shards 2 of 2.")
+        self.assertIn("are not in any shard.", problems[1])
+
+    def test_shards_carriage_returns(self):
+        with open("mac.csv", 'w', newline='') as csv_file:
+            for i in range(4):
+                csv_file.write(f"38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,{i+1}.000000\r")
+        settings = batch_settings()
+        for i in range(1, 3):
+            settings["shard"] = (i, 2)
+            self.assertEqual(generate_file("mac.csv", settings).row_runs, [[2*i - 1, 2*i]])
+        with patch('sys.stdout', new=io.StringIO()) as output:
+            self.assertEqual(merge_shards(["mac.csv"]), 0)
+        self.assertEqual(output.getvalue(), "All 4 rows are in exactly one shard, and all shards can be merged.\n")
+
+    def test_shards(self):
+        write_transfers_csv("big.csv", 1200)
+        settings = batch_settings()
+        for i in range(1, 4):
+            settings["shard"] = (i, 3)
+            result = generate_file("big.csv", settings)
+            self.assertEqual(result.row_runs, [[400*i - 399, 400*i]])
+        self.assertEqual(sorted(glob.glob("pre-proposal_big_*.json")), [f"pre-proposal_big_{i:04}.json" for i in range(1, 1201)])
+        with open("pre-proposal_big_0401.json") as json_file:
+            self.assertEqual(json.load(json_file)["payload"]["schedule"][0]["amount"], 401000000)
+        with patch('sys.stdout', new=io.StringIO()) as output:
+            self.assertEqual(merge_shards(["big.csv"]), 0)
+        self.assertEqual(output.getvalue(), "All 1200 rows are in exactly one shard, and all shards can be merged.\n")
+
+        os.remove("pre-proposal_big.shard-2-of-3.json")
+        settings["shard"] = (1, 2)
+        generate_file("big.csv", settings)
+        self.assertEqual(check_shards("big.csv")[1], [
+            "Shard manifests differ in shards, so they were not generated from the same csv file with the same options."])
+        os.remove("pre-proposal_big.shard-1-of-2.json")
+        self.assertEqual(check_shards("big.csv")[1], [
+            "Missing shards 2 of 3.",
+            "Rows 401-800 are not in any shard."])
+        os.remove("pre-proposal_big_0002.json")
+        self.assertEqual(check_shards("big.csv")[1][-1], "Pre-proposal files of rows 2 are missing.")
+
+class TestVerify(unittest.TestCase):
+    sender = '38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE'
+    receiver = '4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7'
+
+    def get_settings(self, directory, output_format):
+        initial_release_time = datetime.fromisoformat("2030-01-15T14:00:00+01:00")
+        schedule = ReleaseSchedule(5, initial_release_time, initial_release_time + relativedelta(months = +1))
+        # The earliest release skips the first remaining release
+        schedule_book = ScheduleBook({"default": schedule}, "default", False, date(2030, 3, 1))
+        return dict(batch_settings(),
+            is_welcome=False,
+            release_times=schedule_book.default().release_times,
+            skipped_releases=schedule_book.default().skipped_releases,
+            num_releases=5,
+            output_format=output_format,
+            output_dir=directory,
+            report="none",
+            schedule_book=schedule_book)
+
+    def test_release_amounts(self):
+        for (initial_amount, remaining_amount) in [(1, 9), (5, 1000001), (10**12, 7)]:
+            for skipped_releases in range(5):
+                amounts = amounts_to_scheduled_list(TransferAmount(initial_amount), TransferAmount(remaining_amount), 5, skipped_releases)
+                self.assertEqual(release_amounts(initial_amount, remaining_amount, 5, skipped_releases), [amount.amount for amount in amounts])
+        #Same errors as generation
+        self.assertRaisesRegex(AssertionError, "too small", release_amounts, 1, 3, 5, 0)
+        self.assertRaisesRegex(AssertionError, "Cannot split into 0 parts", release_amounts, 1, 3, 1, 0)
+        self.assertRaisesRegex(ValueError, "not in valid range", release_amounts, TransferAmount.max_amount, 8, 5, 1)
+
+    def test_verify_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "test.csv")
+            with open(filename, 'w') as csv_file:
+                for i in range(1, 1201):
+                    csv_file.write(f"{self.sender},{self.receiver},{i}.000000,{i + 100}.000000\n")
+            for output_format, compression in [("files", None), ("jsonl", None), ("zip", None), ("files", "gzip"), ("tar", "xz"), ("zip", "gzip")]:
+                with self.subTest(output_format, compression=compression):
+                    settings = dict(self.get_settings(directory, output_format), compression=compression)
+                    generate_file(filename, settings)
+                    with patch('sys.stdout', new=io.StringIO()) as output:
+                        self.assertEqual(verify_file(filename, settings), (1200, 0))
+                    self.assertEqual(output.getvalue(), "")
+
+            settings = self.get_settings(directory, "files")
+            with open(os.path.join(directory, "pre-proposal_test_0007.json"), 'r+') as json_file:
+                content = json.load(json_file)
+                content["payload"]["schedule"][1]["amount"] += 1
+                content["payload"]["schedule"][0]["amount"] -= 1
+                json_file.seek(0)
+                json.dump(content, json_file)
+                json_file.truncate()
+            os.remove(os.path.join(directory, "pre-proposal_test_0010.json"))
+            with open(os.path.join(directory, "pre-proposal_test_1201.json"), 'w') as json_file:
+                json_file.write("{}")
+            with patch('sys.stdout', new=io.StringIO()) as output:
+                self.assertEqual(verify_file(filename, settings), (1200, 3))
+            lines = output.getvalue().splitlines()
+            self.assertRegex(lines[0], "^Row 7: Release amounts .* are not split as by the schedule")
+            self.assertEqual(lines[1:], [
+                f'Row 10: Pre-proposal file "{os.path.join(directory, "pre-proposal_test_0010.json")}" is missing.',
+                "Found 1 pre-proposals without csv row, of rows 1201."])
+            with ProcessPoolExecutor(max_workers=2, initializer=init_worker, initargs=(settings,)) as executor:
+                with patch('sys.stdout', new=io.StringIO()) as parallel_output:
+                    self.assertEqual(verify_file(filename, settings, executor, 2), (1200, 3))
+            self.assertEqual(parallel_output.getvalue(), output.getvalue())
+
+    def test_verify_proposal(self):
+        schedule_book = self.get_settings("", "files")["schedule_book"]
+        schedule = schedule_book.default()
+        row = [self.sender, self.receiver, "1.000000", "100.000000"]
+        releases = list(zip([26000000, 25000000, 25000000, 25000000], schedule.timestamps))
+        self.assertEqual(schedule.timestamps[1:], schedule.planned_timestamps[1:])
+        content = pre_proposal_json(self.sender, self.receiver, 0, releases)
+        self.assertEqual(verify_proposal(1, row, content, False, '.', ',', schedule_book), [])
+        #Generated on a later day, when another release is skipped
+        later_releases = [(51000000, schedule.planned_timestamps[2] - 1000)] + releases[2:]
+        content = pre_proposal_json(self.sender, self.receiver, 0, later_releases)
+        self.assertEqual(verify_proposal(1, row, content, False, '.', ',', schedule_book), [])
+        content = pre_proposal_json(self.receiver, self.receiver, 0, [(26000000, schedule.planned_timestamps[1] + 1000)] + releases[1:])
+        self.assertEqual(verify_proposal(1, row, content, False, '.', ',', schedule_book), [
+            f'Sender "{self.receiver}" differs from "{self.sender}" in the csv file.',
+            f"First release at {schedule.planned_timestamps[1] + 1000} is not between the initial release, the skipped releases and the remaining releases of the schedule."])
+        self.assertEqual(verify_proposal(1, row[:3], content, False, '.', ',', schedule_book)[0][:17], "Invalid csv row: ")
+        self.assertEqual(verify_proposal(1, row, "{", False, '.', ',', schedule_book), ["Invalid pre-proposal json."])
+
+class TestShard(unittest.TestCase):
+
+    def test_contiguous(self):
+        shards = [Shard(i, 3, row_count=10) for i in range(1, 4)]
+        self.assertEqual([[row for row in range(1, 11) if shard.contains(row, [])] for shard in shards], [[1, 2, 3], [4, 5, 6], [7, 8, 9, 10]])
+        self.assertEqual([shard.overlaps(3, 2) for shard in shards], [True, True, False])
+        #The last shard takes all rows beyond the counted rows
+        self.assertEqual([shard.contains(11, []) for shard in shards], [False, False, True])
+
+    def test_hashed(self):
+        shards = [Shard(i, 4, hashed=True, row_count=100) for i in range(1, 5)]
+        rows = [(i, [f"sender{i % 7}", f"receiver{i % 10}", "1.000000"]) for i in range(1, 101)]
+        for row_number, row_data in rows:
+            self.assertEqual(sum(shard.contains(row_number, row_data) for shard in shards), 1)
+            #All transfers between the same accounts are in the same shard
+            self.assertEqual([shard.contains(row_number, row_data) for shard in shards], [shard.contains(row_number % 70 + 1, row_data) for shard in shards])
+        self.assertTrue(all(any(shard.contains(*row) for row in rows) for shard in shards))
+
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("2/5"), (2, 5))
+        for argument in ["0/5", "6/5", "2", "a/b"]:
+            self.assertRaises(argparse.ArgumentTypeError, parse_shard, argument)
+
+    def test_row_number_digits(self):
+        self.assertEqual([row_number_digits(rows) for rows in [0, 999, 1000, 123456]], [3, 3, 4, 6])
+
+class TestDaemon(unittest.TestCase):
+
+    def test_requests(self):
+        config = get_config()
+        with tempfile.TemporaryDirectory() as directory:
+            socket_path = os.path.join(directory, "test.sock")
+            server = ProposalServer(socket_path, config, build_argument_parser(config))
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                with open(os.path.join(directory, "test.csv"), 'w') as csv_file:
+                    csv_file.write("38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,1.000000\n")
+                    csv_file.write("38Dh9TwGWCieKppVu3ft91bjPvpyt7hWWNdFTRz9P3CCdvYHjE,4QbKSwdnF1PTtN6LqdTfmUt7FQDTToxFVV746ysy7TazZy4zx7,2.000000\n")
+                os.mkdir(os.path.join(directory, "out"))
+                response = send_request(socket_path, {"input_csv": ["test.csv"], "welcome": True, "output_dir": "out", "arguments": ["--report", "none"], "cwd": directory})
+                self.assertEqual(response["exit_code"], 0)
+                self.assertEqual(response["output"], ["Successfully generated 2 proposals."])
+                [result] = response["files"]
+                self.assertEqual(result["transfers"], 2)
+                self.assertEqual(result["output_files"], [os.path.join(directory, "out", f"pre-proposal_test_00{i}.json") for i in [1, 2]])
+                with open(result["output_files"][1]) as json_file:
+                    self.assertEqual(json.load(json_file)["payload"]["schedule"][0]["amount"], 2000000)
+
+                #Scheduled transfers need 4 columns
+                response = send_request(socket_path, {"arguments": ["test.csv", "--check"], "cwd": directory})
+                self.assertEqual(response["exit_code"], 2)
+                self.assertEqual(response["output"][0], "Row 1: Row must contain exactly 4 entries, but contains 3.")
+                response = send_request(socket_path, {"arguments": ["--jobs"], "cwd": directory})
+                self.assertEqual(response["exit_code"], 2)
 
+                #Unexpected errors are returned to the client, and the daemon keeps serving requests
+                with patch('proposal_generator.pre_proposal_json', side_effect=RuntimeError("unexpected")):
+                    response = send_request(socket_path, {"input_csv": ["test.csv"], "welcome": True, "output_dir": "out",
+                        "arguments": ["--report", "none", "--async-write"], "cwd": directory})
+                self.assertEqual(response["exit_code"], 1)
+                self.assertEqual(response["output"], ["Error: RuntimeError: unexpected"])
+                self.assertEqual([thread.name for thread in threading.enumerate() if thread.name == "BackgroundWriter"], [])
+                response = send_request(socket_path, {"input_csv": ["test.csv"], "welcome": True, "output_dir": "out", "arguments": ["--report", "none"], "cwd": directory})
+                self.assertEqual(response["exit_code"], 0)
+            finally:
+                server.shutdown()
+                server.server_close()
 
 class TestMain(unittest.TestCase):
 
@@ -265,7 +1459,7 @@ class TestMain(unittest.TestCase):
                 "amount" : TransferAmount(1000000000)
             }
         ]
-        arguments = argparse.Namespace(welcome=True, input_csv='./test.csv')
+        arguments = argparse.Namespace(welcome=True, input_csv=['./test.csv'], jobs=1, check=False, verify=False, report='none', output_format='files', output_dir=None, concurrent_files=4, async_write=False, write_queue_size=1024, fsync_batch=0, incremental=False, digests=False, compress=None, compress_level=6, memory_budget=None, expiry_chunk=None, signing_rate=None, dry_run=False, profile=False, metrics_file=None, tracemalloc=False, cprofile=None, shard=None, shard_mode='contiguous', merge_shards=False, schedules=None, schedule_column=False, serve=None)
         config = {
 		"num_releases" : 10,
 		"welcome_release_time" : time1,
@@ -297,11 +1491,10 @@ class TestMain(unittest.TestCase):
         #Mock various calls
         with patch('proposal_generator.get_config', return_value=config) as get_fake_config:
             with patch('argparse.ArgumentParser.parse_args', return_value=arguments) as fake_args:
-                with patch('proposal_generator.csv_to_list',return_value=transfers) as fake_csv:
+                with patch('proposal_generator.iter_transfers',return_value=iter(transfers)) as fake_csv, patch('proposal_generator.count_csv_lines', return_value=len(transfers)):
                     with patch('builtins.open', new=mock_open()) as mock_file: 
-                        with patch('json.dump', new=mock_open()) as mock_call:
-                            main()
-                            mock_call.assert_called_once_with(expected_content, mock_file(),indent=4)
+                        main()
+                        mock_file().write.assert_called_once_with(json.dumps(expected_content, indent=4))
                            
     def test_valid_transfer(self):
         time1 = datetime.combine(date.today(), time.fromisoformat("14:00:00+01:00")) + relativedelta(months =- 3)
@@ -314,7 +1507,7 @@ class TestMain(unittest.TestCase):
                 "remaining_amount" : TransferAmount(10)
             }
         ]
-        arguments = argparse.Namespace(welcome=False, input_csv='./test.csv')
+        arguments = argparse.Namespace(welcome=False, input_csv=['./test.csv'], jobs=1, check=False, verify=False, report='none', output_format='files', output_dir=None, concurrent_files=4, async_write=False, write_queue_size=1024, fsync_batch=0, incremental=False, digests=False, compress=None, compress_level=6, memory_budget=None, expiry_chunk=None, signing_rate=None, dry_run=False, profile=False, metrics_file=None, tracemalloc=False, cprofile=None, shard=None, shard_mode='contiguous', merge_shards=False, schedules=None, schedule_column=False, serve=None)
         config = {
 		"num_releases" : 10,
 		"welcome_release_time" : datetime.fromisoformat("1970-08-26T14:00:00+01:00"),
@@ -348,11 +1541,10 @@ class TestMain(unittest.TestCase):
         #Mock various calls
         with patch('proposal_generator.get_config', return_value=config) as get_fake_config:
             with patch('argparse.ArgumentParser.parse_args', return_value=arguments) as fake_args:
-                with patch('proposal_generator.csv_to_list',return_value=transfers) as fake_csv:
+                with patch('proposal_generator.iter_transfers',return_value=iter(transfers)) as fake_csv, patch('proposal_generator.count_csv_lines', return_value=len(transfers)):
                     with patch('builtins.open', new=mock_open()) as mock_file: 
-                        with patch('json.dump', new=mock_open()) as mock_call:
-                            main()
-                            mock_call.assert_called_once_with(expected_content, mock_file(),indent=4)
+                        main()
+                        mock_file().write.assert_called_once_with(json.dumps(expected_content, indent=4))
 
 if __name__ == '__main__':
     unittest.main()